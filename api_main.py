@@ -1,14 +1,19 @@
-from fastapi import FastAPI
+import os
 
-from src.api.dtos import CosineSearchDto
-from src.cosine_similarity import build_cos_similarity_model
+from src.cosine_similarity import build_cos_similarity_model, load_cos_similarity_model
 from src.logging import logger_factory
 from src.preprocessing.metacritic_preprocessing import deserialize_unpreprocessed_metacritic_reviews, preprocess_reviews
 from src.preprocessing.preprocessor import metacritic_preprocessor
 from src.api.api import start_api
+from src.sharded_index import sharded_idx_exists
+from src.sparse_tf_idf import sparse_idx_exists
 
 logger = logger_factory.get_logger(__name__)
 
+# Directory with the index built via build_index.py
+# (use serve.py to serve the index from multiple processes sharing one copy of it)
+INDEX_DIR_PATH = 'resources/index'
+
 
 def get_documents():
     """
@@ -20,39 +25,21 @@ def get_documents():
     unpreproc_docs = deserialize_unpreprocessed_metacritic_reviews(metacritic_documents_path)
 
     logger.info('Preprocessing documents')
-    return preprocess_reviews(unpreproc_docs, metacritic_preprocessor)
+    return preprocess_reviews(unpreproc_docs, metacritic_preprocessor, workers=os.cpu_count())
 
 
 logger.info('Starting the application')
 
-metacritic_reviews = get_documents()
-logger.info('Documents loaded, building cosine similarity model')
-cos_model = build_cos_similarity_model(metacritic_reviews, metacritic_preprocessor)
+if sparse_idx_exists(INDEX_DIR_PATH) or sharded_idx_exists(INDEX_DIR_PATH):
+    logger.info(f'Loading index from {INDEX_DIR_PATH}')
+    cos_model = load_cos_similarity_model(INDEX_DIR_PATH, metacritic_preprocessor)
+else:
+    logger.info(f'Index not found in {INDEX_DIR_PATH}, building it from the documents (use build_index.py)')
+    metacritic_reviews = get_documents()
+    logger.info('Documents loaded, building cosine similarity model')
+    cos_model = build_cos_similarity_model(metacritic_reviews, metacritic_preprocessor)
 
 logger.info('Starting the API')
 
-app = FastAPI()
-
-MAX_SEARCH_ITEMS = 10_000
-
-port = 8000
-
-
-@app.get("/")
-def root():
-    return {"message": "Hello World"}
-
-
-@app.post("/cosine_search/")
-def cosine_search(cosine_search_req: CosineSearchDto):
-    if cosine_search_req.limit > MAX_SEARCH_ITEMS:
-        return {'success': False,
-                'message': f'Requested limit ({cosine_search_req.limit}) exceeds maximum ({MAX_SEARCH_ITEMS})'}
-
-    search_results = cos_model.get_top_n_documents(cosine_search_req.query, cosine_search_req.limit)
-    return search_results
-
-
-logger.info(f'Starting API server on http://localhost:{port}')
-
-app.setup()
\ No newline at end of file
+app = start_api(cos_model)
+app.setup()
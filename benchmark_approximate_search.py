@@ -0,0 +1,57 @@
+import os
+import time
+
+import numpy as np
+
+from src.cosine_similarity import CosineSimilaritySearch
+from src.document import Document
+from src.logging import logger_factory
+from src.preprocessing.metacritic_preprocessing import deserialize_unpreprocessed_metacritic_reviews, preprocess_reviews
+from src.preprocessing.preprocessor import metacritic_preprocessor
+from src.sparse_tf_idf import create_sparse_tfidf_idx
+
+# Benchmark of the approximate search over the impact-ordered index - recall of the exact top n and latency
+# for several posting budgets. Metacritic reviews are used if they were downloaded, otherwise a synthetic corpus
+
+logger = logger_factory.get_logger(__name__)
+
+
+def get_documents():
+    unpreprocessed_file_path = 'resources/unpreprocessed_reviews.json'
+    if os.path.exists(unpreprocessed_file_path):
+        logger.info('Loading and preprocessing metacritic reviews')
+        return preprocess_reviews(deserialize_unpreprocessed_metacritic_reviews(unpreprocessed_file_path),
+                                  metacritic_preprocessor, workers=os.cpu_count())
+
+    logger.info('Generating synthetic corpus')
+    rng = np.random.default_rng(42)
+    vocabulary = ['best', 'game', 'ever'] + [f'term{i}' for i in range(20_000)]
+    term_probs = 1 / np.arange(1, len(vocabulary) + 1)
+    term_probs /= term_probs.sum()
+    return [Document(doc_id, [vocabulary[term_id] for term_id in rng.choice(len(vocabulary), size=rng.integers(5, 80),
+                                                                               p=term_probs)])
+            for doc_id in range(50_000)]
+
+
+documents = get_documents()
+sparse_idx = create_sparse_tfidf_idx(documents)
+exact_search = CosineSimilaritySearch(sparse_idx, documents, metacritic_preprocessor)
+impact_search = CosineSimilaritySearch(sparse_idx.to_impact_ordered(), documents, metacritic_preprocessor)
+
+n = 10
+queries = ['best game ever', 'this deserves way higher user score. this game is absolute masterpiece.',
+           'it only looks good, thats all', 'game term1 term50 term3000']
+for max_postings in [1_000, 5_000, 20_000, None]:
+    recalls, times = [], []
+    for query in queries:
+        exact_scores = [score for score, _ in exact_search.get_top_n_documents(query, n)]
+        if not exact_scores:
+            continue
+        start = time.perf_counter()
+        results = impact_search.get_top_n_documents(query, n, approximate=True, max_postings=max_postings)
+        times.append(time.perf_counter() - start)
+        # Documents are compared by their score since many documents can share the same score
+        recalls.append(sum(score >= exact_scores[-1] - 1e-6 for score, _ in results) / len(exact_scores))
+
+    print(f'max postings {str(max_postings):>6}: recall@{n} {np.mean(recalls):.2f}, '
+          f'mean latency {np.mean(times) * 1000:.2f} ms')
@@ -0,0 +1,75 @@
+import os
+import shutil
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from src.logging import logger_factory
+from src.metacritic_review_do import MetacriticReviewDocument
+from src.preprocessing.metacritic_preprocessing import deserialize_preprocessed_reviews, \
+    deserialize_unpreprocessed_metacritic_reviews, preprocess_reviews, serialize_preprocessed_reviews
+from src.preprocessing.preprocessed_corpus import load_preprocessed_corpus, save_preprocessed_corpus
+from src.preprocessing.preprocessor import metacritic_preprocessor
+
+# Benchmark of the binary columnar corpus format against the indented json of the preprocessed reviews -
+# file size and reload time. Metacritic reviews are used if they were downloaded, otherwise a synthetic corpus
+
+logger = logger_factory.get_logger(__name__)
+
+
+def get_documents():
+    unpreprocessed_file_path = 'resources/unpreprocessed_reviews.json'
+    if os.path.exists(unpreprocessed_file_path):
+        logger.info('Loading and preprocessing metacritic reviews')
+        return preprocess_reviews(deserialize_unpreprocessed_metacritic_reviews(unpreprocessed_file_path),
+                                  metacritic_preprocessor, workers=os.cpu_count())
+
+    logger.info('Generating synthetic corpus')
+    rng = np.random.default_rng(42)
+    vocabulary = np.array([f'term{i}' for i in range(20_000)])
+    term_probs = 1 / np.arange(1, len(vocabulary) + 1)
+    term_probs /= term_probs.sum()
+    documents = []
+    for doc_id in range(50_000):
+        words = vocabulary[rng.choice(len(vocabulary), size=rng.integers(5, 80), p=term_probs)].tolist()
+        documents.append(MetacriticReviewDocument(doc_id, words, f'game{doc_id % 500}', f'reviewer{doc_id % 7000}',
+                                                  datetime(2020, 1, 1) + timedelta(days=doc_id % 700),
+                                                  float(doc_id % 100), ' '.join(words), doc_id % 3 == 0))
+    return documents
+
+
+def get_dir_size(dir_path) -> int:
+    return sum(os.path.getsize(os.path.join(dir_path, file_name)) for file_name in os.listdir(dir_path))
+
+
+documents = get_documents()
+tmp_dir_path = tempfile.mkdtemp()
+try:
+    json_file_path = os.path.join(tmp_dir_path, 'preprocessed.json')
+    corpus_dir_path = os.path.join(tmp_dir_path, 'corpus')
+    serialize_preprocessed_reviews(documents, json_file_path)
+    save_preprocessed_corpus(documents, corpus_dir_path)
+
+    start = time.perf_counter()
+    json_documents = deserialize_preprocessed_reviews(json_file_path)
+    json_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    corpus = load_preprocessed_corpus(corpus_dir_path)
+    load_time = time.perf_counter() - start
+    corpus_documents = list(corpus)
+    corpus_time = time.perf_counter() - start
+
+    assert [document.tokens for document in json_documents] == [document.tokens for document in corpus_documents]
+    assert [document.text for document in json_documents] == [document.text for document in corpus_documents]
+
+    json_size, corpus_size = os.path.getsize(json_file_path), get_dir_size(corpus_dir_path)
+    print(f'Documents: {len(documents)}')
+    print(f'Json:   {json_size / 2 ** 20:8.2f} MiB, reload {json_time:.3f} s')
+    print(f'Binary: {corpus_size / 2 ** 20:8.2f} MiB, reload {load_time:.3f} s '
+          f'({corpus_time:.3f} s including creation of all documents)')
+    print(f'Size ratio: {json_size / corpus_size:.1f}x, reload speedup: {json_time / corpus_time:.1f}x')
+finally:
+    shutil.rmtree(tmp_dir_path)
@@ -0,0 +1,84 @@
+import gc
+import os
+import pickle
+import tracemalloc
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from src.logging import logger_factory
+from src.metacritic_review_do import MetacriticReviewDocument
+from src.preprocessing.metacritic_preprocessing import deserialize_unpreprocessed_metacritic_reviews
+from src.preprocessing.preprocessor import metacritic_preprocessor
+from src.tf_idf import create_inverted_tfidf_idx
+
+# Benchmark of the memory used by the documents and the object-graph inverted index (traced Python allocations).
+# Metacritic reviews are used if they were downloaded, otherwise a synthetic corpus with Zipfian term distribution
+
+logger = logger_factory.get_logger(__name__)
+
+
+def get_reviews() -> list:
+    """
+    Returns tokens and metadata of the reviews, the documents are created from them
+    """
+    unpreprocessed_file_path = 'resources/unpreprocessed_reviews.json'
+    if os.path.exists(unpreprocessed_file_path):
+        logger.info('Loading and preprocessing metacritic reviews')
+        reviews = deserialize_unpreprocessed_metacritic_reviews(unpreprocessed_file_path)
+        tokens = metacritic_preprocessor.get_processed_tokens_batch([review.text for review in reviews],
+                                                                    workers=os.cpu_count())
+        return [(review_tokens, review.game_name, review.reviewer_name, review.date_reviewed, review.score,
+                 review.text, review.is_critic_review)
+                for review, review_tokens in zip(reviews, tokens) if review_tokens is not None]
+
+    logger.info('Generating synthetic corpus')
+    rng = np.random.default_rng(42)
+    vocabulary = np.array([f'term{i}' for i in range(20_000)])
+    term_probs = 1 / np.arange(1, len(vocabulary) + 1)
+    term_probs /= term_probs.sum()
+    reviews = []
+    for doc_id in range(50_000):
+        words = vocabulary[rng.choice(len(vocabulary), size=rng.integers(5, 80), p=term_probs)].tolist()
+        reviews.append((words, f'game{doc_id % 500}', f'reviewer{doc_id % 7000}',
+                        datetime(2020, 1, 1) + timedelta(days=doc_id % 700), float(doc_id % 100), ' '.join(words),
+                        doc_id % 3 == 0))
+    return reviews
+
+
+def measure(fn):
+    """
+    Returns result of the function and the number of bytes it allocated and did not release
+    """
+    gc.collect()
+    tracemalloc.start()
+    result = fn()
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, size
+
+
+# Reviews are unpickled while the memory is traced, so each review has its own strings as if it was just loaded
+pickled_reviews = pickle.dumps(get_reviews(), protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def create_documents():
+    return [MetacriticReviewDocument(doc_id, *review) for doc_id, review in enumerate(pickle.loads(pickled_reviews))]
+
+
+documents, documents_size = measure(create_documents)
+inverted_idx, inverted_idx_size = measure(lambda: create_inverted_tfidf_idx(documents))
+postings = sum(term_stats.df for term_stats in inverted_idx.values())
+del inverted_idx, documents
+
+# Tokens are dropped while the index is built, so the released tokens are subtracted from the size
+documents = create_documents()
+_, dropped_tokens_idx_size = measure(lambda: create_inverted_tfidf_idx(documents, drop_tokens=True))
+
+print(f'Documents: {len(documents)}, postings: {postings}')
+print(f'Documents: {documents_size / 2 ** 20:.2f} MiB ({documents_size / len(documents):.1f} B/document)')
+print(f'Object-graph index: {inverted_idx_size / 2 ** 20:.2f} MiB '
+      f'({inverted_idx_size / postings:.1f} B/posting)')
+print(f'Object-graph index with dropped tokens: {dropped_tokens_idx_size / 2 ** 20:.2f} MiB '
+      f'({dropped_tokens_idx_size / postings:.1f} B/posting)')
@@ -0,0 +1,30 @@
+import os
+
+from src.logging import logger_factory
+from src.preprocessing.metacritic_preprocessing import deserialize_unpreprocessed_metacritic_reviews, preprocess_reviews
+from src.preprocessing.preprocessor import metacritic_preprocessor
+from src.sparse_tf_idf import SparseTfIdfIndex, get_memory_report
+from src.tf_idf import create_inverted_tfidf_idx
+
+# Script comparing memory used by the object-graph inverted index and the compact sparse index
+
+logger = logger_factory.get_logger(__name__)
+
+unpreprocessed_file_path = 'resources/unpreprocessed_reviews.json'
+if not os.path.exists(unpreprocessed_file_path):
+    raise FileNotFoundError(f'{unpreprocessed_file_path} does not exist, run metacritic_convert_raw_to_processed.py')
+
+logger.info('Loading and preprocessing metacritic reviews')
+metacritic_reviews = preprocess_reviews(deserialize_unpreprocessed_metacritic_reviews(unpreprocessed_file_path),
+                                        metacritic_preprocessor)
+
+logger.info('Building indexes')
+inverted_idx = create_inverted_tfidf_idx(metacritic_reviews)
+sparse_idx = SparseTfIdfIndex.from_inverted_idx(inverted_idx)
+
+report = get_memory_report(inverted_idx, sparse_idx)
+print(f'Documents: {sparse_idx.total_docs}, terms: {len(sparse_idx)}, postings: {report["postings"]}')
+print(f'Object-graph index: {report["inverted_idx_bytes"] / 2 ** 20:.2f} MiB '
+      f'({report["inverted_idx_bytes_per_posting"]:.1f} B/posting)')
+print(f'Sparse index: {report["sparse_idx_bytes"] / 2 ** 20:.2f} MiB '
+      f'({report["sparse_idx_bytes_per_posting"]:.1f} B/posting)')
@@ -0,0 +1,64 @@
+import os
+import time
+
+import numpy as np
+
+from src.cosine_similarity import CosineSimilaritySearch
+from src.document import Document
+from src.logging import logger_factory
+from src.max_score import max_score_top_n
+from src.preprocessing.metacritic_preprocessing import deserialize_unpreprocessed_metacritic_reviews, preprocess_reviews
+from src.preprocessing.preprocessor import metacritic_preprocessor
+from src.sparse_tf_idf import create_sparse_tfidf_idx
+
+# Benchmark of MaxScore dynamic pruning against exhaustive term-at-a-time scoring on the sparse index.
+# Metacritic reviews are used if they were downloaded, otherwise a synthetic corpus with Zipfian term distribution
+
+logger = logger_factory.get_logger(__name__)
+
+
+def get_documents():
+    unpreprocessed_file_path = 'resources/unpreprocessed_reviews.json'
+    if os.path.exists(unpreprocessed_file_path):
+        logger.info('Loading and preprocessing metacritic reviews')
+        return preprocess_reviews(deserialize_unpreprocessed_metacritic_reviews(unpreprocessed_file_path),
+                                  metacritic_preprocessor, workers=os.cpu_count())
+
+    logger.info('Generating synthetic corpus')
+    rng = np.random.default_rng(42)
+    vocabulary = ['best', 'game', 'ever'] + [f'term{i}' for i in range(20_000)]
+    term_probs = 1 / np.arange(1, len(vocabulary) + 1)
+    term_probs /= term_probs.sum()
+    return [Document(doc_id, [vocabulary[term_id] for term_id in rng.choice(len(vocabulary), size=rng.integers(5, 80),
+                                                                               p=term_probs)])
+            for doc_id in range(50_000)]
+
+
+documents = get_documents()
+sparse_idx = create_sparse_tfidf_idx(documents)
+exhaustive_search = CosineSimilaritySearch(sparse_idx, documents, metacritic_preprocessor, use_max_score=False)
+max_score_search = CosineSimilaritySearch(sparse_idx, documents, metacritic_preprocessor, use_max_score=True)
+
+queries = ['best game ever', 'this deserves way higher user score. this game is absolute masterpiece.',
+           'it only looks good, thats all', 'game term1 term50 term3000']
+for query in queries:
+    for n in [10, 100]:
+        compiled_query = exhaustive_search.compile_query(query)
+        if compiled_query.is_empty:
+            continue
+
+        stats = {}
+        max_score_top_n(sparse_idx, compiled_query.get_term_weights(), compiled_query.norm, n, stats)
+
+        start = time.perf_counter()
+        exhaustive_results = exhaustive_search.get_top_n_documents(query, n)
+        exhaustive_time = time.perf_counter() - start
+        start = time.perf_counter()
+        max_score_results = max_score_search.get_top_n_documents(query, n)
+        max_score_time = time.perf_counter() - start
+
+        assert np.allclose([score for score, _ in exhaustive_results], [score for score, _ in max_score_results],
+                           atol=1e-6), f'Results differ for query: {query}'
+        print(f'{query[:40]!r:44} n={n:<4} postings {stats["postings"]:>8}, evaluated {stats["evaluated_postings"]:>8} '
+              f'({stats["evaluated_postings"] / max(stats["postings"], 1):.1%}), '
+              f'exhaustive {exhaustive_time * 1000:.2f} ms, max score {max_score_time * 1000:.2f} ms')
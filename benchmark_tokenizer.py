@@ -0,0 +1,79 @@
+import json
+import os
+import string
+import timeit
+from collections import Counter
+
+import regex as re
+
+from src.preprocessing.tokenizer import Tokenizer
+
+# Microbenchmark of the single-pass tokenizer against the original per-word, four-regex implementation.
+# Both tokenizers must produce the same tokens on the bundled documents
+
+
+class PerWordTokenizer:
+    """
+    Original tokenizer - splits text by spaces and runs each regex over each word
+    """
+
+    DEFAULT_REGEX = r'(\d+[.,](\d+)?)|([\p{L}\d]+)|(<.*?>)|([\p{Punct}])'
+    URL_REGEX = r'(https?:\/\/(?:www\.|(?!www))[a-zA-Z0-9][a-zA-Z0-9-]+[a-zA-Z0-9]\.[^\s]{2,}|www\.[a-zA-Z0-9][' \
+                r'a-zA-Z0-9-]+[a-zA-Z0-9]\.[^\s]{2,}|https?:\/\/(?:www\.|(?!www))[a-zA-Z0-9]+\.[^\s]{2,' \
+                r'}|www\.[a-zA-Z0-9]+\.[^\s]{2,})/ '
+    CENSORED_REGEX = r'[\w+À-ž]+\*[\w+À-ž]*|[\w+À-ž]*\*[\w+À-ž]+'
+    DATE_REGEX = r'\d{1,2}\.\s?\d{1,2}\.\s*\d{0,4}'
+    BASIC_LATIN_CHARACTERS = r'[\p{IsCyrillic}\p{Han}\p{Hiragana}\p{Katakana}\u0600-\u06FF]'
+
+    def __init__(self):
+        self.regexes = [self.DEFAULT_REGEX, self.URL_REGEX, self.CENSORED_REGEX, self.DATE_REGEX]
+
+    def tokenize(self, text, remove_punctuation):
+        text = re.sub(self.BASIC_LATIN_CHARACTERS, '', text)
+        if remove_punctuation:
+            text = text.translate(str.maketrans('', '', string.punctuation))
+
+        tokens = []
+        split_by_ws = text.split(' ')
+        for regex in self.regexes:
+            for text_by_ws in split_by_ws:
+                for group in re.findall(regex, text_by_ws):
+                    if type(group) == tuple:
+                        tokens.extend(item for item in group if item != '')
+                    elif group != '':
+                        tokens.append(group)
+        return tokens
+
+
+def load_texts():
+    texts = []
+    for file_path in ['resources/czech_documents.json', 'resources/english_documents.json']:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            texts.extend(document['text'] for document in json.load(f))
+
+    # Metacritic reviews are used if they were downloaded
+    if os.path.exists('resources/unpreprocessed_reviews.json'):
+        with open('resources/unpreprocessed_reviews.json', 'r', encoding='utf-8') as f:
+            texts.extend(review['text'] for review in json.load(f))
+    return texts
+
+
+texts = load_texts()
+tokenizer, per_word_tokenizer = Tokenizer(), PerWordTokenizer()
+
+for remove_punctuation in [False, True]:
+    for text in texts:
+        expected, actual = per_word_tokenizer.tokenize(text, remove_punctuation), \
+            tokenizer.tokenize(text, remove_punctuation)
+        assert Counter(expected) == Counter(actual), f'Tokens differ for text: {text}'
+        # Without punctuation only words remain, so even the order is the same
+        assert not remove_punctuation or expected == actual, f'Order of tokens differs for text: {text}'
+
+    repeat = max(1, 20_000 // len(texts))
+    per_word_time = timeit.timeit(lambda: [per_word_tokenizer.tokenize(text, remove_punctuation) for text in texts],
+                                  number=repeat)
+    single_pass_time = timeit.timeit(lambda: [tokenizer.tokenize(text, remove_punctuation) for text in texts],
+                                     number=repeat)
+    print(f'remove_punctuation={remove_punctuation}: per-word {per_word_time / repeat * 1000:.2f} ms, '
+          f'single-pass {single_pass_time / repeat * 1000:.2f} ms per {len(texts)} texts '
+          f'({per_word_time / single_pass_time:.1f}x speedup)')
@@ -0,0 +1,51 @@
+import os
+import sys
+
+from src.cosine_similarity import build_and_save_cos_similarity_model, build_cos_similarity_model, \
+    save_cos_similarity_model
+from src.logging import logger_factory
+from src.preprocessing.metacritic_preprocessing import iter_preprocessed_reviews, iter_unpreprocessed_metacritic_reviews
+from src.preprocessing.preprocessed_corpus import load_preprocessed_corpus, preprocessed_corpus_exists
+from src.preprocessing.preprocessor import metacritic_preprocessor
+
+# Script to build binary index from the unpreprocessed reviews, the index is then loaded by api_main.py
+# Reviews (json array or json lines) are streamed through preprocessing into the index, so the memory is bounded
+# by the size of the postings instead of the size of the corpus
+# Usage: python build_index.py [unpreprocessed reviews path] [index directory] [--impact-ordered] [--shards=N]
+#        [--tf-weighting=raw|log|augmented|bm25]
+# Directory of the preprocessed corpus (see metacritic_convert_raw_to_processed.py) can be passed instead
+# of the unpreprocessed reviews, preprocessing is then skipped
+# With --impact-ordered postings are ordered by their impact, which suits the approximate search
+# With --shards=N documents are partitioned into N shards, each searched by its own process
+# With --tf-weighting term frequencies are weighted by the given scheme instead of log term frequency
+
+logger = logger_factory.get_logger(__name__)
+
+args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+unpreprocessed_file_path = args[0] if len(args) > 0 else 'resources/unpreprocessed_reviews.json'
+index_dir_path = args[1] if len(args) > 1 else 'resources/index'
+impact_ordered = '--impact-ordered' in sys.argv
+shards = next((int(arg.split('=')[1]) for arg in sys.argv if arg.startswith('--shards=')), None)
+tf_weighting = next((arg.split('=')[1] for arg in sys.argv if arg.startswith('--tf-weighting=')), 'log')
+
+if preprocessed_corpus_exists(unpreprocessed_file_path):
+    logger.info(f'Indexing preprocessed reviews from {unpreprocessed_file_path}')
+    metacritic_reviews = iter(load_preprocessed_corpus(unpreprocessed_file_path))
+else:
+    logger.info(f'Preprocessing and indexing reviews from {unpreprocessed_file_path}')
+    unpreprocessed_reviews = iter_unpreprocessed_metacritic_reviews(unpreprocessed_file_path)
+    metacritic_reviews = iter_preprocessed_reviews(unpreprocessed_reviews, metacritic_preprocessor,
+                                                   workers=os.cpu_count())
+
+if shards is None:
+    build_and_save_cos_similarity_model(metacritic_reviews, index_dir_path, impact_ordered=impact_ordered,
+                                        tf_weighting=tf_weighting)
+else:
+    # Shard workers are started with their documents, so the documents are held in memory
+    cos_model = build_cos_similarity_model(list(metacritic_reviews), metacritic_preprocessor, shards=shards,
+                                           tf_weighting=tf_weighting)
+    logger.info(f'Saving index to {index_dir_path}')
+    save_cos_similarity_model(cos_model, index_dir_path)
+    cos_model.tf_idf_inverted_idx.close()
+
+logger.info(f'Index saved to {index_dir_path}')
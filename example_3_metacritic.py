@@ -26,10 +26,10 @@ query3 = 'it only looks good, thats all. it can\'t be seemed as real cyberpunk k
 
 query4 = 'best game ever'
 
-# Search top 10 for each query
-for query in [query1, query2, query3, query4]:
+# Search top 10 for each query, all queries are scored at once
+queries = [query1, query2, query3, query4]
+for query, results in zip(queries, cos_similarity.get_top_n_documents_batch(queries, 10)):
     print('Query: ', query)
     print('Top 10 results:')
-    results = cos_similarity.get_top_n_documents(query, 10)
     for cos_sim, result in results:
         print(cos_sim, result)
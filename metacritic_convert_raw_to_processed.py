@@ -1,34 +1,32 @@
 import logging
+import os
 
 from src.logging import logger_factory
-from src.preprocessing.metacritic_preprocessing import load_metacritic_reviews, preprocess_reviews, \
-    serialize_preprocessed_reviews, serialize_unpreprocessed_metacritic_reviews
+from src.preprocessing.metacritic_preprocessing import iter_metacritic_reviews, iter_preprocessed_reviews, \
+    iter_unpreprocessed_metacritic_reviews, serialize_unpreprocessed_metacritic_reviews
+from src.preprocessing.preprocessed_corpus import save_preprocessed_corpus
 from src.preprocessing.preprocessor import metacritic_preprocessor
 
 # Script to convert rawdata.json to processed data
+# Reviews are streamed from file to file, so the whole dataset is never held in memory
 
 logger = logger_factory.get_logger(__name__)
 
-logger.info('Loading metacritic reviews')
+logger.info('Loading metacritic reviews and saving them unpreprocessed')
 raw_file_path = 'resources/rawdata.json'
-metacritic_reviews = load_metacritic_reviews(raw_file_path)
-
-# Save mapped reviews to file
-logger.info('Saving unpreprocessed metacritic reviews')
 unpreprocessed_file_path = 'resources/unpreprocessed_reviews.json'
-serialize_unpreprocessed_metacritic_reviews(metacritic_reviews, unpreprocessed_file_path)
+serialize_unpreprocessed_metacritic_reviews(iter_metacritic_reviews(raw_file_path), unpreprocessed_file_path)
 
 
 logger.info('Preprocessing metacritic reviews')
 # Preprocess them
 metacritic_preprocessor.config.recognize_lang = True  # enable language recognition
-preprocessed_reviews = preprocess_reviews(metacritic_reviews, metacritic_preprocessor)
-
-logger.info('Serializing preprocessed reviews')
+preprocessed_reviews = iter_preprocessed_reviews(iter_unpreprocessed_metacritic_reviews(unpreprocessed_file_path),
+                                                 metacritic_preprocessor, workers=os.cpu_count())
 
-# Serialize documents to new json file
-preprocessed_file_path = 'resources/preprocessed_metacritic.json'
+# Save documents in the binary corpus format as they are preprocessed (can be passed to build_index.py)
+preprocessed_dir_path = 'resources/preprocessed_metacritic'
 
-serialize_preprocessed_reviews(preprocessed_reviews, preprocessed_file_path)
+save_preprocessed_corpus(preprocessed_reviews, preprocessed_dir_path)
 
-logger.info('Preprocessed data saved to {}'.format(preprocessed_file_path))
+logger.info('Preprocessed data saved to {}'.format(preprocessed_dir_path))
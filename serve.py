@@ -0,0 +1,93 @@
+import gc
+import os
+import signal
+import socket
+import sys
+
+import uvicorn
+
+from src.api.api import port, start_api
+from src.api.search_executor import SearchExecutor
+from src.cosine_similarity import build_cos_similarity_model, load_cos_similarity_model, save_cos_similarity_model
+from src.logging import logger_factory
+from src.preprocessing.metacritic_preprocessing import deserialize_unpreprocessed_metacritic_reviews, preprocess_reviews
+from src.preprocessing.preprocessor import metacritic_preprocessor
+from src.sharded_index import sharded_idx_exists
+from src.sparse_tf_idf import sparse_idx_exists
+
+# Multi-process serving of the API over one shared index
+# The parent process builds the index (only if it does not exist yet) and loads it memory-mapped, then it forks
+# the workers, which serve requests from one shared listening socket. Pages of the mapped index files are shared
+# by all workers via OS page cache and the Python objects of the model are shared copy-on-write,
+# so memory stays flat as the number of workers grows
+# Usage: python serve.py [number of workers] [index directory] [unpreprocessed reviews path]
+
+logger = logger_factory.get_logger(__name__)
+
+workers = int(sys.argv[1]) if len(sys.argv) > 1 else os.cpu_count()
+index_dir_path = sys.argv[2] if len(sys.argv) > 2 else 'resources/index'
+unpreprocessed_file_path = sys.argv[3] if len(sys.argv) > 3 else 'resources/unpreprocessed_reviews.json'
+
+
+def build_index():
+    logger.info(f'Index not found in {index_dir_path}, building it from {unpreprocessed_file_path}')
+    unpreprocessed_reviews = deserialize_unpreprocessed_metacritic_reviews(unpreprocessed_file_path)
+    metacritic_reviews = preprocess_reviews(unpreprocessed_reviews, metacritic_preprocessor, workers=os.cpu_count())
+    save_cos_similarity_model(build_cos_similarity_model(metacritic_reviews, metacritic_preprocessor, sparse_idx=True),
+                              index_dir_path)
+
+
+def run_worker(cos_model, sock: socket.socket):
+    # Threads and locks of the API (executor, caches) are created after the fork, CPUs are split among the workers
+    app = start_api(cos_model, search_executor=SearchExecutor(workers=max(1, os.cpu_count() // workers)))
+    uvicorn.Server(uvicorn.Config(app, log_level='info')).run(sockets=[sock])
+
+
+if not sparse_idx_exists(index_dir_path) and not sharded_idx_exists(index_dir_path):
+    build_index()
+
+logger.info(f'Loading index from {index_dir_path}')
+cos_model = load_cos_similarity_model(index_dir_path, metacritic_preprocessor)
+
+if cos_model.is_sharded_idx:
+    # Shards are already searched by their own processes, connections to them cannot be shared by forked workers
+    workers = 1
+else:
+    # Lazy initialized arrays are created before the fork, so the workers share them instead of creating their own
+    _ = cos_model.tf_idf_inverted_idx.inv_doc_norms
+# Objects of the model are moved to the permanent generation, so the garbage collector of the workers does not
+# write to their pages (which would copy them to each worker)
+gc.freeze()
+
+sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+sock.bind(('0.0.0.0', port))
+sock.listen(2048)
+sock.set_inheritable(True)
+
+if not hasattr(os, 'fork') or workers <= 1:
+    logger.info(f'Starting single worker on http://localhost:{port}')
+    run_worker(cos_model, sock)
+    sys.exit(0)
+
+worker_pids = []
+for _ in range(workers):
+    pid = os.fork()
+    if pid == 0:
+        run_worker(cos_model, sock)
+        os._exit(0)
+    worker_pids.append(pid)
+
+logger.info(f'Started {workers} workers on http://localhost:{port}')
+
+
+def stop_workers(signum, frame):
+    for worker_pid in worker_pids:
+        os.kill(worker_pid, signal.SIGTERM)
+
+
+signal.signal(signal.SIGINT, stop_workers)
+signal.signal(signal.SIGTERM, stop_workers)
+for worker_pid in worker_pids:
+    os.waitpid(worker_pid, 0)
+logger.info('All workers stopped')
@@ -1,31 +1,221 @@
+import time
+
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse, Response
 
-from src.api.dtos import CosineSearchDto
+from src.api.dtos import CosineSearchDto, CosineBatchSearchDto, AddReviewsDto, DeleteDocumentsDto
+from src.api.query_cache import QueryResultCache, get_query_key
+from src.api.search_executor import ExecutorOverloadedError, QueueTimeoutError, SearchExecutor
+from src.api.serialization import create_json_response, get_invalid_fields, serialize_results
+from src.compiled_query import CompiledQuery
 from src.cosine_similarity import CosineSimilaritySearch
+from src.instrumentation import instrumentation
 from src.logging import logger_factory
+from src.preprocessing.metacritic_preprocessing import MetacriticReview, preprocess_reviews
 
 MAX_SEARCH_ITEMS = 10_000
+MAX_BATCH_QUERIES = 1_000
+# Minimum number of ranked documents cached for a query, the ranking is extended at least twice when a deeper
+# page is requested, so paging through the results rescores the query only a few times
+MIN_RANKING_SIZE = 100
+# Compiled queries are small, so their cache is much smaller than the cache of the rankings
+COMPILED_QUERY_CACHE_BYTES = 4 * 1024 * 1024
 
 logger = logger_factory.get_logger(__name__)
 port = 8000
 
 
-def start_api(cos_sim_model: CosineSimilaritySearch):
+def start_api(cos_sim_model: CosineSimilaritySearch, query_cache: QueryResultCache = None,
+              search_executor: SearchExecutor = None, metrics=True, compiled_query_cache: QueryResultCache = None):
+    """
+    Creates the API
+    :param cos_sim_model: cosine similarity model
+    :param query_cache: cache of the search results, default cache is created if not passed
+    :param compiled_query_cache: cache of the compiled queries by the query text, kept apart from the results
+                                 so the queries neither evict the rankings nor skew their hit ratio.
+                                 Default cache is created if not passed
+    :param search_executor: executor of the search requests, default executor is created if not passed
+    :param metrics: if True, stages of all searches are timed and exported by the /metrics endpoint, otherwise
+                    only the requests asking for the profile are timed
+    :return: FastAPI app
+    """
     app = FastAPI()
+    instrumentation.enabled = metrics
+    query_cache = query_cache if query_cache is not None else QueryResultCache()
+    compiled_query_cache = compiled_query_cache if compiled_query_cache is not None else \
+        QueryResultCache(max_bytes=COMPILED_QUERY_CACHE_BYTES)
+    search_executor = search_executor if search_executor is not None else SearchExecutor()
 
     # Sample test endpoint
     @app.get("/")
     def root():
         return {"message": "Hello World"}
 
+    def get_compiled_query(query_text: str) -> CompiledQuery:
+        """
+        Returns the query compiled against the index. Compiled queries are cached, so the following pages
+        of the same query are neither preprocessed nor weighted again
+        """
+        query = compiled_query_cache.get(query_text)
+        if query is None:
+            generation = compiled_query_cache.generation
+            query = cos_sim_model.compile_query(query_text)
+            compiled_query_cache.put(query_text, query, generation)
+        return query
+
+    def get_ranking(cosine_search_req: CosineSearchDto, n: int):
+        """
+        Returns at least n best documents of the query (fewer only if there are no more matching documents).
+        Rankings are cached, so consecutive pages of the same query are only sliced from the cached ranking
+        """
+        # Generation is read before the query is compiled, so a ranking of the index changed meanwhile is not cached
+        generation = query_cache.generation
+        # Query is compiled only once, the compiled query is both the cache key and the search input
+        query = get_compiled_query(cosine_search_req.query)
+        cache_key = get_query_key(query, cosine_search_req.approximate, cosine_search_req.max_postings,
+                                  cosine_search_req.time_budget_ms)
+        cached_ranking = query_cache.get(cache_key)
+        if cached_ranking is not None:
+            ranking, is_complete = cached_ranking
+            if len(ranking) >= n or is_complete:
+                instrumentation.count('cache_hits')
+                return ranking
+            n = max(n, 2 * len(ranking))
+        instrumentation.count('cache_misses')
+
+        n = min(max(n, MIN_RANKING_SIZE), MAX_SEARCH_ITEMS)
+        ranking = cos_sim_model.get_top_n_documents_for_query(
+            query, n, approximate=cosine_search_req.approximate, max_postings=cosine_search_req.max_postings,
+            time_budget_ms=cosine_search_req.time_budget_ms)
+        # Ranking with fewer than n documents contains all matching documents
+        query_cache.put(cache_key, (ranking, len(ranking) < n), generation)
+        return ranking
+
     @app.post("/cosine_search/")
-    def cosine_search(cosine_search_req: CosineSearchDto):
-        if cosine_search_req.limit > MAX_SEARCH_ITEMS:
+    async def cosine_search(cosine_search_req: CosineSearchDto):
+        if cosine_search_req.offset < 0:
+            return {'success': False, 'message': f'Offset ({cosine_search_req.offset}) must not be negative'}
+
+        if cosine_search_req.offset + cosine_search_req.limit > MAX_SEARCH_ITEMS:
+            return {'success': False,
+                    'message': f'Requested offset and limit ({cosine_search_req.offset} + {cosine_search_req.limit}) '
+                               f'exceed maximum ({MAX_SEARCH_ITEMS})'}
+
+        if get_invalid_fields(cosine_search_req.fields):
+            return {'success': False,
+                    'message': f'Fields {get_invalid_fields(cosine_search_req.fields)} cannot be requested'}
+
+        return await submit_search(search, cosine_search_req)
+
+    def search(cosine_search_req: CosineSearchDto):
+        end = cosine_search_req.offset + cosine_search_req.limit
+        search_results = get_ranking(cosine_search_req, end)[cosine_search_req.offset:end]
+        with instrumentation.stage('serialization'):
+            return create_json_response(serialize_results(search_results, cosine_search_req.fields))
+
+    @app.post("/cosine_search/batch/")
+    async def cosine_search_batch(cosine_batch_search_req: CosineBatchSearchDto):
+        if cosine_batch_search_req.limit > MAX_SEARCH_ITEMS:
+            return {'success': False,
+                    'message': f'Requested limit ({cosine_batch_search_req.limit}) exceeds maximum '
+                               f'({MAX_SEARCH_ITEMS})'}
+
+        if len(cosine_batch_search_req.queries) > MAX_BATCH_QUERIES:
             return {'success': False,
-                    'message': f'Requested limit ({cosine_search_req.limit}) exceeds maximum ({MAX_SEARCH_ITEMS})'}
+                    'message': f'Number of queries ({len(cosine_batch_search_req.queries)}) exceeds maximum '
+                               f'({MAX_BATCH_QUERIES})'}
+
+        if get_invalid_fields(cosine_batch_search_req.fields):
+            return {'success': False,
+                    'message': f'Fields {get_invalid_fields(cosine_batch_search_req.fields)} cannot be requested'}
+
+        return await submit_search(search_batch, cosine_batch_search_req)
+
+    def search_batch(cosine_batch_search_req: CosineBatchSearchDto):
+        batch_results = cos_sim_model.get_top_n_documents_batch(cosine_batch_search_req.queries,
+                                                                cosine_batch_search_req.limit)
+        with instrumentation.stage('serialization'):
+            return create_json_response([serialize_results(search_results, cosine_batch_search_req.fields)
+                                         for search_results in batch_results])
+
+    async def submit_search(search_fn, search_req):
+        """
+        Runs the search in the search executor, requests are rejected if the executor is overloaded
+        """
+        try:
+            return await search_executor.submit(run_search, search_fn, search_req, time.perf_counter())
+        except ExecutorOverloadedError as e:
+            return JSONResponse({'success': False, 'message': str(e)}, status_code=429, headers={'Retry-After': '1'})
+        except QueueTimeoutError as e:
+            return JSONResponse({'success': False, 'message': str(e)}, status_code=503, headers={'Retry-After': '1'})
+
+    def run_search(search_fn, search_req, submitted_at: float):
+        """
+        Runs the search in the worker thread of the executor and times the whole request, if the request asks for
+        the profile, the durations of its stages are returned in the Server-Timing header
+        """
+        with instrumentation.profile(search_req.profile) as profile:
+            instrumentation.record('queue_wait', time.perf_counter() - submitted_at)
+            with instrumentation.stage('search_request'):
+                response = search_fn(search_req)
+        if profile is not None:
+            response.headers['Server-Timing'] = profile.get_server_timing()
+        return response
+
+    @app.post("/documents/")
+    def add_reviews(add_reviews_req: AddReviewsDto):
+        reviews = [MetacriticReview(**review.dict()) for review in add_reviews_req.reviews]
+        documents = preprocess_reviews(reviews, cos_sim_model.preprocessor)
+        try:
+            cos_sim_model.add_documents(documents)
+        except ValueError as e:
+            return {'success': False, 'message': str(e)}
+        finally:
+            invalidate_caches()
+
+        return {'success': True, 'doc_ids': [document.doc_id for document in documents]}
+
+    @app.post("/documents/delete/")
+    def delete_documents(delete_documents_req: DeleteDocumentsDto):
+        try:
+            cos_sim_model.delete_documents(delete_documents_req.doc_ids)
+        except ValueError as e:
+            return {'success': False, 'message': str(e)}
+        finally:
+            invalidate_caches()
+
+        return {'success': True}
+
+    def invalidate_caches():
+        # Both the rankings and the query weights (idf) depend on the indexed documents
+        query_cache.invalidate()
+        compiled_query_cache.invalidate()
+
+    @app.get("/cache/stats/")
+    def cache_stats():
+        return {**query_cache.get_stats(), 'compiled_queries': compiled_query_cache.get_stats()}
+
+    @app.get("/executor/stats/")
+    def executor_stats():
+        return search_executor.get_stats()
 
-        search_results = cos_sim_model.get_top_n_documents(cosine_search_req.query, cosine_search_req.limit)
-        return search_results
+    @app.get("/metrics")
+    def metrics_endpoint():
+        """
+        Returns the metrics in Prometheus text format. Each process of serve.py has its own metrics, so the workers
+        should be scraped one by one (or served by a single worker) to get metrics of all requests
+        """
+        cache_stats, executor_stats = query_cache.get_stats(), search_executor.get_stats()
+        counters = {'search_cache_evictions_total': cache_stats['evictions'],
+                    'search_cache_invalidations_total': cache_stats['invalidations'],
+                    'search_executor_completed_total': executor_stats['completed'],
+                    'search_executor_rejected_total': executor_stats['rejected'],
+                    'search_executor_timed_out_total': executor_stats['timed_out']}
+        gauges = {'search_cache_entries': cache_stats['size'], 'search_cache_bytes': cache_stats['bytes'],
+                  'search_executor_queue_depth': executor_stats['queue_depth'],
+                  'search_executor_running': executor_stats['running']}
+        return Response(instrumentation.get_prometheus_text(counters, gauges), media_type='text/plain; version=0.0.4')
 
     logger.info(f'Starting API server on http://localhost:{port}')
 
+    return app
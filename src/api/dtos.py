@@ -1,7 +1,44 @@
-from pydantic import BaseModel
+from datetime import datetime
+from typing import List, Optional
+
+from pydantic import BaseModel, conint
 
 
 class CosineSearchDto(BaseModel):
     query: str
-    limit: int = 10
+    # Negative limit is rejected by validation (422), it would turn the requested page into a reversed slice
+    limit: conint(ge=0) = 10
     offset: int = 0
+    # Approximate search returns the best documents found within the budget (None means no limit)
+    approximate: bool = False
+    max_postings: Optional[int] = None
+    time_budget_ms: Optional[float] = None
+    # Stored fields of the documents returned with the results under "fields" (e.g. gameName, text), by default
+    # only ids and scores
+    fields: List[str] = []
+    # Durations of the search stages are returned in the Server-Timing header of the response
+    profile: bool = False
+
+
+class CosineBatchSearchDto(BaseModel):
+    queries: List[str]
+    limit: conint(ge=0) = 10
+    fields: List[str] = []
+    profile: bool = False
+
+
+class MetacriticReviewDto(BaseModel):
+    game_name: str
+    reviewer_name: str
+    date_reviewed: datetime
+    score: float
+    text: str
+    is_critic_review: bool
+
+
+class AddReviewsDto(BaseModel):
+    reviews: List[MetacriticReviewDto]
+
+
+class DeleteDocumentsDto(BaseModel):
+    doc_ids: List[int]
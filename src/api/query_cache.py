@@ -0,0 +1,140 @@
+# Cache of the search results in the API layer
+# Queries are keyed by their compiled queries, so differently worded queries that preprocess to the same terms
+# (e.g. different case, punctuation or word forms) share one entry
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Hashable
+
+from src.compiled_query import CompiledQuery
+
+
+def get_object_size(obj, seen: set = None) -> int:
+    """
+    Estimates size of the object in bytes including all objects it references. Objects referenced multiple times
+    are counted once
+    :param obj: object
+    :param seen: ids of already counted objects
+    :return: estimated size in bytes
+    """
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(get_object_size(key, seen) + get_object_size(value, seen) for key, value in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(get_object_size(item, seen) for item in obj)
+    else:
+        if hasattr(obj, '__dict__'):
+            size += get_object_size(obj.__dict__, seen)
+        # Attributes of the slotted objects (e.g. documents)
+        for cls in type(obj).__mro__:
+            slots = getattr(cls, '__slots__', ())
+            for slot in [slots] if isinstance(slots, str) else slots:
+                if hasattr(obj, slot):
+                    size += get_object_size(getattr(obj, slot), seen)
+    return size
+
+
+def get_query_key(query: CompiledQuery, *params) -> tuple:
+    """
+    Creates cache key from the compiled query and the search parameters, differently written queries with
+    the same compiled query (e.g. different word order or inflection) share the cached results
+    """
+    return (query.key,) + params
+
+
+class QueryResultCache:
+    """
+    Bounded cache of search results with least recently used eviction and time to live of the entries.
+    Size of the cache is limited by the estimated number of bytes of the cached results
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, ttl_seconds=300.0):
+        """
+        :param max_bytes: maximum estimated size of all cached results in bytes
+        :param ttl_seconds: time after which an entry expires, None for no expiration
+        """
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        # Incremented by invalidate, results calculated before the invalidation are not cached (see put)
+        self.generation = 0
+        self._items = OrderedDict()  # key -> (expiration time, size in bytes, results)
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable):
+        """
+        Returns cached results for the key, None if the key is not cached or the entry expired
+        """
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None and item[0] is not None and item[0] <= time.monotonic():
+                self._remove(key)
+                item = None
+
+            if item is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._items.move_to_end(key)
+            return item[2]
+
+    def put(self, key: Hashable, results, generation: int = None):
+        """
+        Caches the results, least recently used entries are evicted if the cache is full. Results larger than
+        the whole cache are not cached
+        :param generation: generation of the cache read before the results were calculated, the results are
+                           dropped if the cache was invalidated since (they may be calculated from the old index)
+        """
+        size = get_object_size(key) + get_object_size(results)
+        if size > self.max_bytes:
+            return
+
+        expiration = time.monotonic() + self.ttl_seconds if self.ttl_seconds is not None else None
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            if key in self._items:
+                self._remove(key)
+            self._items[key] = (expiration, size, results)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                self._remove(next(iter(self._items)))
+                self.evictions += 1
+
+    def invalidate(self):
+        """
+        Removes all entries, must be called whenever the index changes
+        """
+        with self._lock:
+            self._items.clear()
+            self.bytes = 0
+            self.invalidations += 1
+            self.generation += 1
+
+    def _remove(self, key):
+        _, size, _ = self._items.pop(key)
+        self.bytes -= size
+
+    @property
+    def hit_ratio(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups > 0 else 0.0
+
+    def get_stats(self) -> dict:
+        return {'size': len(self._items), 'bytes': self.bytes, 'max_bytes': self.max_bytes, 'hits': self.hits,
+                'misses': self.misses, 'hit_ratio': self.hit_ratio, 'evictions': self.evictions,
+                'invalidations': self.invalidations}
+
+    def __len__(self):
+        return len(self._items)
@@ -0,0 +1,99 @@
+# Bounded executor for the search requests
+# Scoring is CPU heavy, so it runs in a dedicated, sized pool of threads (numpy releases the GIL during
+# the vectorized scoring) instead of the event loop or the default unbounded threadpool. Number of waiting requests
+# is limited, requests over the limit are rejected immediately and requests that waited too long are dropped,
+# so the latency stays bounded under overload
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class ExecutorOverloadedError(Exception):
+    """
+    Raised when the queue of the executor is full
+    """
+    pass
+
+
+class QueueTimeoutError(Exception):
+    """
+    Raised when the request waited in the queue longer than allowed
+    """
+    pass
+
+
+class SearchExecutor:
+    """
+    Runs search requests in a bounded pool of worker threads and collects queue metrics
+    """
+
+    def __init__(self, workers: int = None, max_queue_size=64, max_wait_ms=1000.0):
+        """
+        :param workers: number of worker threads, number of CPUs if not passed
+        :param max_queue_size: maximum number of requests waiting for a worker
+        :param max_wait_ms: maximum time a request can wait for a worker, None for no limit
+        """
+        self.workers = workers if workers is not None else os.cpu_count()
+        self.max_queue_size = max_queue_size
+        self.max_wait_ms = max_wait_ms
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='search')
+        self._lock = threading.Lock()
+
+        self.queued = 0  # requests waiting for a worker
+        self.running = 0
+        self.started = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.total_wait_ms = 0.0
+        self.max_observed_wait_ms = 0.0
+
+    async def submit(self, fn, *args):
+        """
+        Runs the function in a worker thread and waits for its result without blocking the event loop
+        :param fn: function to run
+        :param args: arguments of the function
+        :return: result of the function
+        :raises ExecutorOverloadedError: if the queue is full
+        :raises QueueTimeoutError: if the request waited in the queue for too long
+        """
+        with self._lock:
+            if self.queued >= self.max_queue_size:
+                self.rejected += 1
+                raise ExecutorOverloadedError(f'Search queue is full ({self.max_queue_size} requests)')
+            self.queued += 1
+
+        return await asyncio.get_running_loop().run_in_executor(self._executor, self._run, fn, args,
+                                                                time.perf_counter())
+
+    def _run(self, fn, args, submitted_at: float):
+        wait_ms = (time.perf_counter() - submitted_at) * 1000
+        with self._lock:
+            self.queued -= 1
+            self.started += 1
+            self.total_wait_ms += wait_ms
+            self.max_observed_wait_ms = max(self.max_observed_wait_ms, wait_ms)
+            if self.max_wait_ms is not None and wait_ms > self.max_wait_ms:
+                # The client is likely gone or retrying already, so the request is not processed
+                self.timed_out += 1
+                raise QueueTimeoutError(f'Request waited {wait_ms:.0f} ms in the search queue')
+            self.running += 1
+
+        try:
+            return fn(*args)
+        finally:
+            with self._lock:
+                self.running -= 1
+                self.completed += 1
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {'workers': self.workers, 'max_queue_size': self.max_queue_size, 'queue_depth': self.queued,
+                    'running': self.running, 'completed': self.completed, 'rejected': self.rejected,
+                    'timed_out': self.timed_out, 'max_wait_ms': self.max_observed_wait_ms,
+                    'mean_wait_ms': self.total_wait_ms / self.started if self.started > 0 else 0.0}
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
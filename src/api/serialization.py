@@ -0,0 +1,68 @@
+# Compact serialization of the search results
+# Each result is serialized as {"doc_id": ..., "score": ..., "fields": {<requested fields>}}, so the (large) tokens
+# and text of the documents are only sent if the client asks for them. Requested fields are kept apart from
+# the doc_id and score of the result, so they cannot overwrite them (e.g. score of the review)
+from typing import List, Tuple
+
+import numpy as np
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response
+
+from src.document import Document
+from src.metacritic_review_do import MetacriticReviewDocument
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Fields which can be requested - stored fields of all document types
+REQUESTABLE_FIELDS = frozenset(Document.STORED_FIELDS + MetacriticReviewDocument.STORED_FIELDS)
+
+
+def get_invalid_fields(fields: List[str]) -> List[str]:
+    """
+    Returns fields that cannot be requested - fields not stored by any document type
+    """
+    return [field for field in fields if field not in REQUESTABLE_FIELDS]
+
+
+def to_python(value):
+    """
+    Converts numpy values to the Python ones, which can be encoded without orjson
+    """
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def serialize_results(results: List[Tuple[float, Document]], fields: List[str]) -> List[dict]:
+    """
+    Converts search results to plain dictionaries
+    :param results: list of tuples of score and document
+    :param fields: stored fields of the documents included in the results (see get_invalid_fields), fields
+                   not stored by the type of the document are None
+    :return: list of dictionaries with doc_id, score and the requested fields (only if any are requested)
+    """
+    serialized_results = []
+    for score, document in results:
+        serialized_result = {'doc_id': to_python(document.doc_id), 'score': float(score)}
+        if fields:
+            stored_fields = type(document).STORED_FIELDS
+            serialized_result['fields'] = {field: to_python(getattr(document, field)) if field in stored_fields
+                                           else None for field in fields}
+        serialized_results.append(serialized_result)
+    return serialized_results
+
+
+def create_json_response(content) -> Response:
+    """
+    Creates response serialized via orjson if it is installed, content must only contain dictionaries, lists
+    and primitive values (including datetime), so the slow recursive jsonable_encoder is skipped. Without orjson
+    the content is encoded by FastAPI
+    """
+    if orjson is not None:
+        return Response(orjson.dumps(content, option=orjson.OPT_SERIALIZE_NUMPY), media_type='application/json')
+    return JSONResponse(jsonable_encoder(content))
@@ -0,0 +1,52 @@
+# Module for the queries compiled against the index
+# Query is preprocessed and weighted once per request, the compiled query is then passed to the scoring backend
+# (any index type, exact or approximate search), which does not touch the query text or the vocabulary again
+from typing import Dict, List, Optional
+
+import numpy as np
+
+
+class CompiledQuery:
+    """
+    Distinct indexed terms of the query with their tf-idf weights and the norm of the query vector.
+    Compiled query only holds values, so it can be cached and reused by the following pages of the same query
+    (weights depend on the idf, so the cached queries must be dropped when the index is updated)
+    """
+
+    __slots__ = ('terms', 'term_ids', 'weights', 'norm')
+
+    def __init__(self, terms: List[str], term_ids: Optional[np.ndarray], weights: np.ndarray):
+        """
+        Initializes the compiled query
+        :param terms: distinct indexed terms of the query
+        :param term_ids: ids of the terms in the index, None for indexes which address the terms by their strings
+        :param weights: tf-idf weights of the terms
+        """
+        self.terms = terms
+        self.term_ids = term_ids
+        self.weights = weights
+        self.norm = float(np.linalg.norm(weights))
+
+    def __len__(self):
+        return len(self.terms)
+
+    @property
+    def is_empty(self) -> bool:
+        """
+        Returns True if no document can match the query (it has no indexed term)
+        """
+        return self.norm == 0
+
+    @property
+    def key(self) -> tuple:
+        """
+        Returns hashable key of the query, queries with the same key have the same results.
+        Order of the terms does not change the cosine similarity, so the terms are sorted
+        """
+        return tuple(sorted(zip(self.terms, self.weights.tolist())))
+
+    def get_term_weights(self) -> Dict[int, float]:
+        """
+        Returns tf-idf weights of the query terms by their term id in the index
+        """
+        return dict(zip(self.term_ids.tolist(), self.weights.tolist()))
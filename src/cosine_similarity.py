@@ -1,13 +1,31 @@
 import ctypes
 import heapq
+import threading
 from collections import OrderedDict
-from typing import List, Dict, Tuple
+from typing import Iterable, List, Tuple, Union, Optional
 
 import numpy as np
 
+from src.compiled_query import CompiledQuery
+from src.doc_id_service import doc_id_service
 from src.document import Document
 from src.preprocessing.preprocessor import Preprocessor
-from src.tf_idf import DocumentStats, create_inverted_tfidf_idx
+from src.document_store import iter_saved_documents, load_documents, save_documents
+from src.impact_search import approximate_top_n
+from src.instrumentation import instrumentation
+from src.max_score import max_score_top_n
+from src.read_write_lock import ReadWriteLock
+from src.segmented_index import SegmentedIndex
+from src.sharded_index import ShardedIndex, create_sharded_idx, load_sharded_idx, sharded_idx_exists
+from src.sparse_tf_idf import SparseTfIdfIndex, create_sparse_tfidf_idx, load_sparse_tfidf_idx, \
+    save_sparse_tfidf_idx
+from src.tf_idf import InvertedIndex, create_inverted_tfidf_idx, get_tf_weights
+from src.vocabulary import vocabulary
+
+
+# Maximum number of query-document scores held in memory at once during batch search (32 MB of float64 scores,
+# the selection of the top n allocates an index array of the same size)
+MAX_BATCH_SCORES = 2 ** 22
 
 
 class CosineSimilaritySearch:
@@ -15,105 +33,487 @@ class CosineSimilaritySearch:
     Cosine similarity search implementation
     """
 
-    def __init__(self, tf_idf_inverted_idx: dict, documents: List[Document], preprocessor: Preprocessor):
+    def __init__(self, tf_idf_inverted_idx: Union[InvertedIndex, SparseTfIdfIndex, SegmentedIndex, ShardedIndex],
+                 documents: Optional[List[Document]], preprocessor: Preprocessor, use_max_score=True):
         """
         Initialize the cosine similarity search
         :param tf_idf_inverted_idx: inverted index containing terms and their stats with documents and tfidf values
-        :param documents:
+                                    and precomputed norms of the document vectors. Either the object-graph
+                                    InvertedIndex, the compact SparseTfIdfIndex, the SegmentedIndex or the ShardedIndex
+        :param documents: indexed documents, must be in the same order as they were passed to the index.
+                          Any sequence of documents can be passed, e.g. memory-mapped DocumentStore.
+                          SegmentedIndex and ShardedIndex store the documents themselves, so None is passed
+        :param use_max_score: if True, sparse index is searched with MaxScore dynamic pruning, which skips documents
+                              that cannot enter the top n (results are the same as with exhaustive scoring).
+                              MaxScore needs postings ordered by document position, so it is not used
+                              for impact-ordered index
         """
         self.tf_idf_inverted_idx = tf_idf_inverted_idx
-        self.documents = documents
-        self.total_docs = len(documents)
+        self.is_sparse_idx = isinstance(tf_idf_inverted_idx, SparseTfIdfIndex)
+        self.is_segmented_idx = isinstance(tf_idf_inverted_idx, SegmentedIndex)
+        self.is_sharded_idx = isinstance(tf_idf_inverted_idx, ShardedIndex)
+        is_inverted_idx = not (self.is_sparse_idx or self.is_segmented_idx or self.is_sharded_idx)
+        # Inverted index can be updated, so we keep our own copy of the list
+        self.documents = list(documents) if is_inverted_idx else documents
+        # Sparse index addresses documents by their position, so the mapping is only needed for the inverted index
+        self.doc_id_to_document = None if not is_inverted_idx else \
+            {document.doc_id: document for document in documents}
         self.preprocessor = preprocessor
+        self.use_max_score = use_max_score
+        # Searches run concurrently, updates of the index exclude them (and each other). Segmented index has
+        # its own lock, so its updates do not take this one
+        self.lock = ReadWriteLock()
 
-        # The number of dimensions is equal to the number of terms
-        self.dims = len(tf_idf_inverted_idx.keys())
-        self.term_to_vec_mapping = {term: idx for idx, term in enumerate(self.tf_idf_inverted_idx)}
+        self._sparse_idx = tf_idf_inverted_idx if self.is_sparse_idx else None  # used for batch search
+        # Sparse index of the inverted index is built by the first batch search after an update, concurrent
+        # batch searches wait for it instead of building their own
+        self._sparse_idx_lock = threading.Lock()
 
-    @staticmethod
-    def append_term_to_vec(terms, term_mapping: Dict[str, int], last_idx):
-        for term in terms:
-            if term in term_mapping:
-                continue
-            term_mapping[term] = last_idx[0]
-            last_idx[0] = last_idx[0] + 1
-
-    def get_bow_similarity(self, query_bow: dict, document: Document,
-                           query_document_stats) -> float:
-        """
-        Calculates similarity between two bags of words
-        :param query_document_stats: dictionary containing terms mapped to document stats of the query
-        :param query_bow:
-        :param document: document to compare with
-        :return: similarity between the two bags of words
-        """
-        doc_bow = document.bow
-
-        # We throw away dimensions where both query and document are zero since they are completely useless
-        # and will not change the outcome but boost our performance significantly
-
-        term_mapping = {}
-        last_idx = [0]
-        self.append_term_to_vec(query_bow.keys(), term_mapping, last_idx)
-        self.append_term_to_vec(doc_bow.keys(), term_mapping, last_idx)
-
-        # Create vector for the query and the document
-        query_vec = np.zeros(len(term_mapping.keys()))
-        doc_vec = np.zeros(len(term_mapping.keys()))
-        for term in query_bow.keys():
-            query_vec[term_mapping[term]] = query_document_stats[term].tfidf
-
-        for term in doc_bow.keys():
-            doc_vec[term_mapping[term]] = self.tf_idf_inverted_idx[term].documents[document.doc_id].tfidf
-
-        # Finally, calculate the cosine similarity
-        return np.dot(query_vec, doc_vec) / (np.linalg.norm(doc_vec) * np.linalg.norm(query_vec))
-
-    def get_query_term_stats(self, query_doc: Document):
-        query_bow = query_doc.bow
-        term_to_document_stats = {}
-        for term, freq in query_bow.items():
-            document_stats = DocumentStats(query_doc, freq)
-            tf = 1 + np.log10(freq)
-            idf = np.log10(self.total_docs / self.tf_idf_inverted_idx[term].df)
-            document_stats.set_tfidf(tf * idf)
-
-            term_to_document_stats[term] = document_stats
-
-        return term_to_document_stats
-
-    def get_top_n_documents(self, query: str, n: int) -> List[Tuple[float, Document]]:
+    @property
+    def total_docs(self):
+        return self.tf_idf_inverted_idx.total_docs
+
+    def add_documents(self, documents: List[Document]):
+        """
+        Adds documents to the index, the documents are searchable immediately without rebuilding the index
+        :param documents: preprocessed documents
+        :return:
+        """
+        if self.is_sparse_idx or self.is_sharded_idx:
+            raise ValueError('Sparse index is immutable, documents can only be added to the inverted index')
+
+        # Segmented index locks only its in-memory segment, so the searches are not blocked by its updates
+        # (including sealing and merging of the segments run by the writer)
+        if self.is_segmented_idx:
+            self.tf_idf_inverted_idx.add_documents(documents)
+            return
+
+        with self.lock.write():
+            self._add_documents(documents)
+
+    def _add_documents(self, documents: List[Document]):
+        self.tf_idf_inverted_idx.add_documents(documents)
+        self.documents.extend(documents)
+        for document in documents:
+            self.doc_id_to_document[document.doc_id] = document
+        self._sparse_idx = None  # sparse index used for batch search must be rebuilt
+
+    def delete_documents(self, doc_ids: List[int]):
+        """
+        Deletes documents from the index
+        :param doc_ids: ids of the documents to delete
+        :return:
+        """
+        if self.is_sparse_idx or self.is_sharded_idx:
+            raise ValueError('Sparse index is immutable, documents can only be deleted from the inverted index')
+
+        if self.is_segmented_idx:
+            self.tf_idf_inverted_idx.delete_documents(doc_ids)
+            return
+
+        with self.lock.write():
+            self._delete_documents(doc_ids)
+
+    def _delete_documents(self, doc_ids: List[int]):
+        for doc_id in doc_ids:
+            if doc_id not in self.doc_id_to_document:
+                raise ValueError(f'Document with id {doc_id} is not indexed')
+        if len(set(doc_ids)) != len(doc_ids):
+            raise ValueError('Deleted documents must have unique ids')
+
+        # Positions of the documents match the positions in the index
+        for doc_id in doc_ids:
+            self.documents[self.tf_idf_inverted_idx.doc_id_to_idx[doc_id]] = None
+            del self.doc_id_to_document[doc_id]
+        self.tf_idf_inverted_idx.delete_documents(doc_ids)
+        self._sparse_idx = None
+
+    def compile_query_doc(self, query_doc: Document) -> CompiledQuery:
+        """
+        Compiles the preprocessed query against the index - calculates tf-idf weights of its terms and the norm
+        of the query vector, which are then used by all scoring backends
+        :param query_doc: query document containing only the indexed terms (see get_query_doc)
+        :return: compiled query
+        """
+        with self.lock.read():
+            return self._compile_query_doc(query_doc)
+
+    def _compile_query_doc(self, query_doc: Document) -> CompiledQuery:
+        term_ids, counts = query_doc.bow_ids
+        terms = vocabulary.get_terms(term_ids)
+        weights = np.zeros(len(terms), dtype=np.float64)
+        if len(terms) > 0:
+            # Query is weighted by the same scheme as the documents, for bm25 the query is its own average document
+            query_length = counts.sum()
+            weights = get_tf_weights(counts, counts.max(), query_length, query_length,
+                                     self.tf_idf_inverted_idx.tf_weighting)
+            weights *= np.array([self.tf_idf_inverted_idx.get_idf(term) for term in terms], dtype=np.float64)
+
+        # Sparse and sharded indexes address the terms by their ids, the others by the terms themselves
+        index_term_ids = None
+        if self.is_sparse_idx or self.is_sharded_idx:
+            term_to_id = self.tf_idf_inverted_idx.term_to_id
+            index_term_ids = np.fromiter((term_to_id[term] for term in terms), dtype=np.int64, count=len(terms))
+        return CompiledQuery(terms, index_term_ids, weights)
+
+    def compile_query(self, query: str) -> CompiledQuery:
+        """
+        Preprocesses the query and compiles it against the index
+        :param query: query text
+        :return: compiled query
+        """
+        with self.lock.read():
+            return self._compile_query(query)
+
+    def _compile_query(self, query: str) -> CompiledQuery:
+        with instrumentation.stage('query_preprocessing'):
+            query_doc = self.get_query_doc(query)
+        with instrumentation.stage('query_weighting'):
+            return self._compile_query_doc(query_doc)
+
+    def get_query_doc(self, query: str) -> Document:
+        """
+        Preprocesses the query and creates a document from its indexed terms
+        :param query: query text
+        :return: query document
+        """
         # We need to treat the query as a document
         # Preprocess the query and get the tokens
         query_terms = self.preprocessor.get_processed_tokens(query)
 
         # Filter out those that are not indexed
-        # Todo this could be done in a better way
         query_terms = [term for term in query_terms if term in self.tf_idf_inverted_idx]
+        return Document(-1, query_terms)
+
+    def get_top_n_documents(self, query: str, n: int, approximate=False, max_postings: int = None,
+                            time_budget_ms: float = None) -> List[Tuple[float, Document]]:
+        """
+        Searches top n documents most similar to the query
+        :param query: query text
+        :param n: number of returned documents
+        :param approximate: if True, the search stops once the posting or time budget runs out and returns
+                            the current top n. Only supported by the sparse index (best with the impact-ordered one),
+                            other indexes always return exact results
+        :param max_postings: maximum number of evaluated postings in the approximate search, None for no limit
+        :param time_budget_ms: time budget of the approximate search in milliseconds, None for no limit
+        :return: list of tuples of cosine similarity and document ordered by the similarity
+        """
+        with self.lock.read():
+            return self._get_top_n_documents_for_query(self._compile_query(query), n, approximate, max_postings,
+                                                       time_budget_ms)
+
+    def get_top_n_documents_for_query(self, query: CompiledQuery, n: int, approximate=False,
+                                      max_postings: int = None,
+                                      time_budget_ms: float = None) -> List[Tuple[float, Document]]:
+        """
+        Same as get_top_n_documents, but the query is already compiled (see compile_query), so the same
+        compiled query can be searched repeatedly, e.g. for the following pages of the results
+        """
+        with self.lock.read():
+            return self._get_top_n_documents_for_query(query, n, approximate, max_postings, time_budget_ms)
+
+    def _get_top_n_documents_for_query(self, query: CompiledQuery, n: int, approximate: bool,
+                                       max_postings: Optional[int],
+                                       time_budget_ms: Optional[float]) -> List[Tuple[float, Document]]:
+        if query.is_empty:
+            return []
+
+        if self.is_segmented_idx or self.is_sharded_idx:
+            # Segments and shards generate, score and select the candidates together
+            with instrumentation.stage('scoring'):
+                return self.tf_idf_inverted_idx.get_top_n(query, n)
+        if self.is_sparse_idx and approximate:
+            return self._get_top_n_sparse_idx_approximate(query, n, max_postings, time_budget_ms)
+        if self.is_sparse_idx:
+            return self._get_top_n_sparse_idx(query, n)
+        return self._get_top_n_inverted_idx(query, n)
+
+    def _get_top_n_inverted_idx(self, query: CompiledQuery, n: int) -> List[Tuple[float, Document]]:
+        # Term-at-a-time scoring - walk only the posting lists of the query terms and accumulate
+        # the dot products, so documents without any query term are never touched
+        # Idf is applied once per term, postings only hold the tf weights
+        accumulators, postings = {}, 0
+        with instrumentation.stage('candidate_generation'):
+            for term, query_weight in zip(query.terms, query.weights.tolist()):
+                # Query compiled before an update of the index can contain terms which are no longer indexed
+                if term not in self.tf_idf_inverted_idx:
+                    continue
+                term_weight = query_weight * self.tf_idf_inverted_idx.get_idf(term)
+                term_postings = self.tf_idf_inverted_idx[term].documents
+                postings += len(term_postings)
+                for doc_id, document_stats in term_postings.items():
+                    accumulators[doc_id] = accumulators.get(doc_id, 0.0) + term_weight * document_stats.tf_weight
+
+        results = []
+        with instrumentation.stage('scoring'):
+            for doc_id, dot_product in accumulators.items():
+                document = self.doc_id_to_document[doc_id]
+                doc_norm = self.tf_idf_inverted_idx.get_document_norm(doc_id)
+                if doc_norm == 0:
+                    continue
+                # Scores are clamped, rounding errors could push the similarity of identical vectors over 1
+                results.append((min(float(dot_product / (doc_norm * query.norm)), 1.0), document))
+        instrumentation.count('postings', postings)
+        instrumentation.count('scored_documents', len(results))
+
+        with instrumentation.stage('selection'):
+            return heapq.nlargest(n, results, key=lambda x: x[0])
+
+    def _get_top_n_sparse_idx(self, query: CompiledQuery, n: int) -> List[Tuple[float, Document]]:
+        if self.use_max_score and not self.tf_idf_inverted_idx.impact_ordered:
+            # Candidates are generated, scored and pruned together
+            stats = {} if instrumentation.active else None
+            with instrumentation.stage('scoring'):
+                doc_idxs, scores = max_score_top_n(self.tf_idf_inverted_idx, query.get_term_weights(), query.norm, n,
+                                                   stats)
+            self._count_pruned_postings(stats)
+            return [(min(float(score), 1.0), self.documents[doc_idx]) for doc_idx, score in zip(doc_idxs, scores)]
+
+        # Same term-at-a-time scoring as for the inverted index, the posting lists are numpy arrays,
+        # so each of them is accumulated in a single vectorized operation
+        accumulators, postings = np.zeros(self.tf_idf_inverted_idx.total_docs, dtype=np.float64), 0
+        with instrumentation.stage('candidate_generation'):
+            for term, query_weight in zip(query.terms, query.weights.tolist()):
+                doc_idxs, weights = self.tf_idf_inverted_idx.get_postings(term)
+                accumulators[doc_idxs] += query_weight * weights
+                postings += len(doc_idxs)
+
+        with instrumentation.stage('scoring'):
+            candidates = np.flatnonzero(accumulators)
+            doc_norms = self.tf_idf_inverted_idx.doc_norms[candidates]
+            candidates, doc_norms = candidates[doc_norms > 0], doc_norms[doc_norms > 0]
+            scores = np.minimum(accumulators[candidates] / (doc_norms * query.norm), 1.0)
+        instrumentation.count('postings', postings)
+        instrumentation.count('scored_documents', len(scores))
 
-        # Create query document
-        query_doc = Document(-1, query_terms)
+        # Select top n without sorting all candidates
+        with instrumentation.stage('selection'):
+            if len(scores) > n:
+                top_n = np.argpartition(-scores, n)[:n]
+                candidates, scores = candidates[top_n], scores[top_n]
+            order = np.argsort(-scores, kind='stable')
+        return [(float(scores[i]), self.documents[candidates[i]]) for i in order]
 
-        # Get bag of words of the query
-        query_vec = query_doc.bow
+    def _get_top_n_sparse_idx_approximate(self, query: CompiledQuery, n: int, max_postings: Optional[int],
+                                          time_budget_ms: Optional[float]) -> List[Tuple[float, Document]]:
+        stats = {} if instrumentation.active else None
+        with instrumentation.stage('scoring'):
+            doc_idxs, scores = approximate_top_n(self.tf_idf_inverted_idx, query.get_term_weights(), query.norm, n,
+                                                 max_postings=max_postings, time_budget_ms=time_budget_ms, stats=stats)
+        self._count_pruned_postings(stats)
+        return [(min(float(score), 1.0), self.documents[doc_idx]) for doc_idx, score in zip(doc_idxs, scores)]
 
-        # Get the cosine similarity of the query with all documents
+    @staticmethod
+    def _count_pruned_postings(stats: Optional[dict]):
+        """
+        Counts postings evaluated and skipped by the dynamic pruning (stats of max_score_top_n or approximate_top_n)
+        """
+        if not stats:
+            return
+        instrumentation.count('postings', stats['evaluated_postings'])
+        instrumentation.count('pruned_postings', stats['postings'] - stats['evaluated_postings'])
+        if 'terminated_early' in stats:
+            instrumentation.count('terminated_early_searches', stats['terminated_early'])
+
+    def get_top_n_documents_batch(self, queries: List[str], n: int) -> List[List[Tuple[float, Document]]]:
+        """
+        Searches top n documents for each of the queries. All queries are turned into one sparse query matrix
+        which is multiplied with the document-term matrix in a single vectorized operation
+        :param queries: query texts
+        :param n: number of documents returned for each query
+        :return: list of results of each query in the same order as the queries
+        """
+        with self.lock.read():
+            return self._get_top_n_documents_batch(queries, n)
+
+    def _get_top_n_documents_batch(self, queries: List[str], n: int) -> List[List[Tuple[float, Document]]]:
+        if self.is_segmented_idx or self.is_sharded_idx:
+            # Segments and shards have no single document-term matrix, so the queries are searched one by one
+            return [self._get_top_n_documents_for_query(self._compile_query(query), n, False, None, None)
+                    for query in queries]
+
+        sparse_idx = self._get_sparse_idx()
+
+        # Query matrix in coordinate format - query (row), term id and tf-idf weight of each non-zero item
+        # Sparse index converted from the inverted index has its own term ids, so the terms are mapped to them
+        compiled_queries = [self._compile_query(query) for query in queries]
+        query_rows = np.repeat(np.arange(len(queries), dtype=np.int64), [len(query) for query in compiled_queries])
+        query_term_ids = np.array([sparse_idx.term_to_id[term] for query in compiled_queries for term in query.terms],
+                                  dtype=np.int64)
+        query_weights = np.concatenate([query.weights for query in compiled_queries] + [np.empty(0)])
+        query_norms = np.array([query.norm for query in compiled_queries], dtype=np.float64)
+
+        # Queries are scored in chunks so the dense score matrix stays bounded
+        chunk_size = max(1, MAX_BATCH_SCORES // max(sparse_idx.total_docs, 1))
         results = []
-        for doc in self.documents:
-            # Get the cosine similarity of the query with the current document
-            results.append((np.abs(self.get_bow_similarity(query_vec, doc, self.get_query_term_stats(query_doc))), doc))
+        for chunk_start in range(0, len(queries), chunk_size):
+            chunk_end = min(chunk_start + chunk_size, len(queries))
+            in_chunk = (query_rows >= chunk_start) & (query_rows < chunk_end)
+            with instrumentation.stage('scoring'):
+                scores = self._multiply_query_matrix(sparse_idx, query_rows[in_chunk] - chunk_start,
+                                                     query_term_ids[in_chunk], query_weights[in_chunk],
+                                                     chunk_end - chunk_start)
+            with instrumentation.stage('selection'):
+                results.extend(self._get_top_n_rows(scores, query_norms[chunk_start:chunk_end], sparse_idx.doc_norms,
+                                                    n))
+        instrumentation.count('postings', int(sparse_idx.df[query_term_ids].sum()))
+
+        return results
 
-        return heapq.nlargest(n, results, key=lambda x: x[0])
+    def _get_sparse_idx(self) -> SparseTfIdfIndex:
+        """
+        Returns the sparse index, object-graph inverted index is converted on the first use after each update.
+        Must be called under the read lock, so the inverted index does not change during the conversion
+        """
+        sparse_idx = self._sparse_idx
+        if sparse_idx is not None:
+            return sparse_idx
+        with self._sparse_idx_lock:
+            if self._sparse_idx is None:
+                self._sparse_idx = SparseTfIdfIndex.from_inverted_idx(self.tf_idf_inverted_idx)
+            return self._sparse_idx
+
+    @staticmethod
+    def _multiply_query_matrix(sparse_idx: SparseTfIdfIndex, query_rows: np.ndarray, query_term_ids: np.ndarray,
+                               query_weights: np.ndarray, n_queries: int) -> np.ndarray:
+        """
+        Multiplies sparse query matrix (given in coordinate format) with the document-term matrix
+        :return: dense matrix of dot products with shape (n_queries, total_docs)
+        """
+        # Gather postings of all query items at once - for each query item its posting list slice
+        starts = sparse_idx.term_offsets[query_term_ids]
+        lengths = sparse_idx.df[query_term_ids].astype(np.int64)
+        item_offsets = np.cumsum(lengths) - lengths
+        posting_positions = np.arange(lengths.sum()) + np.repeat(starts - item_offsets, lengths)
 
+        # Each posting contributes query weight * idf * tf weight to the (query, document) cell
+        contributions = (np.repeat(query_weights * sparse_idx.idf[query_term_ids], lengths) *
+                         sparse_idx.posting_tf_weights[posting_positions])
+        cells = (np.repeat(query_rows, lengths) * sparse_idx.total_docs +
+                 sparse_idx.posting_doc_idxs[posting_positions])
+        return np.bincount(cells, weights=contributions,
+                           minlength=n_queries * sparse_idx.total_docs).reshape(n_queries, sparse_idx.total_docs)
 
-def build_cos_similarity_model(documents: List[Document], preprocessor: Preprocessor):
+    def _get_top_n_rows(self, dot_products: np.ndarray, query_norms: np.ndarray, doc_norms: np.ndarray,
+                        n: int) -> List[List[Tuple[float, Document]]]:
+        """
+        Normalizes the dot products to cosine similarities and selects top n documents in each row.
+        Dot products are normalized in place, so no other matrix of their size is allocated
+        """
+        scores = dot_products
+        with np.errstate(divide='ignore', invalid='ignore'):
+            scores /= query_norms[:, np.newaxis]
+            scores /= doc_norms
+        scores[~np.isfinite(scores)] = 0
+        # Scores are clamped, rounding errors could push the similarity of identical vectors over 1
+        np.minimum(scores, 1.0, out=scores)
+
+        n = min(n, scores.shape[1])
+        if n == 0:
+            return [[] for _ in range(scores.shape[0])]
+        # Partitioned in ascending order, so the scores are not negated into another matrix
+        top_n = np.argpartition(scores, scores.shape[1] - n, axis=1)[:, scores.shape[1] - n:]
+
+        results = []
+        for row, row_top_n in enumerate(top_n):
+            row_scores = scores[row, row_top_n]
+            order = np.argsort(-row_scores, kind='stable')
+            results.append([(float(row_scores[i]), self.documents[row_top_n[i]]) for i in order
+                            if row_scores[i] > 0])
+        return results
+
+
+def build_cos_similarity_model(documents: List[Document], preprocessor: Preprocessor, sparse_idx=False,
+                               impact_ordered=False, shards: int = None, drop_tokens=False, tf_weighting='log'):
     """
     Builds a cosine similarity model
     :param documents:
     :param preprocessor:
+    :param sparse_idx: if True, compact SparseTfIdfIndex is used instead of the object-graph inverted index
+    :param impact_ordered: if True, postings of the sparse index are ordered by their impact, which suits
+                           the approximate search (implies sparse_idx)
+    :param shards: if set, documents are partitioned into this number of shards, each searched by its own
+                   worker process (ShardedIndex)
+    :param drop_tokens: if True, documents indexed by the object-graph inverted index keep only their bags of words
+    :param tf_weighting: term frequency weighting scheme, one of TF_WEIGHTINGS. Segmented index is always
+                         weighted by log term frequency
     :return:
     """
     # Build inverted index
-    inverted_idx = create_inverted_tfidf_idx(documents)
+    if shards is not None:
+        return CosineSimilaritySearch(create_sharded_idx(documents, shards, tf_weighting), None, preprocessor)
+    if impact_ordered:
+        inverted_idx = create_sparse_tfidf_idx(documents, tf_weighting).to_impact_ordered()
+    elif sparse_idx:
+        inverted_idx = create_sparse_tfidf_idx(documents, tf_weighting)
+    else:
+        inverted_idx = create_inverted_tfidf_idx(documents, drop_tokens=drop_tokens, tf_weighting=tf_weighting)
 
     return CosineSimilaritySearch(inverted_idx, documents, preprocessor)
+
+
+def build_segmented_cos_similarity_model(dir_path, preprocessor: Preprocessor, documents: List[Document] = None,
+                                         seal_threshold=10_000, merge_factor=4):
+    """
+    Builds a cosine similarity model over the segmented index stored in the directory. Existing segments are loaded,
+    further documents can be added via add_documents of the model
+    :param dir_path: directory of the segmented index
+    :param preprocessor: preprocessor used for the queries
+    :param documents: documents added to the index after it is opened
+    :param seal_threshold: number of documents in the in-memory segment that triggers sealing
+    :param merge_factor: number of sealed segments that triggers merging
+    :return: cosine similarity model
+    """
+    segmented_idx = SegmentedIndex(dir_path, seal_threshold=seal_threshold, merge_factor=merge_factor)
+    # Documents created after the index is reopened must not reuse the ids of the stored documents
+    doc_id_service.skip_past(segmented_idx.get_max_doc_id())
+    if documents:
+        segmented_idx.add_documents(documents)
+    return CosineSimilaritySearch(segmented_idx, None, preprocessor)
+
+
+def save_cos_similarity_model(cos_sim_model: CosineSimilaritySearch, dir_path):
+    """
+    Saves index and documents of the model to a directory in binary format
+    :param cos_sim_model: cosine similarity model
+    :param dir_path: path to the directory
+    :return:
+    """
+    if cos_sim_model.is_sharded_idx:
+        cos_sim_model.tf_idf_inverted_idx.save(dir_path)
+        return
+
+    with cos_sim_model.lock.read():
+        save_documents(cos_sim_model.documents, dir_path)
+        save_sparse_tfidf_idx(cos_sim_model._get_sparse_idx(), dir_path)
+
+
+def build_and_save_cos_similarity_model(documents: Iterable[Document], dir_path, impact_ordered=False,
+                                        tf_weighting='log'):
+    """
+    Builds sparse index from a stream of documents and saves it together with the documents in a single pass.
+    Documents are written to disk as they are indexed, so only the postings are held in memory.
+    The model is then loaded via load_cos_similarity_model
+    :param documents: documents, any iterable (e.g. generator of iter_preprocessed_reviews)
+    :param dir_path: path to the directory
+    :param impact_ordered: if True, postings are ordered by their impact
+    :param tf_weighting: term frequency weighting scheme, one of TF_WEIGHTINGS
+    :return:
+    """
+    sparse_idx = create_sparse_tfidf_idx(iter_saved_documents(documents, dir_path), tf_weighting)
+    if impact_ordered:
+        sparse_idx = sparse_idx.to_impact_ordered()
+    save_sparse_tfidf_idx(sparse_idx, dir_path)
+
+
+def load_cos_similarity_model(dir_path, preprocessor: Preprocessor):
+    """
+    Loads model saved via save_cos_similarity_model. Index and documents are memory-mapped, so loading is
+    nearly instant and all processes loading the same directory share the pages via OS page cache
+    :param dir_path: path to the directory
+    :param preprocessor: preprocessor used for the queries, should be the same as used for the documents
+    :return: cosine similarity model
+    """
+    if sharded_idx_exists(dir_path):
+        return CosineSimilaritySearch(load_sharded_idx(dir_path), None, preprocessor)
+    return CosineSimilaritySearch(load_sparse_tfidf_idx(dir_path), load_documents(dir_path), preprocessor)
@@ -9,5 +9,11 @@ class IdService:
         self.counter += 1
         return self.counter
 
+    def skip_past(self, doc_id):
+        """
+        Makes the following ids greater than the doc_id, e.g. when documents with stored ids are loaded
+        """
+        self.counter = max(self.counter, doc_id)
+
 
 doc_id_service = IdService()
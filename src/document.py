@@ -1,34 +1,112 @@
+from typing import List, Tuple
+
+import numpy as np
+
+from src.vocabulary import vocabulary
+
+
 class Document:
     """
     Base interface to represent any document that can be indexed
     """
 
+    # Documents are created for each indexed review, so they do not carry per-instance dictionary
+    __slots__ = ('doc_id', 'token_ids', '_bow_ids')
+    # Stored fields which can be returned with the search results
+    STORED_FIELDS = ('tokens',)
+
     def __init__(self, doc_id, tokens):
         """
         Initializes the document object
         :param doc_id: the document id
-        :param tokens: tokens of the document obtained from preprocessing
+        :param tokens: tokens of the document obtained from preprocessing, either list of strings or int32 array
+                       of their ids in the shared vocabulary
         """
         self.doc_id = doc_id
-        self.tokens = tokens
-        self._bow = None  # bag of words (dictionary of term: frequency in the document)
+        # Tokens are stored as ids in the shared vocabulary, so the same terms are not duplicated across documents
+        self.token_ids = tokens if isinstance(tokens, np.ndarray) else vocabulary.add_terms(tokens)
+        self._bow_ids = None  # bag of words kept after the tokens were dropped (2 x n array of term ids and counts)
 
     def __str__(self):
         return f'Document:\n\tid: {self.doc_id}\n\ttokens: {self.tokens}'
 
+    @property
+    def tokens(self):
+        """
+        Returns tokens of the document as strings, None if the tokens were dropped
+        :return:
+        """
+        return vocabulary.get_terms(self.token_ids) if self.token_ids is not None else None
+
+    @property
+    def bow_ids(self):
+        """
+        Returns the bag of words of the document as arrays of the distinct term ids (sorted) and their frequencies
+        :return:
+        """
+        if self.token_ids is None:
+            return self._bow_ids[0], self._bow_ids[1]
+        return np.unique(self.token_ids, return_counts=True)
+
     @property
     def bow(self):
         """
-        Returns the bag of words representation of the document
-        This property is lazy initialized
+        Returns the bag of words representation of the document (dictionary of term: frequency in the document)
+        The dictionary is created on each access, bow_ids is cheaper if term ids are sufficient
+        :return:
+        """
+        term_ids, counts = self.bow_ids
+        return dict(zip(vocabulary.get_terms(term_ids), counts.tolist()))
+
+    def drop_tokens(self):
+        """
+        Drops the tokens and keeps only the bag of words of the document (order of the tokens is lost), which
+        is smaller for documents with repeated terms
         :return:
         """
-        if self._bow is None:
-            bow = {}
-            for token in self.tokens:
-                if token not in bow:
-                    bow[token] = 1
-                else:
-                    bow[token] += 1
-            self._bow = bow
-        return self._bow
+        if self.token_ids is not None:
+            self._bow_ids = np.array(self.bow_ids, dtype=np.int32)
+            self.token_ids = None
+
+    def __getstate__(self):
+        # Term ids are only valid in the vocabulary of this process, so the tokens are pickled as strings
+        state = {'doc_id': self.doc_id, 'tokens': self.tokens}
+        if self.token_ids is None:
+            state['bow'] = self.bow
+        state.update(getattr(self, '__dict__', {}))
+        return state
+
+    def __setstate__(self, state):
+        state = dict(state)
+        state.pop('_bow', None)  # documents pickled before the tokens were interned
+        self.doc_id = state.pop('doc_id')
+        tokens, bow = state.pop('tokens'), state.pop('bow', None)
+        self.token_ids = vocabulary.add_terms(tokens) if tokens is not None else None
+        self._bow_ids = None
+        if bow is not None:
+            term_ids = vocabulary.add_terms(bow.keys())
+            order = np.argsort(term_ids)
+            counts = np.fromiter(bow.values(), dtype=np.int32, count=len(bow))
+            self._bow_ids = np.array([term_ids[order], counts[order]], dtype=np.int32)
+        for key, value in state.items():
+            setattr(self, key, value)
+
+
+def get_bows(documents: List[Document]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Returns bags of words of the documents as postings ordered by document position and term id. Tokens of all
+    documents are counted at once, which is much faster than bow_ids of each document
+    :param documents: documents
+    :return: tuple of arrays of document positions, term ids and term frequencies of the postings
+    """
+    token_ids = [document.token_ids if document.token_ids is not None else np.repeat(*document._bow_ids)
+                 for document in documents]
+    doc_lengths = np.fromiter(map(len, token_ids), dtype=np.int64, count=len(token_ids))
+    # Each document-term pair is encoded into a single key, so the pairs are counted by a single np.unique.
+    # Vocabulary can grow meanwhile (it is shared by all threads), so its size is read only once and the keys
+    # are encoded and decoded with the same value. Tokens of the documents were added to it before
+    vocabulary_size = len(vocabulary)
+    keys = np.repeat(np.arange(len(documents), dtype=np.int64), doc_lengths) * vocabulary_size
+    keys += np.concatenate(token_ids + [np.empty(0, dtype=np.int32)])
+    keys, tfs = np.unique(keys, return_counts=True)
+    return keys // vocabulary_size, (keys % vocabulary_size).astype(np.int32), tfs
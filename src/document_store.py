@@ -0,0 +1,101 @@
+# Module for storing indexed documents on disk
+# Documents are pickled one by one into a single blob file, offsets of the documents are stored in a separate array
+# so any document can be loaded without reading the others
+import os
+import pickle
+from typing import Iterable, Iterator, List
+
+import numpy as np
+
+from src.document import Document
+
+
+class DocumentStore:
+    """
+    Read-only sequence of documents backed by memory-mapped files
+    """
+
+    def __init__(self, blob: np.ndarray, offsets: np.ndarray):
+        """
+        :param blob: bytes of all pickled documents
+        :param offsets: start of each document in the blob, has len(documents) + 1 items
+        """
+        self.blob = blob
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, idx) -> Document:
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError(f'Document index {idx} out of range')
+        return pickle.loads(self.blob[self.offsets[idx]:self.offsets[idx + 1]])
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+
+def save_documents(documents: Iterable[Document], dir_path):
+    """
+    Saves documents to the directory, documents are then loaded via load_documents
+    :param documents: documents, any iterable
+    :param dir_path: path to the directory, created if it does not exist
+    :return:
+    """
+    for _ in iter_saved_documents(documents, dir_path):
+        pass
+
+
+def iter_saved_documents(documents: Iterable[Document], dir_path) -> Iterator[Document]:
+    """
+    Saves documents to the directory while they are passed through, so a stream of documents can be saved
+    and indexed in a single pass (e.g. create_sparse_tfidf_idx(iter_saved_documents(documents, dir_path))).
+    The store is complete once the generator is exhausted
+    :param documents: documents, any iterable
+    :param dir_path: path to the directory, created if it does not exist
+    :return: generator of the same documents
+    """
+    os.makedirs(dir_path, exist_ok=True)
+    offsets = [0]
+    with open(os.path.join(dir_path, 'documents.bin'), 'wb') as f:
+        for document in documents:
+            offsets.append(offsets[-1] + f.write(pickle.dumps(document, protocol=pickle.HIGHEST_PROTOCOL)))
+            yield document
+
+    np.save(os.path.join(dir_path, 'document_offsets.npy'), np.array(offsets, dtype=np.int64))
+
+
+def merge_documents(document_stores: List[DocumentStore], live_masks: List[np.ndarray], dir_path):
+    """
+    Writes live documents of several stores into a new store, pickled documents are copied without deserializing
+    :param document_stores: document stores to merge
+    :param live_masks: for each store boolean array of its documents, False marks documents that are dropped
+    :param dir_path: path to the directory of the new store
+    :return:
+    """
+    os.makedirs(dir_path, exist_ok=True)
+    offsets = [0]
+    with open(os.path.join(dir_path, 'documents.bin'), 'wb') as f:
+        for document_store, live_mask in zip(document_stores, live_masks):
+            for idx in np.flatnonzero(live_mask):
+                start, end = document_store.offsets[idx], document_store.offsets[idx + 1]
+                offsets.append(offsets[-1] + f.write(document_store.blob[start:end].tobytes()))
+
+    np.save(os.path.join(dir_path, 'document_offsets.npy'), np.array(offsets, dtype=np.int64))
+
+
+def load_documents(dir_path) -> DocumentStore:
+    """
+    Loads documents saved via save_documents. Files are memory-mapped, so documents are only deserialized
+    when they are accessed
+    :param dir_path: path to the directory
+    :return: document store
+    """
+    offsets = np.load(os.path.join(dir_path, 'document_offsets.npy'), mmap_mode='r')
+    blob_path = os.path.join(dir_path, 'documents.bin')
+    blob = np.memmap(blob_path, dtype=np.uint8, mode='r') if os.path.getsize(blob_path) > 0 \
+        else np.empty(0, dtype=np.uint8)
+    return DocumentStore(blob, offsets)
@@ -0,0 +1,83 @@
+# Approximate top-k retrieval over the impact-ordered sparse index (score-at-a-time processing)
+# Posting lists of the query terms are split into blocks, blocks of all terms are processed from the one with
+# the highest impact (query weight times the largest normalized weight in the block). Processing stops once
+# the posting or time budget runs out and the current top n is returned. Since the most important postings are
+# processed first, the results are close to the exact ones even if only a fraction of the postings is evaluated
+import time
+from typing import Dict, Tuple
+
+import numpy as np
+
+from src.sparse_tf_idf import SparseTfIdfIndex
+
+# Number of postings processed at once, the time budget is checked after each block
+IMPACT_BLOCK_SIZE = 1024
+
+
+def approximate_top_n(sparse_idx: SparseTfIdfIndex, query_weights: Dict[int, float], query_norm: float, n: int,
+                      max_postings: int = None, time_budget_ms: float = None, block_size=IMPACT_BLOCK_SIZE,
+                      stats: dict = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Finds approximate top n documents by cosine similarity. Without any budget the results are exact
+    :param sparse_idx: sparse index, should be impact-ordered (see SparseTfIdfIndex.to_impact_ordered), otherwise
+                       the blocks are ordered only by their first posting
+    :param query_weights: tf-idf weight of each query term (by term id)
+    :param query_norm: norm of the query vector
+    :param n: number of returned documents
+    :param max_postings: maximum number of evaluated postings, None for no limit
+    :param time_budget_ms: time budget in milliseconds, None for no limit
+    :param block_size: number of postings in a block
+    :param stats: if passed, number of postings in the query posting lists ('postings'), number of evaluated
+                  postings ('evaluated_postings') and number of early terminated searches ('terminated_early')
+                  are added to it
+    :return: tuple of document positions and their scores ordered by the score
+    """
+    if n <= 0 or not query_weights:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+
+    deadline = time.perf_counter() + time_budget_ms / 1000 if time_budget_ms is not None else None
+
+    # Split the posting lists into blocks, weight of the first posting is the maximum of the block
+    block_starts, block_ends, block_term_ids, block_weights = [], [], [], []
+    for term_id, weight in query_weights.items():
+        start, end = sparse_idx.term_offsets[term_id], sparse_idx.term_offsets[term_id + 1]
+        starts = np.arange(start, end, block_size, dtype=np.int64)
+        block_starts.append(starts)
+        block_ends.append(np.minimum(starts + block_size, end))
+        block_term_ids.append(np.full(len(starts), term_id, dtype=np.int64))
+        block_weights.append(np.full(len(starts), weight / query_norm))
+    block_starts, block_ends = np.concatenate(block_starts), np.concatenate(block_ends)
+    block_term_ids, block_weights = np.concatenate(block_term_ids), np.concatenate(block_weights)
+
+    impacts = (block_weights * sparse_idx.posting_tf_weights[block_starts] * sparse_idx.idf[block_term_ids] *
+               sparse_idx.inv_doc_norms[sparse_idx.posting_doc_idxs[block_starts]])
+    order = np.argsort(-impacts, kind='stable')
+
+    accumulators = np.zeros(sparse_idx.total_docs, dtype=np.float64)
+    total_postings, evaluated_postings = int(np.sum(block_ends - block_starts)), 0
+    for block in order:
+        if max_postings is not None and evaluated_postings >= max_postings:
+            break
+        if deadline is not None and time.perf_counter() >= deadline:
+            break
+
+        start, end = block_starts[block], block_ends[block]
+        if max_postings is not None:
+            end = min(end, start + max_postings - evaluated_postings)
+        doc_idxs = sparse_idx.posting_doc_idxs[start:end]
+        accumulators[doc_idxs] += (block_weights[block] * sparse_idx.idf[block_term_ids[block]] *
+                                   sparse_idx.posting_tf_weights[start:end] * sparse_idx.inv_doc_norms[doc_idxs])
+        evaluated_postings += end - start
+
+    if stats is not None:
+        stats['postings'] = stats.get('postings', 0) + total_postings
+        stats['evaluated_postings'] = stats.get('evaluated_postings', 0) + evaluated_postings
+        stats['terminated_early'] = stats.get('terminated_early', 0) + int(evaluated_postings < total_postings)
+
+    candidates = np.flatnonzero(accumulators)
+    scores = accumulators[candidates]
+    if len(scores) > n:
+        top_n = np.argpartition(-scores, n)[:n]
+        candidates, scores = candidates[top_n], scores[top_n]
+    order = np.argsort(-scores, kind='stable')
+    return candidates[order], scores[order]
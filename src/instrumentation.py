@@ -0,0 +1,218 @@
+# Module for the latency instrumentation of the search
+# Stages of the search (preprocessing, scoring, selection of the top n, ...) are timed and the work done by them
+# (postings, scored documents, cache hits, ...) is counted. Metrics are aggregated for the whole process (exported
+# in Prometheus text format) and optionally for a single request (profile of the request running in the current
+# thread). If neither is enabled, each instrumented stage only costs one check of the thread-local profile
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager, nullcontext
+from typing import Callable, Dict, List, Optional
+
+# Upper bounds of the histogram buckets of the stage durations in seconds
+STAGE_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                 10.0)
+
+# Context of the stages which are not measured, shared by all of them so nothing is allocated
+_NOT_MEASURED = nullcontext()
+
+
+class StageHistogram:
+    """
+    Histogram of the durations of a stage
+    """
+
+    __slots__ = ('bucket_counts', 'count', 'sum')
+
+    def __init__(self):
+        self.bucket_counts = [0] * (len(STAGE_BUCKETS) + 1)  # the last bucket holds durations over all bounds
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds: float):
+        self.bucket_counts[bisect_left(STAGE_BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+
+class RequestProfile:
+    """
+    Durations of the stages and counters of a single request
+    """
+
+    __slots__ = ('stage_seconds', 'counters')
+
+    def __init__(self):
+        self.stage_seconds: Dict[str, float] = {}
+        self.counters: Dict[str, int] = {}
+
+    def get_server_timing(self) -> str:
+        """
+        Returns value of the Server-Timing header with the durations of the stages in milliseconds,
+        counters are passed as descriptions of the entries without duration
+        """
+        entries = [f'{stage};dur={seconds * 1000:.3f}' for stage, seconds in self.stage_seconds.items()]
+        entries.extend(f'{name};desc="{value}"' for name, value in self.counters.items())
+        return ', '.join(entries)
+
+
+class _ThreadState(threading.local):
+    # Class attribute is the default of each thread, so the lookup never falls back to an exception
+    profile: Optional[RequestProfile] = None
+
+
+class _Stage:
+    """
+    Measures duration of the stage, see Instrumentation.stage
+    """
+
+    __slots__ = ('instrumentation', 'name', 'start')
+
+    def __init__(self, instrumentation, name: str):
+        self.instrumentation = instrumentation
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.instrumentation.record(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class Instrumentation:
+    """
+    Registry of the stage durations and counters. Hooks can be added to pass the measurements to other
+    monitoring systems (e.g. logging of slow stages), they are called with the kind of the measurement
+    ('stage' or 'counter'), its name and value (seconds or count)
+    """
+
+    def __init__(self, enabled=False):
+        """
+        :param enabled: if True, measurements are aggregated for the whole process, requests can still be profiled
+                        one by one if it is False
+        """
+        self.enabled = enabled
+        self.stages: Dict[str, StageHistogram] = {}
+        self.counters: Dict[str, int] = {}
+        self.hooks: List[Callable[[str, str, float], None]] = []
+        # Stages of the searches running in several threads are measured at once
+        self.lock = threading.Lock()
+        self._local = _ThreadState()
+
+    @property
+    def current_profile(self) -> Optional[RequestProfile]:
+        """
+        Returns profile of the request running in the current thread, None if the request is not profiled
+        """
+        return self._local.profile
+
+    @property
+    def active(self) -> bool:
+        """
+        Returns True if the measurements are used, so the callers can skip collecting the values for the counters
+        """
+        return self.enabled or self.current_profile is not None
+
+    def stage(self, name: str):
+        """
+        Returns context manager measuring the duration of the stage, the stage is not measured if the instrumentation
+        is not active
+        :param name: name of the stage, durations of the stages with the same name are summed up in the profile
+        """
+        if not self.enabled and self._local.profile is None:
+            return _NOT_MEASURED
+        return _Stage(self, name)
+
+    def record(self, name: str, seconds: float):
+        """
+        Records duration of the stage measured by the caller
+        """
+        profile = self._local.profile
+        if profile is not None:
+            profile.stage_seconds[name] = profile.stage_seconds.get(name, 0.0) + seconds
+        if not self.enabled:
+            return
+        with self.lock:
+            histogram = self.stages.get(name)
+            if histogram is None:
+                histogram = self.stages[name] = StageHistogram()
+            histogram.observe(seconds)
+        for hook in self.hooks:
+            hook('stage', name, seconds)
+
+    def count(self, name: str, value: int = 1):
+        """
+        Increments the counter
+        """
+        profile = self._local.profile
+        if profile is not None:
+            profile.counters[name] = profile.counters.get(name, 0) + value
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+        for hook in self.hooks:
+            hook('counter', name, value)
+
+    def add_hook(self, hook: Callable[[str, str, float], None]):
+        self.hooks.append(hook)
+
+    @contextmanager
+    def profile(self, enabled=True):
+        """
+        Profiles the request running in the current thread, stages and counters of the request are collected
+        into the yielded profile
+        :param enabled: if False, None is yielded and the request is not profiled
+        """
+        if not enabled:
+            yield None
+            return
+
+        previous_profile, self._local.profile = self.current_profile, RequestProfile()
+        try:
+            yield self._local.profile
+        finally:
+            self._local.profile = previous_profile
+
+    def reset(self):
+        with self.lock:
+            self.stages.clear()
+            self.counters.clear()
+
+    def get_prometheus_text(self, counters: Dict[str, float] = None, gauges: Dict[str, float] = None) -> str:
+        """
+        Returns the metrics in Prometheus text exposition format
+        :param counters: additional counters collected elsewhere (e.g. by the query cache), by metric name
+        :param gauges: additional gauges (e.g. size of the queue), by metric name
+        :return: text of the metrics
+        """
+        with self.lock:
+            stages = {name: (list(histogram.bucket_counts), histogram.count, histogram.sum)
+                      for name, histogram in self.stages.items()}
+            all_counters = {f'search_{name}_total': value for name, value in self.counters.items()}
+        all_counters.update(counters or {})
+
+        lines = []
+        if stages:
+            lines.append('# HELP search_stage_duration_seconds Duration of the search stages')
+            lines.append('# TYPE search_stage_duration_seconds histogram')
+        for name, (bucket_counts, count, total) in sorted(stages.items()):
+            cumulative_count = 0
+            for bound, bucket_count in zip(STAGE_BUCKETS, bucket_counts):
+                cumulative_count += bucket_count
+                lines.append(f'search_stage_duration_seconds_bucket{{stage="{name}",le="{bound}"}} {cumulative_count}')
+            lines.append(f'search_stage_duration_seconds_bucket{{stage="{name}",le="+Inf"}} {count}')
+            lines.append(f'search_stage_duration_seconds_sum{{stage="{name}"}} {total}')
+            lines.append(f'search_stage_duration_seconds_count{{stage="{name}"}} {count}')
+
+        for metric_type, metrics in [('counter', all_counters), ('gauge', gauges or {})]:
+            for name, value in sorted(metrics.items()):
+                lines.append(f'# TYPE {name} {metric_type}')
+                lines.append(f'{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+# Instrumentation shared by all searches of the process, enabled by the API
+instrumentation = Instrumentation()
@@ -0,0 +1,114 @@
+# Exact top-k retrieval with MaxScore dynamic pruning over the sparse tf-idf index
+# Each term stores an upper bound of its contribution to the cosine similarity (maximum normalized weight
+# in its posting list). Terms are processed from the one with the highest upper bound. Once the sum of the upper
+# bounds of the remaining terms drops below the score of the current n-th best document, no new document can
+# enter the top n, so the remaining posting lists are only probed for the current candidates and candidates
+# which cannot reach the top n are dropped
+from typing import Dict, Tuple
+
+import numpy as np
+
+from src.sparse_tf_idf import SparseTfIdfIndex
+
+
+def get_nth_largest(values: np.ndarray, n: int) -> float:
+    """
+    Returns n-th largest value, 0 if there are less than n values
+    """
+    if len(values) < n:
+        return 0.0
+    return float(np.partition(values, len(values) - n)[len(values) - n])
+
+
+def update_top_n(accumulators: np.ndarray, top_doc_idxs: np.ndarray, doc_idxs: np.ndarray,
+                 n: int) -> Tuple[np.ndarray, float]:
+    """
+    Updates the current top n documents after a posting list was added to the accumulators. Accumulators only grow,
+    so the new top n is among the previous top n and the documents of the posting list, the other documents
+    are not scanned
+    :param accumulators: partial scores of all documents
+    :param top_doc_idxs: positions of the top n documents before the posting list was added
+    :param doc_idxs: document positions of the posting list (sorted)
+    :param n: number of documents
+    :return: tuple of positions of the new top n documents and the n-th largest score (0 if there are less than n)
+    """
+    # Previous top documents which are in the posting list are dropped, so no document is counted twice
+    positions = np.searchsorted(doc_idxs, top_doc_idxs)
+    in_bounds = positions < len(doc_idxs)
+    in_postings = np.zeros(len(top_doc_idxs), dtype=bool)
+    in_postings[in_bounds] = doc_idxs[positions[in_bounds]] == top_doc_idxs[in_bounds]
+    pool = np.concatenate([top_doc_idxs[~in_postings], doc_idxs])
+    if len(pool) < n:
+        return pool, 0.0
+    top_doc_idxs = pool[np.argpartition(-accumulators[pool], n - 1)[:n]]
+    return top_doc_idxs, float(accumulators[top_doc_idxs].min())
+
+
+def max_score_top_n(sparse_idx: SparseTfIdfIndex, query_weights: Dict[int, float], query_norm: float, n: int,
+                    stats: dict = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Finds top n documents by cosine similarity, results are the same as with exhaustive scoring
+    :param sparse_idx: sparse index, postings of each term must be ordered by document position
+    :param query_weights: tf-idf weight of each query term (by term id)
+    :param query_norm: norm of the query vector
+    :param n: number of returned documents
+    :param stats: if passed, number of postings in the query posting lists ('postings') and number of evaluated
+                  postings ('evaluated_postings') are added to it
+    :return: tuple of document positions and their scores ordered by the score
+    """
+    if n <= 0 or not query_weights:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+
+    # Query weights are normalized so the contributions sum up to the cosine similarity
+    term_ids = np.array(list(query_weights.keys()), dtype=np.int64)
+    weights = np.array(list(query_weights.values()), dtype=np.float64) / query_norm
+    upper_bounds = weights * sparse_idx.term_max_scores[term_ids]
+    order = np.argsort(-upper_bounds, kind='stable')
+    term_ids, weights, upper_bounds = term_ids[order], weights[order], upper_bounds[order]
+    # remaining_upper_bounds[i] bounds the score a document can get from terms i, i + 1, ...
+    # (slightly increased, so rounding errors can never prune a document that belongs to the top n)
+    remaining_upper_bounds = np.append(np.cumsum(upper_bounds[::-1])[::-1], 0) * (1 + 1e-6)
+
+    accumulators = np.zeros(sparse_idx.total_docs, dtype=np.float64)
+    top_doc_idxs = np.empty(0, dtype=np.int64)  # current top n documents while all postings are evaluated
+    candidates = None  # set once no new document can enter the top n
+    total_postings, evaluated_postings = 0, 0
+    for i, (term_id, weight) in enumerate(zip(term_ids, weights)):
+        doc_idxs, normalized_weights = sparse_idx.get_normalized_postings(term_id)
+        total_postings += len(doc_idxs)
+
+        if candidates is None:
+            # Any document can still enter the top n, so the whole posting list is evaluated
+            accumulators[doc_idxs] += weight * normalized_weights
+            evaluated_postings += len(doc_idxs)
+            top_doc_idxs, threshold = update_top_n(accumulators, top_doc_idxs, doc_idxs, n)
+            if remaining_upper_bounds[i + 1] < threshold:
+                candidates = np.flatnonzero(accumulators)
+        else:
+            # Only candidates are looked up in the posting list (it is ordered by document position)
+            positions = np.searchsorted(doc_idxs, candidates)
+            in_bounds = positions < len(doc_idxs)
+            found = np.zeros(len(candidates), dtype=bool)
+            found[in_bounds] = doc_idxs[positions[in_bounds]] == candidates[in_bounds]
+            accumulators[candidates[found]] += weight * normalized_weights[positions[found]]
+            evaluated_postings += len(candidates)
+
+        if candidates is not None:
+            # Partial scores are lower bounds of the final scores, so the n-th best partial score is a lower bound
+            # of the final n-th best score. Candidates which cannot reach it are dropped
+            threshold = get_nth_largest(accumulators[candidates], n)
+            candidates = candidates[accumulators[candidates] + remaining_upper_bounds[i + 1] >= threshold]
+
+    if stats is not None:
+        stats['postings'] = stats.get('postings', 0) + total_postings
+        stats['evaluated_postings'] = stats.get('evaluated_postings', 0) + evaluated_postings
+
+    if candidates is None:
+        # All postings were evaluated, so the current top n are the final results
+        candidates = top_doc_idxs[accumulators[top_doc_idxs] > 0]
+    scores = accumulators[candidates]
+    if len(scores) > n:
+        top_n = np.argpartition(-scores, n)[:n]
+        candidates, scores = candidates[top_n], scores[top_n]
+    order = np.argsort(-scores, kind='stable')
+    return candidates[order], scores[order]
@@ -1,21 +1,70 @@
 # Module for reading metacritic reviews from the documents.json file
+import sys
 from datetime import datetime
+
+import numpy as np
+
 from src.document import Document
 
+# Metadata of the review, names are kept from the former attributes
+METADATA_FIELDS = ['gameName', 'reviewer_name', 'dateReviewed', 'score', 'text', 'criticReview']
+
+
+def to_datetime64(date) -> np.datetime64:
+    """
+    Converts review date to numpy datetime, dates deserialized from json are strings
+    """
+    if date is None:
+        return np.datetime64('NaT', 's')
+    if isinstance(date, str):
+        date = datetime.fromisoformat(date)
+    return np.datetime64(date, 's')
+
+
+def from_datetime64(date: np.datetime64):
+    """
+    Converts numpy datetime back to the review date as it is deserialized from json (str of the datetime), so
+    the documents are the same whichever format they were loaded from. None for NaT
+    """
+    date = date.astype(datetime) if isinstance(date, np.datetime64) else date
+    return str(date) if date is not None else None
+
+
+def intern_name(name):
+    """
+    Interns game or reviewer name, reviews of the same game (reviewer) then share one string instead of each
+    review holding its own copy. Interned strings are released once no document references them
+    """
+    return sys.intern(name) if type(name) is str else name
+
 
 class MetacriticReviewDocument(Document):
+    # Metadata is held by the document itself, so documents created temporarily (e.g. loaded from the document
+    # store for a search result) release it together with the document
+    __slots__ = tuple(METADATA_FIELDS)
+    STORED_FIELDS = Document.STORED_FIELDS + tuple(METADATA_FIELDS)
 
     def __init__(self, doc_id, terms, game_name: str, reviewer_name: str, date_reviewed: datetime, score: float,
                  text: str,
                  criticReview: bool):
         super().__init__(doc_id, terms)
-        self.gameName = game_name
-        self.reviewer_name = reviewer_name
+        self.gameName = intern_name(game_name)
+        self.reviewer_name = intern_name(reviewer_name)
         self.dateReviewed = date_reviewed
         self.score = score
         self.text = text
         self.criticReview = criticReview
 
+    def __getstate__(self):
+        state = super().__getstate__()
+        state.update((field, getattr(self, field)) for field in METADATA_FIELDS)
+        return state
+
+    def __setstate__(self, state):
+        super().__setstate__(state)
+        self.gameName = intern_name(self.gameName)
+        self.reviewer_name = intern_name(self.reviewer_name)
+
     def __str__(self):
         return f"""
         {super().__str__()}
@@ -26,5 +75,3 @@ class MetacriticReviewDocument(Document):
             score: {self.score}
             game_name: {self.gameName}
             is_critic_review: {self.criticReview}"""
-
-
@@ -0,0 +1,145 @@
+# Incremental reading of large json files
+# Only the currently parsed value is held in memory, e.g. a single review of a large array of reviews,
+# so files of any size can be read with bounded memory
+import json
+from typing import Iterator, Tuple
+
+# Json whitespace characters
+WHITESPACE = ' \t\n\r'
+
+
+class JsonStreamReader:
+    """
+    Reads json values from a text file one by one
+    """
+
+    def __init__(self, f, read_size=1 << 20):
+        """
+        :param f: file opened in text mode
+        :param read_size: number of characters read from the file at once
+        """
+        self.f = f
+        self.read_size = read_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self, read_size: int) -> bool:
+        """
+        Reads more characters to the buffer, already parsed characters are dropped
+        :return: False if the end of the file was reached
+        """
+        data = self.f.read(read_size)
+        if not data:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """
+        Skips whitespace and returns the next character without consuming it, empty string at the end of the file
+        """
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill(self.read_size):
+                return ''
+
+    def read_char(self) -> str:
+        char = self.peek()
+        self.pos += len(char)
+        return char
+
+    def expect(self, expected_char: str):
+        char = self.read_char()
+        if char != expected_char:
+            raise ValueError(f'Invalid json, expected "{expected_char}" but found "{char}"')
+
+    def read_value(self):
+        """
+        Parses the next json value
+        """
+        self.peek()
+        read_size = self.read_size
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                # Value ending at the end of the buffer could continue (e.g. a number), so it is parsed again
+                # once more characters are read
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            # Read size grows, so a large value is not parsed again too many times
+            self._fill(read_size)
+            read_size *= 2
+
+
+def iter_array_items(reader: JsonStreamReader) -> Iterator:
+    """
+    Yields items of the json array at the current position of the reader
+    """
+    reader.expect('[')
+    if reader.peek() == ']':
+        reader.read_char()
+        return
+
+    while True:
+        yield reader.read_value()
+        char = reader.read_char()
+        if char == ']':
+            return
+        if char != ',':
+            raise ValueError(f'Invalid json array, expected "," or "]" but found "{char}"')
+
+
+def iter_object_array_items(reader: JsonStreamReader) -> Iterator[Tuple[str, object]]:
+    """
+    Yields items of all arrays of the json object at the current position of the reader, the object must only
+    contain arrays (e.g. {"2020": [...], "2021": [...]})
+    :return: generator of tuples of the key of the array and the item
+    """
+    reader.expect('{')
+    if reader.peek() == '}':
+        reader.read_char()
+        return
+
+    while True:
+        key = reader.read_value()
+        reader.expect(':')
+        for item in iter_array_items(reader):
+            yield key, item
+        char = reader.read_char()
+        if char == '}':
+            return
+        if char != ',':
+            raise ValueError(f'Invalid json object, expected "," or "}}" but found "{char}"')
+
+
+def iter_json_lines(f) -> Iterator:
+    """
+    Yields values of a json lines file (one json value per line), empty lines are skipped
+    """
+    for line in f:
+        if line.strip():
+            yield json.loads(line)
+
+
+def iter_json_records(f) -> Iterator:
+    """
+    Yields items of a json array file or values of a json lines file, the format is detected from the first
+    character of the file (the file must be seekable)
+    """
+    reader = JsonStreamReader(f)
+    if reader.peek() == '[':
+        yield from iter_array_items(reader)
+    else:
+        f.seek(0)
+        yield from iter_json_lines(f)
@@ -1,9 +1,12 @@
 import json
+import textwrap
+from collections import deque
 from datetime import datetime
-from typing import List
+from typing import Iterable, Iterator, List
 
 from src.doc_id_service import doc_id_service
 from src.metacritic_review_do import MetacriticReviewDocument
+from src.preprocessing.json_stream import JsonStreamReader, iter_json_records, iter_object_array_items
 
 
 class MetacriticReview:
@@ -40,41 +43,65 @@ def load_metacritic_reviews(file_path) -> List[MetacriticReview]:
     :param: file_path:
     :return: list of MetacriticReview objects
     """
+    return list(iter_metacritic_reviews(file_path))
 
-    reviews = []
+
+def iter_metacritic_reviews(file_path) -> Iterator[MetacriticReview]:
+    """
+    Lazily loads reviews from crawled json file ({year: [game, ...]}), only one game is held in memory at once
+    :param: file_path:
+    :return: generator of MetacriticReview objects
+    """
     with open(file_path, 'r', encoding='utf-8') as f:
-        # Read the json contents
-        file = json.load(f)
+        # Iterate over the games of all years
+        for year, game in iter_object_array_items(JsonStreamReader(f)):
+            # Get the game name
+            game_name = game['name']
 
-        # Iterate over the json contents
-        for year in file:
-            for game in file[year]:
-                # Get the game name
-                game_name = game['name']
-                # Get the critic reviews
-                critic_reviews = game['critic_reviews']
-                # Get the user reviews
-                user_reviews = game['userReviews']
+            # Iterate over the critic reviews
+            for review in game['critic_reviews']:
+                yield map_review(review, True, game_name)
 
-                # Iterate over the critic reviews
-                for review in critic_reviews:
-                    reviews.append(map_review(review, True, game_name))
+            # Iterate over the user reviews
+            for review in game['userReviews']:
+                yield map_review(review, False, game_name)
+
+
+def _dump_json_array(objects: Iterable[dict], f):
+    """
+    Writes the objects as json array one by one, the output is the same as json.dump with indent=4
+    """
+    f.write('[')
+    is_empty = True
+    for obj in objects:
+        f.write('\n' if is_empty else ',\n')
+        f.write(textwrap.indent(json.dumps(obj, indent=4, default=str, sort_keys=True), ' ' * 4))
+        is_empty = False
+    f.write(']' if is_empty else '\n]')
 
-                for review in user_reviews:
-                    reviews.append(map_review(review, False, game_name))
 
-        return reviews
+def serialize_unpreprocessed_metacritic_reviews(reviews: Iterable[MetacriticReview], file_path):
+    """
+    Serializes the reviews to json format, the reviews are written one by one
+    :param reviews: MetacriticReview objects, any iterable
+    :param file_path:
+    :return:
+    """
+    with open(file_path, 'w', encoding='utf-8') as f:
+        _dump_json_array((obj.__dict__ for obj in reviews), f)
 
 
-def serialize_unpreprocessed_metacritic_reviews(reviews: List[MetacriticReview], file_path):
+def serialize_unpreprocessed_metacritic_reviews_jsonl(reviews: Iterable[MetacriticReview], file_path):
     """
-    Serializes the reviews to json format
-    :param reviews: list of MetacriticReview objects
+    Serializes the reviews to json lines format (one review per line)
+    :param reviews: MetacriticReview objects, any iterable
     :param file_path:
     :return:
     """
     with open(file_path, 'w', encoding='utf-8') as f:
-        json.dump([obj.__dict__ for obj in reviews], f, indent=4, default=str, sort_keys=True)
+        for review in reviews:
+            f.write(json.dumps(review.__dict__, default=str, sort_keys=True))
+            f.write('\n')
 
 
 def deserialize_unpreprocessed_metacritic_reviews(file_path):
@@ -83,39 +110,79 @@ def deserialize_unpreprocessed_metacritic_reviews(file_path):
     :param file_path:
     :return: list of MetacriticReview objects
     """
+    return list(iter_unpreprocessed_metacritic_reviews(file_path))
+
+
+def iter_unpreprocessed_metacritic_reviews(file_path) -> Iterator[MetacriticReview]:
+    """
+    Lazily deserializes unpreprocessed reviews from json array or json lines file
+    :param file_path:
+    :return: generator of MetacriticReview objects
+    """
     with open(file_path, 'r', encoding='utf-8') as f:
-        reviews = json.load(f)
-        return [MetacriticReview(**review) for review in reviews]
+        for review in iter_json_records(f):
+            yield MetacriticReview(**review)
 
 
-def preprocess_reviews(metacritic_reviews: List[MetacriticReview], preprocessor):
+def preprocess_reviews(metacritic_reviews: List[MetacriticReview], preprocessor, workers=1, chunk_size=1000):
     """
     Preprocesses the reviews.
     :param: metacritic_reviews:
-    :param: file_path:
+    :param: preprocessor:
+    :param: workers: number of worker processes used for preprocessing, 1 preprocesses in the current process
+    :param: chunk_size: number of reviews sent to a worker at once
     :return:
     """
-    reviews = []
-    for review in metacritic_reviews:
-        try:
-            tokens = preprocessor.get_processed_tokens(review.text)
-        except ValueError:  # if we get value error the language was not recognized
-            continue
+    return list(iter_preprocessed_reviews(metacritic_reviews, preprocessor, workers=workers, chunk_size=chunk_size))
 
-        doc_id = doc_id_service.get_id()
-        reviews.append(
-            MetacriticReviewDocument(doc_id, tokens, review.game_name, review.reviewer_name, review.date_reviewed,
-                                     review.score, review.text, review.is_critic_review))
 
-    return reviews
+def iter_preprocessed_reviews(metacritic_reviews: Iterable[MetacriticReview], preprocessor, workers=1,
+                              chunk_size=1000) -> Iterator[MetacriticReviewDocument]:
+    """
+    Lazily preprocesses stream of reviews, only the reviews being preprocessed are held in memory
+    :param: metacritic_reviews: any iterable of the reviews (e.g. iter_unpreprocessed_metacritic_reviews)
+    :param: preprocessor:
+    :param: workers: number of worker processes used for preprocessing, 1 preprocesses in the current process
+    :param: chunk_size: number of reviews sent to a worker at once
+    :return: generator of the preprocessed documents
+    """
+    # Reviews waiting for their tokens, tokens are returned in the same order as the texts
+    pending_reviews = deque()
+
+    def iter_texts():
+        for review in metacritic_reviews:
+            pending_reviews.append(review)
+            yield review.text
+
+    # Document ids are assigned here in the original order, so they do not depend on the number of workers
+    for tokens in preprocessor.iter_processed_tokens(iter_texts(), workers=workers, chunk_size=chunk_size):
+        review = pending_reviews.popleft()
+        if tokens is None:  # language was not recognized
+            continue
+        doc_id = doc_id_service.get_id()
+        yield MetacriticReviewDocument(doc_id, tokens, review.game_name, review.reviewer_name, review.date_reviewed,
+                                       review.score, review.text, review.is_critic_review)
 
 
-def serialize_preprocessed_reviews(reviews: List[MetacriticReviewDocument], file_path):
+def serialize_preprocessed_reviews(reviews: Iterable[MetacriticReviewDocument], file_path):
     """
-    Serializes the preprocessed reviews to json format
-    :param reviews: list of MetacriticReviewDocument objects
+    Serializes the preprocessed reviews to json format, the reviews are written one by one
+    :param reviews: MetacriticReviewDocument objects, any iterable
     :param file_path:
     :return:
     """
     with open(file_path, 'w', encoding='utf-8') as f:
-        json.dump([obj.__dict__ for obj in reviews], f, indent=4, default=str, sort_keys=True)
+        # Pickled state of the document contains its tokens as strings instead of the term ids
+        _dump_json_array((obj.__getstate__() for obj in reviews), f)
+
+
+def deserialize_preprocessed_reviews(file_path) -> List[MetacriticReviewDocument]:
+    """
+    Deserializes preprocessed reviews saved via serialize_preprocessed_reviews
+    :param file_path:
+    :return: list of MetacriticReviewDocument objects
+    """
+    with open(file_path, 'r', encoding='utf-8') as f:
+        return [MetacriticReviewDocument(review['doc_id'], review['tokens'], review['gameName'],
+                                         review['reviewer_name'], review['dateReviewed'], review['score'],
+                                         review['text'], review['criticReview']) for review in json.load(f)]
@@ -0,0 +1,197 @@
+# Compact binary format of the preprocessed metacritic reviews
+# Tokens are stored as ids into a term dictionary, metadata as typed columns (names are dictionary encoded)
+# and texts as one utf-8 blob with offsets. All arrays are .npy files which can be memory-mapped, so loading
+# the corpus is nearly instant and no preprocessing is needed
+import json
+import os
+from array import array
+from typing import Iterable, List
+
+import numpy as np
+
+from src.metacritic_review_do import MetacriticReviewDocument, from_datetime64, to_datetime64
+from src.vocabulary import vocabulary
+
+# Version of the on-disk format written by save_preprocessed_corpus
+CORPUS_FORMAT_VERSION = 1
+
+# Number of documents converted at once when iterating over the corpus
+ITER_BLOCK_SIZE = 10_000
+
+# Arrays of the corpus, each of them is stored in a separate .npy file
+CORPUS_ARRAYS = ['doc_ids', 'token_offsets', 'token_ids', 'scores', 'dates', 'is_critic_reviews', 'game_name_ids',
+                 'reviewer_name_ids', 'text_offsets']
+
+
+class PreprocessedCorpus:
+    """
+    Read-only sequence of preprocessed reviews stored in columns. Documents are created when they are accessed
+    """
+
+    def __init__(self, terms: List[str], game_names: List[str], reviewer_names: List[str], texts: np.ndarray,
+                 doc_ids: np.ndarray, token_offsets: np.ndarray, token_ids: np.ndarray, scores: np.ndarray,
+                 dates: np.ndarray, is_critic_reviews: np.ndarray, game_name_ids: np.ndarray,
+                 reviewer_name_ids: np.ndarray, text_offsets: np.ndarray):
+        """
+        :param terms: term dictionary, token id is the position in the list
+        :param game_names: dictionary of game names
+        :param reviewer_names: dictionary of reviewer names
+        :param texts: utf-8 bytes of all texts
+        :param doc_ids: id of each document
+        :param token_offsets: start of the tokens of each document in token_ids, has len(documents) + 1 items
+        :param token_ids: token ids of all documents
+        :param scores: score of each review
+        :param dates: date of each review
+        :param is_critic_reviews: True for critic reviews, False for user reviews
+        :param game_name_ids: position of the game name of each review in game_names
+        :param reviewer_name_ids: position of the reviewer name of each review in reviewer_names
+        :param text_offsets: start of the text of each document in texts, has len(documents) + 1 items
+        """
+        self.terms = terms
+        self.game_names = game_names
+        self.reviewer_names = reviewer_names
+        self.texts = texts
+        self.doc_ids = doc_ids
+        self.token_offsets = token_offsets
+        self.token_ids = token_ids
+        self.scores = scores
+        self.dates = dates
+        self.is_critic_reviews = is_critic_reviews
+        self.game_name_ids = game_name_ids
+        self.reviewer_name_ids = reviewer_name_ids
+        self.text_offsets = text_offsets
+        self._vocabulary_ids = None
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    @property
+    def vocabulary_ids(self) -> np.ndarray:
+        """
+        Ids of the terms in the shared vocabulary, lazy initialized
+        """
+        if self._vocabulary_ids is None:
+            self._vocabulary_ids = vocabulary.add_terms(self.terms)
+        return self._vocabulary_ids
+
+    def get_token_ids(self, idx) -> np.ndarray:
+        """
+        Returns tokens of the document as ids in the shared vocabulary
+        """
+        return self.vocabulary_ids[self.token_ids[self.token_offsets[idx]:self.token_offsets[idx + 1]]]
+
+    def get_text(self, idx) -> str:
+        return bytes(self.texts[self.text_offsets[idx]:self.text_offsets[idx + 1]]).decode('utf-8')
+
+    def __getitem__(self, idx) -> MetacriticReviewDocument:
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError(f'Document index {idx} out of range')
+
+        return MetacriticReviewDocument(int(self.doc_ids[idx]), self.get_token_ids(idx),
+                                        self.game_names[self.game_name_ids[idx]],
+                                        self.reviewer_names[self.reviewer_name_ids[idx]],
+                                        from_datetime64(self.dates[idx]), float(self.scores[idx]),
+                                        self.get_text(idx), bool(self.is_critic_reviews[idx]))
+
+    def __iter__(self):
+        for start in range(0, len(self), ITER_BLOCK_SIZE):
+            yield from self._iter_block(start, min(start + ITER_BLOCK_SIZE, len(self)))
+
+    def _iter_block(self, start, end):
+        """
+        Yields documents at positions [start, end). Columns of the block are converted to Python objects at once,
+        which is much faster than accessing the documents one by one
+        """
+        token_offsets = (self.token_offsets[start:end + 1] - self.token_offsets[start]).tolist()
+        token_ids = self.vocabulary_ids[self.token_ids[self.token_offsets[start]:self.token_offsets[end]]]
+        text_offsets = (self.text_offsets[start:end + 1] - self.text_offsets[start]).tolist()
+        texts = bytes(self.texts[self.text_offsets[start]:self.text_offsets[end]])
+        columns = zip(self.doc_ids[start:end].tolist(), self.game_name_ids[start:end].tolist(),
+                      self.reviewer_name_ids[start:end].tolist(),
+                      map(from_datetime64, self.dates[start:end].astype(object).tolist()),
+                      self.scores[start:end].tolist(), self.is_critic_reviews[start:end].tolist())
+        for i, (doc_id, game_name_id, reviewer_name_id, date, score, is_critic_review) in enumerate(columns):
+            yield MetacriticReviewDocument(doc_id, token_ids[token_offsets[i]:token_offsets[i + 1]],
+                                           self.game_names[game_name_id], self.reviewer_names[reviewer_name_id],
+                                           date, score, texts[text_offsets[i]:text_offsets[i + 1]].decode('utf-8'),
+                                           is_critic_review)
+
+
+def save_preprocessed_corpus(documents: Iterable[MetacriticReviewDocument], dir_path):
+    """
+    Saves preprocessed reviews to the directory, documents are written one by one, so any iterable can be passed
+    :param documents: preprocessed reviews
+    :param dir_path: path to the directory, created if it does not exist
+    :return:
+    """
+    os.makedirs(dir_path, exist_ok=True)
+    game_name_to_id, reviewer_name_to_id = {}, {}
+    doc_ids, token_offsets, token_ids, text_offsets = array('q'), array('q', [0]), array('i'), array('q', [0])
+    scores, dates, is_critic_reviews = array('d'), array('q'), array('b')
+    game_name_ids, reviewer_name_ids = array('i'), array('i')
+    with open(os.path.join(dir_path, 'texts.bin'), 'wb') as f:
+        for document in documents:
+            doc_ids.append(document.doc_id)
+            token_ids.frombytes(document.token_ids.astype(np.int32, copy=False).tobytes())
+            token_offsets.append(len(token_ids))
+            text_offsets.append(text_offsets[-1] + f.write(document.text.encode('utf-8')))
+            scores.append(document.score)
+            dates.append(to_datetime64(document.dateReviewed).astype(np.int64))
+            is_critic_reviews.append(bool(document.criticReview))
+            game_name_ids.append(game_name_to_id.setdefault(document.gameName, len(game_name_to_id)))
+            reviewer_name_ids.append(reviewer_name_to_id.setdefault(document.reviewer_name, len(reviewer_name_to_id)))
+
+    # Ids of the shared vocabulary are mapped to dense ids of the term dictionary of the corpus
+    vocabulary_ids, corpus_token_ids = np.unique(np.frombuffer(token_ids, dtype=np.int32), return_inverse=True)
+    arrays = {
+        'doc_ids': np.frombuffer(doc_ids, dtype=np.int64), 'token_offsets': np.frombuffer(token_offsets, np.int64),
+        'token_ids': corpus_token_ids.astype(np.int32), 'scores': np.frombuffer(scores, dtype=np.float64),
+        'dates': np.frombuffer(dates, dtype=np.int64).view('datetime64[s]'),
+        'is_critic_reviews': np.frombuffer(is_critic_reviews, dtype=np.int8).astype(bool),
+        'game_name_ids': np.frombuffer(game_name_ids, dtype=np.int32),
+        'reviewer_name_ids': np.frombuffer(reviewer_name_ids, dtype=np.int32),
+        'text_offsets': np.frombuffer(text_offsets, dtype=np.int64),
+    }
+    for array_name in CORPUS_ARRAYS:
+        np.save(os.path.join(dir_path, f'{array_name}.npy'), arrays[array_name])
+
+    with open(os.path.join(dir_path, 'dictionaries.json'), 'w', encoding='utf-8') as f:
+        json.dump({'terms': vocabulary.get_terms(vocabulary_ids), 'game_names': list(game_name_to_id),
+                   'reviewer_names': list(reviewer_name_to_id)}, f, ensure_ascii=False)
+
+    # Metadata are written last so an incomplete corpus is never recognized as valid
+    with open(os.path.join(dir_path, 'corpus.json'), 'w', encoding='utf-8') as f:
+        json.dump({'version': CORPUS_FORMAT_VERSION, 'total_docs': len(doc_ids), 'total_tokens': len(token_ids)}, f)
+
+
+def load_preprocessed_corpus(dir_path, mmap=True) -> PreprocessedCorpus:
+    """
+    Loads corpus saved via save_preprocessed_corpus
+    :param dir_path: path to the directory
+    :param mmap: if True, arrays are memory-mapped (read only) instead of being read to memory
+    :return: preprocessed corpus
+    """
+    with open(os.path.join(dir_path, 'corpus.json'), 'r', encoding='utf-8') as f:
+        meta = json.load(f)
+    if meta['version'] != CORPUS_FORMAT_VERSION:
+        raise ValueError(f'Unsupported corpus format version {meta["version"]}, expected {CORPUS_FORMAT_VERSION}')
+
+    with open(os.path.join(dir_path, 'dictionaries.json'), 'r', encoding='utf-8') as f:
+        dictionaries = json.load(f)
+
+    arrays = {array_name: np.load(os.path.join(dir_path, f'{array_name}.npy'), mmap_mode='r' if mmap else None)
+              for array_name in CORPUS_ARRAYS}
+    texts_path = os.path.join(dir_path, 'texts.bin')
+    texts = np.memmap(texts_path, dtype=np.uint8, mode='r') if mmap and os.path.getsize(texts_path) > 0 \
+        else np.fromfile(texts_path, dtype=np.uint8)
+    return PreprocessedCorpus(dictionaries['terms'], dictionaries['game_names'], dictionaries['reviewer_names'],
+                              texts, **arrays)
+
+
+def preprocessed_corpus_exists(dir_path) -> bool:
+    """
+    Returns True if the directory contains a corpus saved via save_preprocessed_corpus
+    """
+    return os.path.exists(os.path.join(dir_path, 'corpus.json'))
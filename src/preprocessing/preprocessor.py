@@ -1,10 +1,15 @@
+import itertools
 import logging
 import unicodedata
-from typing import Iterable
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, Iterator, List, Optional
 
+from src.instrumentation import instrumentation
 from src.logging import logger_factory
 from src.preprocessing.czech_stemmer import CzechStemmer
 from src.preprocessing.porter_stemmer import PorterStemmer
+from src.preprocessing.stemming_cache import CachedStemmer, LruCache
 from src.preprocessing.tokenizer import Tokenizer
 from nltk.stem.porter import PorterStemmer as NLTKPorterStemmer
 import langid
@@ -50,16 +55,18 @@ class PreprocessorConfig:
 class Preprocessor:
 
     def __init__(self, config: PreprocessorConfig, stemmer, tokenizer: Tokenizer,
-                 stopwords: Iterable[str]):
+                 stopwords: Iterable[str], accents_cache_size=100_000):
         """
         :param config: config
-        :param stemmer: stemmer must have stem() method
+        :param stemmer: stemmer must have stem() method, wrap it in CachedStemmer to cache the stemmed words
         :param tokenizer: tokenizer must have tokenize() method
+        :param accents_cache_size: maximum number of tokens with removed accents that are cached
         """
         self.config = config
         self.stemmer = stemmer
         self.tokenizer = tokenizer
         self.stopwords = stopwords if stopwords else []
+        self.accents_cache = LruCache(accents_cache_size)
 
     def get_processed_tokens(self, text):
         """
@@ -70,7 +77,8 @@ class Preprocessor:
 
         # First recognize the language via
         if self.config.recognize_lang:
-            lang, _ = langid.classify(text)
+            with instrumentation.stage('language_detection'):
+                lang, _ = langid.classify(text)
 
             # If the language is different raise an exception that must be caught by the caller
             if lang != self.config.lang:
@@ -84,7 +92,9 @@ class Preprocessor:
 
         # If tokenizer is not passed the text is split by whitespaces
         # Otherwise the tokenize method is called
-        tokens = self.tokenizer.tokenize(text, self.config.remove_punctuation) if self.tokenizer else text.split(' ')
+        with instrumentation.stage('tokenization'):
+            tokens = self.tokenizer.tokenize(text, self.config.remove_punctuation) if self.tokenizer else \
+                text.split(' ')
 
         # Remove stop words if toggled
         if self.config.remove_stopwords:
@@ -92,15 +102,65 @@ class Preprocessor:
 
         # Stem the tokens (skipped if stemmer is not passed)
         if self.stemmer:
-            tokens = [self.stemmer.stem(token) for token in tokens]
+            with instrumentation.stage('stemming'):
+                tokens = [self.stemmer.stem(token) for token in tokens]
 
         # Remove accents after stemming if toggled
         if self.config.remove_accents_after_stemming:
-            tokens = [self._remove_accents(token) for token in tokens]
+            tokens = [self.accents_cache.get_or_compute(token, self._remove_accents) for token in tokens]
 
         # logger.info(f'Preprocessed text: {text}')
         return tokens  # return list of tokens (terms)
 
+    def get_processed_tokens_batch(self, texts: List[str], workers=1,
+                                   chunk_size=1000) -> List[Optional[List[str]]]:
+        """
+        Preprocesses multiple texts, optionally in parallel in a process pool
+        :param texts: texts to be preprocessed
+        :param workers: number of worker processes, texts are preprocessed in the current process if workers <= 1
+        :param chunk_size: number of texts sent to a worker at once
+        :return: list of terms for each text in the same order as the texts, None for texts
+                 whose language was not recognized
+        """
+        return list(self.iter_processed_tokens(texts, workers=workers, chunk_size=chunk_size))
+
+    def iter_processed_tokens(self, texts: Iterable[str], workers=1,
+                              chunk_size=1000) -> Iterator[Optional[List[str]]]:
+        """
+        Lazily preprocesses stream of texts, optionally in parallel in a process pool. At most 2 * workers chunks
+        are processed at once, so the memory is bounded by the chunk size instead of the number of texts
+        :param texts: texts to be preprocessed, any iterable (e.g. generator reading the texts from a file)
+        :param workers: number of worker processes, texts are preprocessed in the current process if workers <= 1
+        :param chunk_size: number of texts sent to a worker at once
+        :return: generator of terms for each text in the same order as the texts, None for texts
+                 whose language was not recognized
+        """
+        texts = iter(texts)
+        chunks = iter(lambda: list(itertools.islice(texts, chunk_size)), [])
+        if workers <= 1:
+            for chunk in chunks:
+                yield from _get_processed_tokens_chunk(chunk, self)
+            return
+
+        # Preprocessor is sent to each worker only once, results are yielded in the order of the chunks
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(self,)) as executor:
+            futures = deque()
+            for chunk in chunks:
+                futures.append(executor.submit(_get_processed_tokens_chunk, chunk))
+                if len(futures) >= 2 * workers:
+                    yield from futures.popleft().result()
+            while futures:
+                yield from futures.popleft().result()
+
+    def get_cache_stats(self) -> dict:
+        """
+        Returns statistics of the stemming and accent removal caches
+        """
+        stats = {'accents': self.accents_cache.get_stats()}
+        if isinstance(self.stemmer, CachedStemmer):
+            stats['stemmer'] = self.stemmer.cache.get_stats()
+        return stats
+
     @staticmethod
     def _remove_accents(text) -> str:
         """
@@ -113,6 +173,29 @@ class Preprocessor:
                          if not unicodedata.combining(c)])
 
 
+# Preprocessor of the current worker process, set by the process pool initializer
+_worker_preprocessor: Optional[Preprocessor] = None
+
+
+def _init_worker(preprocessor: Preprocessor):
+    global _worker_preprocessor
+    _worker_preprocessor = preprocessor
+
+
+def _get_processed_tokens_chunk(texts: List[str], preprocessor: Preprocessor = None) -> List[Optional[List[str]]]:
+    """
+    Preprocesses chunk of texts, worker's preprocessor is used if the preprocessor is not passed
+    """
+    preprocessor = preprocessor if preprocessor else _worker_preprocessor
+    results = []
+    for text in texts:
+        try:
+            results.append(preprocessor.get_processed_tokens(text))
+        except ValueError:  # language of the text was not recognized
+            results.append(None)
+    return results
+
+
 def _load_czech_stopwords():
     """
     Loads Czech stop words from file.
@@ -132,12 +215,12 @@ def _load_english_stopwords():
 _tokenizer = Tokenizer()
 
 # Default instances
-czech_preprocessor = Preprocessor(PreprocessorConfig('cs', remove_stopwords=True), CzechStemmer(), _tokenizer,
-                                  _load_czech_stopwords())
-english_preprocessor = Preprocessor(PreprocessorConfig('en', remove_stopwords=True), PorterStemmer(), _tokenizer,
-                                    _load_english_stopwords())
+czech_preprocessor = Preprocessor(PreprocessorConfig('cs', remove_stopwords=True), CachedStemmer(CzechStemmer()),
+                                  _tokenizer, _load_czech_stopwords())
+english_preprocessor = Preprocessor(PreprocessorConfig('en', remove_stopwords=True), CachedStemmer(PorterStemmer()),
+                                    _tokenizer, _load_english_stopwords())
 
 metacritic_preprocessor = Preprocessor(
     PreprocessorConfig('en', remove_stopwords=True, to_lowercase=True, remove_accents_before_stemming=True,
-                       remove_accents_after_stemming=True, remove_punctuation=True), NLTKPorterStemmer(), _tokenizer,
-    _load_english_stopwords())
+                       remove_accents_after_stemming=True, remove_punctuation=True), CachedStemmer(NLTKPorterStemmer()),
+    _tokenizer, _load_english_stopwords())
@@ -0,0 +1,85 @@
+import threading
+from collections import OrderedDict
+
+
+class LruCache:
+    """
+    Bounded cache with least recently used eviction, counts hits and misses.
+    Words in natural language texts follow Zipf's law, so even a small cache serves most of the lookups
+    """
+
+    def __init__(self, max_size: int):
+        """
+        :param max_size: maximum number of cached items
+        """
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, key, compute):
+        """
+        Returns cached value for the key, the value is computed and cached if it is not present
+        :param key: key of the value
+        :param compute: function computing the value from the key
+        :return: value
+        """
+        with self._lock:
+            if key in self._items:
+                self.hits += 1
+                self._items.move_to_end(key)
+                return self._items[key]
+
+        value = compute(key)
+        with self._lock:
+            self.misses += 1
+            self._items[key] = value
+            if len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.hits = 0
+            self.misses = 0
+
+    @property
+    def hit_ratio(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups > 0 else 0.0
+
+    def get_stats(self) -> dict:
+        return {'size': len(self._items), 'max_size': self.max_size, 'hits': self.hits, 'misses': self.misses,
+                'hit_ratio': self.hit_ratio}
+
+    def __len__(self):
+        return len(self._items)
+
+    def __getstate__(self):
+        # Lock cannot be pickled (e.g. when the preprocessor is sent to a worker process)
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+
+class CachedStemmer:
+    """
+    Wraps any stemmer (object with stem() method) and caches its results
+    """
+
+    def __init__(self, stemmer, max_size=100_000):
+        """
+        :param stemmer: stemmer must have stem() method
+        :param max_size: maximum number of cached words
+        """
+        self.stemmer = stemmer
+        self.cache = LruCache(max_size)
+
+    def stem(self, word):
+        return self.cache.get_or_compute(word, self.stemmer.stem)
@@ -1,4 +1,5 @@
 import string
+from typing import Iterator, List
 
 import regex as re
 
@@ -6,55 +7,48 @@ import regex as re
 class Tokenizer:
     """
     Default tokenizer
+    All token patterns are combined into one compiled alternation, so the text is scanned only once
+    and the tokens are produced in the order in which they appear in the text
     """
 
-    DEFAULT_REGEX = r'(\d+[.,](\d+)?)|([\p{L}\d]+)|(<.*?>)|([\p{Punct}])'
-    URL_REGEX = r'(https?:\/\/(?:www\.|(?!www))[a-zA-Z0-9][a-zA-Z0-9-]+[a-zA-Z0-9]\.[^\s]{2,}|www\.[a-zA-Z0-9][' \
+    # Tokens never contain a space, the patterns which could match whitespace only match other whitespace characters
+    URL_REGEX = r'https?:\/\/(?:www\.|(?!www))[a-zA-Z0-9][a-zA-Z0-9-]+[a-zA-Z0-9]\.[^\s]{2,}|www\.[a-zA-Z0-9][' \
                 r'a-zA-Z0-9-]+[a-zA-Z0-9]\.[^\s]{2,}|https?:\/\/(?:www\.|(?!www))[a-zA-Z0-9]+\.[^\s]{2,' \
-                r'}|www\.[a-zA-Z0-9]+\.[^\s]{2,})/ '
+                r'}|www\.[a-zA-Z0-9]+\.[^\s]{2,}'
+    DATE_REGEX = r'\d{1,2}\.[^\S ]?\d{1,2}\.[^\S ]*\d{0,4}'
     CENSORED_REGEX = r'[\w+À-ž]+\*[\w+À-ž]*|[\w+À-ž]*\*[\w+À-ž]+'
-    DATE_REGEX = r'\d{1,2}\.\s?\d{1,2}\.\s*\d{0,4}'
+    DEFAULT_REGEX = r'\d+[.,](?:\d+)?|[\p{L}\d]+|<[^ \n]*?>|[\p{Punct}]'
+
+    # Alternatives are tried in this order at each position, so the more specific patterns go first
+    TOKEN_REGEX = re.compile('|'.join(f'(?:{regex})' for regex in [URL_REGEX, DATE_REGEX, CENSORED_REGEX,
+                                                                     DEFAULT_REGEX]))
 
     # Regex used to filter out all non-latin characters - e.g chinese, japanese, etc.
-    BASIC_LATIN_CHARACTERS = r'[\p{IsCyrillic}\p{Han}\p{Hiragana}\p{Katakana}\u0600-\u06FF]'
+    BASIC_LATIN_CHARACTERS = re.compile(r'[\p{IsCyrillic}\p{Han}\p{Hiragana}\p{Katakana}\u0600-\u06FF]')
 
-    def __init__(self):
-        self.regexes = [Tokenizer.DEFAULT_REGEX, Tokenizer.URL_REGEX, Tokenizer.CENSORED_REGEX, Tokenizer.DATE_REGEX]
+    PUNCTUATION_TABLE = str.maketrans('', '', string.punctuation)
 
-    def tokenize(self, text: str, remove_punctuation: bool):
+    def tokenize(self, text: str, remove_punctuation: bool) -> List[str]:
         """
         Tokenize text
         :param remove_punctuation:
         :param text: text to tokenize
         :return: list of tokens
         """
+        return list(self.iter_tokens(text, remove_punctuation))
 
+    def iter_tokens(self, text: str, remove_punctuation: bool) -> Iterator[str]:
+        """
+        Lazily tokenizes the text, tokens are yielded in the order in which they appear in the text
+        :param text: text to tokenize
+        :param remove_punctuation: if True, punctuation is removed before tokenization
+        :return: generator of tokens
+        """
         # Remove all non-latin characters
-        text = re.sub(Tokenizer.BASIC_LATIN_CHARACTERS, '', text)
+        text = Tokenizer.BASIC_LATIN_CHARACTERS.sub('', text)
 
         if remove_punctuation:
-            text = text.translate(str.maketrans('', '', string.punctuation))
-
-        # For each regex, find all matches and add them to the set
-        tokens = []
-        split_by_ws = text.split(' ')
-        for regex in self.regexes:
-            for text_by_ws in split_by_ws:
-                tokens.extend(self._get_all_regex_items(regex, text_by_ws))
-
-        return tokens
-
-    @staticmethod
-    def _get_all_regex_items(regex, text):
-        groups = re.findall(regex, text)
-        items = []
-        for group in groups:
-            if type(group) == tuple:
-                for item in filter(lambda x: x != '', group):
-                    items.append(item)
-                continue
-
-            if group != '':
-                items.append(group)
-
-        return items
+            text = text.translate(Tokenizer.PUNCTUATION_TABLE)
+
+        for match in Tokenizer.TOKEN_REGEX.finditer(text):
+            yield match.group()
@@ -0,0 +1,504 @@
+# Log-structured (segmented) tf-idf index
+# New documents are added to a small in-memory segment, which is sealed into an immutable on-disk segment once it
+# reaches a size threshold. Sealed segments are merged by a background thread. Searches fan out over all segments,
+# scores are combined using global document frequencies, so they are comparable across the segments
+import heapq
+import json
+import os
+import shutil
+import threading
+from typing import List, Tuple, Dict
+
+import numpy as np
+
+from src.compiled_query import CompiledQuery
+from src.document import Document, get_bows
+from src.document_store import DocumentStore, load_documents, merge_documents, save_documents
+from src.logging import logger_factory
+from src.sparse_tf_idf import SparseTfIdfIndex, create_sparse_tfidf_idx, load_sparse_tfidf_idx, \
+    merge_sparse_tfidf_idxs, save_sparse_tfidf_idx
+from src.tf_idf import InvertedIndex, get_idf, get_tf_weights
+from src.vocabulary import vocabulary
+
+logger = logger_factory.get_logger(__name__)
+
+
+class DiskSegment:
+    """
+    Immutable segment stored on disk. Only the deletion mask and the norms of the document vectors
+    (which depend on the global statistics) are held in memory
+    """
+
+    def __init__(self, name: str, dir_path: str):
+        self.name = name
+        self.dir_path = dir_path
+        self.sparse_idx: SparseTfIdfIndex = load_sparse_tfidf_idx(dir_path)
+        self.documents: DocumentStore = load_documents(dir_path)
+
+        deleted_path = os.path.join(dir_path, 'deleted.npy')
+        self.deleted = np.load(deleted_path) if os.path.exists(deleted_path) \
+            else np.zeros(self.sparse_idx.total_docs, dtype=bool)
+        self.norms = np.zeros(self.sparse_idx.total_docs, dtype=np.float32)
+        self.norms_generation = -1  # generation of the global statistics used for the norms
+
+    @property
+    def live_docs(self):
+        return int(self.sparse_idx.total_docs - np.count_nonzero(self.deleted))
+
+    def get_live_df(self) -> np.ndarray:
+        """
+        Returns document frequency of each term of the segment without the deleted documents
+        """
+        is_live = ~self.deleted[self.sparse_idx.posting_doc_idxs]
+        return np.bincount(self.sparse_idx._get_posting_term_ids()[is_live], minlength=len(self.sparse_idx))
+
+    def delete_document(self, doc_id) -> Document:
+        """
+        Marks the document as deleted
+        :param doc_id: id of the document
+        :return: deleted document
+        """
+        idx = self.sparse_idx.doc_id_to_idx[doc_id]
+        self.deleted[idx] = True
+        np.save(os.path.join(self.dir_path, 'deleted.npy'), self.deleted)
+        return self.documents[idx]
+
+    def calculate_norms(self, idf: np.ndarray, generation: int):
+        """
+        Calculates norms of the document vectors using the global idf
+        :param idf: global idf of each term of the segment
+        :param generation: generation of the global statistics
+        :return:
+        """
+        weights = self.sparse_idx.posting_tf_weights * idf[self.sparse_idx._get_posting_term_ids()]
+        squared_sums = np.bincount(self.sparse_idx.posting_doc_idxs, weights=np.square(weights, dtype=np.float64),
+                                   minlength=self.sparse_idx.total_docs)
+        # The norms array is swapped at once, so concurrent queries always see consistent norms
+        self.norms = np.sqrt(squared_sums).astype(np.float32)
+        self.norms_generation = generation
+
+    def get_top_n(self, term_weights: Dict[str, float], query_norm: float, n: int) -> List[Tuple[float, Document]]:
+        accumulators = np.zeros(self.sparse_idx.total_docs, dtype=np.float64)
+        for term, term_weight in term_weights.items():
+            if term not in self.sparse_idx:
+                continue
+            term_id = self.sparse_idx.term_to_id[term]
+            start, end = self.sparse_idx.term_offsets[term_id], self.sparse_idx.term_offsets[term_id + 1]
+            accumulators[self.sparse_idx.posting_doc_idxs[start:end]] += \
+                term_weight * self.sparse_idx.posting_tf_weights[start:end]
+
+        norms = self.norms
+        candidates = np.flatnonzero(accumulators)
+        candidates = candidates[~self.deleted[candidates] & (norms[candidates] > 0)]
+        scores = np.minimum(accumulators[candidates] / (norms[candidates] * query_norm), 1.0)
+        if len(scores) > n:
+            top_n = np.argpartition(-scores, n)[:n]
+            candidates, scores = candidates[top_n], scores[top_n]
+        return [(float(score), self.documents[idx]) for score, idx in zip(scores, candidates)]
+
+
+class MemorySegment:
+    """
+    Mutable in-memory segment backed by the object-graph inverted index
+    """
+
+    def __init__(self):
+        self.inverted_idx = InvertedIndex(calculate_norms=False)  # documents are normalized with the global idf
+        # Postings of the added documents (position of the document, vocabulary term id, tf weight), appended
+        # in chunks by add_documents and concatenated when the norms are calculated
+        self.posting_chunks: List[Tuple[np.ndarray, np.ndarray, np.ndarray]] = []
+        self.norms = np.empty(0, dtype=np.float64)  # norm of each document by its position in the inverted index
+        self.norms_generation = -1  # generation of the global statistics used for the norms
+
+    @property
+    def live_docs(self):
+        return self.inverted_idx.total_docs
+
+    def add_documents(self, documents: List[Document]):
+        first_idx = len(self.inverted_idx.documents)
+        self.inverted_idx.add_documents(documents)
+        posting_doc_idxs, posting_term_ids, posting_tfs = get_bows(documents)
+        # Log weighting only depends on the term frequencies
+        posting_tf_weights = get_tf_weights(posting_tfs, None, None, None, 'log')
+        self.posting_chunks.append((posting_doc_idxs + first_idx, posting_term_ids, posting_tf_weights))
+
+    def calculate_norms(self, segmented_idx):
+        """
+        Calculates norms of the document vectors using the global idf (must be called under the lock of the
+        segmented index). Postings of all documents are weighted at once, idf is only looked up for the terms
+        of the segment
+        """
+        if len(self.posting_chunks) > 1:
+            self.posting_chunks = [tuple(np.concatenate(postings) for postings in zip(*self.posting_chunks))]
+        posting_doc_idxs, posting_term_ids, posting_tf_weights = self.posting_chunks[0] if self.posting_chunks \
+            else (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int32), np.empty(0))
+
+        # Idf is indexed by the vocabulary term id, terms only held by the deleted documents get zero idf
+        # (the norms of the deleted documents are never used)
+        terms = list(self.inverted_idx.keys())
+        term_ids = vocabulary.add_terms(terms)
+        dfs = np.fromiter(map(segmented_idx.global_df.__getitem__, terms), dtype=np.float64, count=len(terms))
+        idf = np.zeros(int(posting_term_ids.max(initial=-1)) + 1, dtype=np.float64)
+        idf[term_ids] = np.log10(segmented_idx.total_docs / dfs)
+        squared_sums = np.bincount(posting_doc_idxs, weights=np.square(posting_tf_weights * idf[posting_term_ids]),
+                                   minlength=len(self.inverted_idx.documents))
+        self.norms = np.sqrt(squared_sums)
+        self.norms_generation = segmented_idx.generation
+
+    def get_top_n(self, term_weights: Dict[str, float], query_norm: float, n: int,
+                  segmented_idx) -> List[Tuple[float, Document]]:
+        accumulators = {}
+        for term, term_weight in term_weights.items():
+            if term not in self.inverted_idx:
+                continue
+            for doc_id, document_stats in self.inverted_idx[term].documents.items():
+                accumulators[doc_id] = accumulators.get(doc_id, 0.0) + term_weight * document_stats.tf_weight
+
+        if accumulators and self.norms_generation != segmented_idx.generation:
+            self.calculate_norms(segmented_idx)
+        results = []
+        for doc_id, dot_product in accumulators.items():
+            idx = self.inverted_idx.doc_id_to_idx[doc_id]
+            doc_norm = self.norms[idx]
+            if doc_norm == 0:
+                continue
+            # Scores are clamped, rounding errors could push the similarity of identical vectors over 1
+            score = min(float(dot_product / (doc_norm * query_norm)), 1.0)
+            results.append((score, self.inverted_idx.documents[idx]))
+        return heapq.nlargest(n, results, key=lambda x: x[0])
+
+
+class SegmentedIndex:
+    """
+    Log-structured tf-idf index consisting of one in-memory segment and immutable on-disk segments.
+    Writes only lock the small in-memory segment, sealing and merging run in a background thread,
+    so ingestion never blocks queries on the sealed segments
+    """
+
+    def __init__(self, dir_path, seal_threshold=10_000, merge_factor=4, background=True):
+        """
+        Opens the index in the directory, existing segments are loaded
+        :param dir_path: directory of the index
+        :param seal_threshold: number of documents in the in-memory segment that triggers sealing
+        :param merge_factor: number of sealed segments that triggers merging of the segments
+        :param background: if True, sealing and merging run in a background thread, otherwise synchronously
+        """
+        self.dir_path = dir_path
+        self.seal_threshold = seal_threshold
+        self.merge_factor = merge_factor
+        self.tf_weighting = 'log'  # segments are always weighted by log term frequency
+        os.makedirs(dir_path, exist_ok=True)
+
+        self.lock = threading.RLock()  # guards the in-memory segments and the list of segments
+        self.maintenance_lock = threading.Lock()  # only one thread seals or merges the segments at a time
+        self.memory_segment = MemorySegment()
+        self.sealing_segments: List[MemorySegment] = []  # full in-memory segments waiting to be written to disk
+        self.disk_segments: List[DiskSegment] = []
+        self.doc_id_to_segment = {}
+
+        # Global statistics over all segments
+        self.global_df: Dict[str, int] = {}
+        self.total_docs = 0
+        self.generation = 0  # incremented with every change of the global statistics
+        self._next_segment_id = 0
+
+        self._load_segments()
+
+        self.background = background
+        self._work_available = threading.Condition(self.lock)
+        self._closed = False
+        self._worker = None
+        if background:
+            self._worker = threading.Thread(target=self._run_background_work, name='segment-merger', daemon=True)
+            self._worker.start()
+
+    def _load_segments(self):
+        manifest_path = os.path.join(self.dir_path, 'segments.json')
+        if not os.path.exists(manifest_path):
+            return
+
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        self._next_segment_id = manifest['next_segment_id']
+        for name in manifest['segments']:
+            segment = DiskSegment(name, os.path.join(self.dir_path, name))
+            self.disk_segments.append(segment)
+            self._register_disk_segment(segment)
+            for term, df in zip(segment.sparse_idx.terms, segment.get_live_df().tolist()):
+                if df > 0:
+                    self.global_df[term] = self.global_df.get(term, 0) + df
+            self.total_docs += segment.live_docs
+
+        self.generation += 1
+        for segment in self.disk_segments:
+            self._refresh_norms(segment)
+
+    def _register_disk_segment(self, segment: DiskSegment):
+        for idx, doc_id in enumerate(segment.sparse_idx.doc_ids.tolist()):
+            if not segment.deleted[idx]:
+                self.doc_id_to_segment[doc_id] = segment
+
+    def _write_manifest(self):
+        manifest_path = os.path.join(self.dir_path, 'segments.json')
+        with open(manifest_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump({'next_segment_id': self._next_segment_id,
+                       'segments': [segment.name for segment in self.disk_segments]}, f)
+        os.replace(manifest_path + '.tmp', manifest_path)  # atomic, so a crash never leaves a broken manifest
+
+    def __len__(self):
+        return len(self.global_df)
+
+    def __contains__(self, term):
+        return self.global_df.get(term, 0) > 0
+
+    def __iter__(self):
+        return iter(list(self.global_df.keys()))
+
+    def keys(self):
+        return list(self.global_df.keys())
+
+    def get_max_doc_id(self) -> int:
+        """
+        Returns the largest id of the documents in all segments (including the deleted ones), -1 if there are none
+        """
+        with self.lock:
+            doc_ids = [segment.sparse_idx.doc_ids for segment in self.disk_segments] + \
+                      [segment.inverted_idx.doc_ids for segment in [self.memory_segment] + self.sealing_segments]
+        return int(max((ids.max() for ids in doc_ids if len(ids) > 0), default=-1))
+
+    def get_df(self, term) -> int:
+        return self.global_df[term]
+
+    def get_idf(self, term) -> float:
+        # Queries are weighted while the index is being updated, so the statistics are read under the lock
+        # and terms deleted in the meantime get zero idf
+        with self.lock:
+            df = self.global_df.get(term, 0)
+            return get_idf(self.total_docs, df) if df > 0 else 0.0
+
+    def add_documents(self, documents: List[Document]):
+        """
+        Adds documents to the in-memory segment, the documents are searchable immediately
+        :param documents: preprocessed documents
+        :return:
+        """
+        with self.lock:
+            for document in documents:
+                if document.doc_id in self.doc_id_to_segment:
+                    raise ValueError(f'Document with id {document.doc_id} is already indexed')
+
+            self.memory_segment.add_documents(documents)
+            for document in documents:
+                self.doc_id_to_segment[document.doc_id] = self.memory_segment
+                for term in document.bow.keys():
+                    self.global_df[term] = self.global_df.get(term, 0) + 1
+            self.total_docs += len(documents)
+            self.generation += 1
+
+            if self.memory_segment.live_docs < self.seal_threshold:
+                return
+            self.sealing_segments.append(self.memory_segment)
+            self.memory_segment = MemorySegment()
+            if self.background:
+                self._work_available.notify_all()
+                return
+
+        # Without background thread the segments are sealed and merged by the writer (outside the lock,
+        # so queries are not blocked)
+        self._seal_pending_segments()
+        self._merge_segments()
+
+    def delete_documents(self, doc_ids: List[int]):
+        """
+        Deletes documents from the index. Documents in the sealed segments are only marked as deleted,
+        they are dropped when the segments are merged
+        :param doc_ids: ids of the documents to delete
+        :return:
+        """
+        with self.lock:
+            # All ids are validated before the global statistics are changed
+            for doc_id in doc_ids:
+                if doc_id not in self.doc_id_to_segment:
+                    raise ValueError(f'Document with id {doc_id} is not indexed')
+            if len(set(doc_ids)) != len(doc_ids):
+                raise ValueError('Deleted documents must have unique ids')
+
+            for doc_id in doc_ids:
+                segment = self.doc_id_to_segment.pop(doc_id)
+                if isinstance(segment, MemorySegment):
+                    inverted_idx = segment.inverted_idx
+                    document = inverted_idx.documents[inverted_idx.doc_id_to_idx[doc_id]]
+                    inverted_idx.delete_documents([doc_id])
+                else:
+                    document = segment.delete_document(doc_id)
+
+                for term in document.bow.keys():
+                    self.global_df[term] -= 1
+                    if self.global_df[term] == 0:
+                        del self.global_df[term]
+            self.total_docs -= len(doc_ids)
+            self.generation += 1
+
+    def get_top_n(self, query: CompiledQuery, n: int) -> List[Tuple[float, Document]]:
+        """
+        Searches all segments and merges their top n results
+        :param query: compiled query (weighted with the global idf)
+        :param n: number of returned documents
+        :return: top n documents with their cosine similarity
+        """
+        query_norm = query.norm
+        # In-memory segments are mutable, so they are searched under the lock (they are small). Weights are
+        # calculated under the same lock, so the global statistics do not change between weighting and scoring
+        with self.lock:
+            # Idf is applied once per term, postings in all segments only hold the tf weights
+            term_weights = {term: query_weight * self.get_idf(term) for term, query_weight in
+                            zip(query.terms, query.weights.tolist()) if term in self}
+            results = []
+            for segment in [self.memory_segment] + self.sealing_segments:
+                results.extend(segment.get_top_n(term_weights, query_norm, n, self))
+            disk_segments = list(self.disk_segments)
+
+        # Disk segments are immutable, so they can be searched while the index is being updated
+        for segment in disk_segments:
+            if not self.background and segment.norms_generation != self.generation:
+                self._refresh_norms(segment)
+            results.extend(segment.get_top_n(term_weights, query_norm, n))
+
+        return heapq.nlargest(n, results, key=lambda x: x[0])
+
+    def flush(self):
+        """
+        Seals the in-memory segment and waits until all pending segments are written to disk
+        :return:
+        """
+        with self.lock:
+            if self.memory_segment.live_docs > 0:
+                self.sealing_segments.append(self.memory_segment)
+                self.memory_segment = MemorySegment()
+        self._seal_pending_segments()
+
+    def close(self):
+        """
+        Flushes the in-memory segment and stops the background thread
+        :return:
+        """
+        self.flush()
+        with self.lock:
+            self._closed = True
+            self._work_available.notify_all()
+        if self._worker is not None:
+            self._worker.join()
+
+    def _run_background_work(self):
+        while True:
+            with self.lock:
+                while not self._closed and not self._has_work():
+                    # Wake up periodically to refresh norms of the segments after changes of global statistics
+                    self._work_available.wait(timeout=1.0)
+                    if any(segment.norms_generation != self.generation for segment in self.disk_segments):
+                        break
+                if self._closed:
+                    return
+
+            try:
+                self._seal_pending_segments()
+                self._merge_segments()
+                for segment in list(self.disk_segments):
+                    self._refresh_norms(segment)
+            except Exception:  # the worker must keep running, failed work is retried on the next wakeup
+                logger.exception('Background segment work failed')
+
+    def _has_work(self):
+        return len(self.sealing_segments) > 0 or len(self.disk_segments) >= self.merge_factor
+
+    def _new_segment_dir(self):
+        with self.lock:
+            name = f'segment_{self._next_segment_id:06d}'
+            self._next_segment_id += 1
+        return name, os.path.join(self.dir_path, name)
+
+    def _refresh_norms(self, segment: DiskSegment):
+        with self.lock:
+            generation = self.generation
+            idf = np.array([get_idf(self.total_docs, self.global_df[term]) if term in self else 0.0
+                            for term in segment.sparse_idx.terms], dtype=np.float32)
+        segment.calculate_norms(idf, generation)
+
+    def _seal_pending_segments(self):
+        """
+        Writes full in-memory segments to disk, the in-memory segment stays searchable until its disk segment
+        replaces it
+        """
+        with self.maintenance_lock:
+            self._seal_pending_segments_locked()
+
+    def _seal_pending_segments_locked(self):
+        while True:
+            with self.lock:
+                if not self.sealing_segments:
+                    return
+                memory_segment = self.sealing_segments[0]
+                inverted_idx = memory_segment.inverted_idx
+                documents = [document for document in inverted_idx.documents if document is not None]
+
+            name, segment_dir = self._new_segment_dir()
+            save_documents(documents, segment_dir)
+            save_sparse_tfidf_idx(create_sparse_tfidf_idx(documents), segment_dir)
+            segment = DiskSegment(name, segment_dir)
+            self._refresh_norms(segment)
+
+            with self.lock:
+                # Apply deletes that happened while the segment was being written
+                for idx, doc_id in enumerate(segment.sparse_idx.doc_ids.tolist()):
+                    if doc_id not in inverted_idx.doc_id_to_idx:
+                        segment.deleted[idx] = True
+                np.save(os.path.join(segment_dir, 'deleted.npy'), segment.deleted)
+
+                self.disk_segments.append(segment)
+                self._register_disk_segment(segment)
+                self.sealing_segments.remove(memory_segment)
+                self._write_manifest()
+            logger.info(f'Sealed segment {name} with {segment.live_docs} documents')
+
+    def _merge_segments(self):
+        """
+        Merges the smallest sealed segments until there are less than merge_factor segments,
+        deleted documents are dropped
+        """
+        with self.maintenance_lock:
+            while self._merge_segments_locked():
+                pass
+
+    def _merge_segments_locked(self) -> bool:
+        with self.lock:
+            if len(self.disk_segments) < self.merge_factor:
+                return False
+            segments = sorted(self.disk_segments, key=lambda x: x.live_docs)[:self.merge_factor]
+            live_masks = [~segment.deleted.copy() for segment in segments]
+
+        name, segment_dir = self._new_segment_dir()
+        merge_documents([segment.documents for segment in segments], live_masks, segment_dir)
+        save_sparse_tfidf_idx(merge_sparse_tfidf_idxs([segment.sparse_idx for segment in segments], live_masks),
+                              segment_dir)
+        merged_segment = DiskSegment(name, segment_dir)
+        self._refresh_norms(merged_segment)
+
+        with self.lock:
+            # Apply deletes that happened during the merge
+            merged_doc_id_to_idx = merged_segment.sparse_idx.doc_id_to_idx
+            for segment, live_mask in zip(segments, live_masks):
+                for idx in np.flatnonzero(live_mask & segment.deleted):
+                    merged_segment.deleted[merged_doc_id_to_idx[int(segment.sparse_idx.doc_ids[idx])]] = True
+            np.save(os.path.join(segment_dir, 'deleted.npy'), merged_segment.deleted)
+
+            self.disk_segments = [segment for segment in self.disk_segments if segment not in segments]
+            self.disk_segments.append(merged_segment)
+            self._register_disk_segment(merged_segment)
+            self._write_manifest()
+
+        # Queries that already hold the old segments may still read them, their files are removed on a best effort
+        # basis (on Linux the mapped pages stay valid until they are unmapped)
+        for segment in segments:
+            shutil.rmtree(segment.dir_path, ignore_errors=True)
+        logger.info(f'Merged {len(segments)} segments into {name} with {merged_segment.live_docs} documents')
+        return True
@@ -0,0 +1,295 @@
+# Sharded tf-idf index
+# Documents are partitioned into shards, each shard has its own posting arrays and is searched by its own worker
+# process. All shards share the global vocabulary (term ids) and the global idf and document norms, so scores
+# of the shards are comparable. Queries are scattered to all shard workers at once and their top n results are
+# merged. Workers communicate with the coordinator through pipes (a local stand-in for RPC)
+import heapq
+import json
+import multiprocessing
+import os
+import threading
+from collections import deque
+from concurrent.futures import Future
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+from src.compiled_query import CompiledQuery
+from src.document import Document
+from src.document_store import load_documents, save_documents
+from src.logging import logger_factory
+from src.max_score import max_score_top_n
+from src.sparse_tf_idf import SparseTfIdfIndex, create_sparse_tfidf_idx, load_sparse_tfidf_idx, \
+    save_sparse_tfidf_idx
+
+logger = logger_factory.get_logger(__name__)
+
+
+def _run_shard_worker(connection, shard_source):
+    """
+    Main loop of the shard worker, requests are tuples of method name and arguments
+    :param connection: connection to the coordinator
+    :param shard_source: directory of the shard or tuple of the shard index and its documents
+    """
+    if isinstance(shard_source, str):
+        sparse_idx, documents = load_sparse_tfidf_idx(shard_source), load_documents(shard_source)
+    else:
+        sparse_idx, documents = shard_source
+
+    while True:
+        method, args = connection.recv()
+        if method == 'close':
+            break
+
+        try:
+            if method == 'get_top_n':
+                query_weights, query_norm, n = args
+                doc_idxs, scores = max_score_top_n(sparse_idx, query_weights, query_norm, n)
+                # Scores are clamped like those of the other backends (rounding errors could exceed 1)
+                result = [(min(float(score), 1.0), documents[doc_idx]) for doc_idx, score in zip(doc_idxs, scores)]
+            elif method == 'save':
+                save_documents(documents, args[0])
+                save_sparse_tfidf_idx(sparse_idx, args[0])
+                result = None
+            else:
+                raise ValueError(f'Unknown method {method}')
+            connection.send((True, result))
+        except Exception as e:
+            connection.send((False, e))
+    connection.close()
+
+
+class ShardWorkerError(RuntimeError):
+    """
+    Raised when the connection to a shard worker failed (e.g. the worker died), the index must be reopened
+    """
+    pass
+
+
+class ShardConnection:
+    """
+    Connection to a shard worker. Requests are sent one by one under the lock of the connection, replies are
+    received by a reader thread in the order of the requests. Several queries can be in flight at once, so the
+    worker always has the next request waiting and the shards serve different queries concurrently
+    """
+
+    def __init__(self, connection, shard: int):
+        self.connection = connection
+        self.shard = shard
+        self.lock = threading.Lock()
+        self.pending = deque()  # futures of the sent requests waiting for their replies, in the order of requests
+        self.error = None  # set once the connection failed, all following requests fail too
+        self.reader = threading.Thread(target=self._receive_replies, name=f'shard-{shard}-reader', daemon=True)
+        self.reader.start()
+
+    def submit(self, method: str, args) -> Future:
+        """
+        Sends the request to the worker
+        :return: future of the result of the request
+        :raises ShardWorkerError: if the connection failed
+        """
+        future = Future()
+        with self.lock:
+            if self.error is not None:
+                raise self.error
+            # Future is queued before the request is sent, so the reader finds it for the reply
+            self.pending.append(future)
+            try:
+                self.connection.send((method, args))
+            except Exception as e:
+                self._fail(e)
+                raise self.error
+        return future
+
+    def close(self):
+        with self.lock:
+            if self.error is None:
+                self.connection.send(('close', None))
+
+    def _receive_replies(self):
+        while True:
+            try:
+                success, result = self.connection.recv()
+            except Exception as e:  # worker died or the connection was closed
+                with self.lock:
+                    self._fail(e)
+                return
+
+            with self.lock:
+                future = self.pending.popleft()
+            if success:
+                future.set_result(result)
+            else:
+                future.set_exception(result)
+
+    def _fail(self, cause: Exception):
+        """
+        Marks the connection as failed and fails the pending requests, must be called under the lock. Replies
+        of the pending requests cannot be told apart any more, so the connection is never used again
+        """
+        if self.error is None:
+            self.error = ShardWorkerError(f'Connection to the worker of shard {self.shard} failed: {cause!r}')
+        while self.pending:
+            self.pending.popleft().set_exception(self.error)
+
+
+class ShardedIndex:
+    """
+    Coordinator of the shard workers. Holds only the global statistics needed to process the queries
+    """
+
+    def __init__(self, shard_idxs: List[SparseTfIdfIndex], shard_sources: list):
+        """
+        Starts a worker process for each shard
+        :param shard_idxs: indexes of the shards, they must share the vocabulary and the global idf
+        :param shard_sources: for each shard either its directory or tuple of the shard index and its documents,
+                              passed to the worker
+        """
+        self.terms = shard_idxs[0].terms
+        self.term_to_id = shard_idxs[0].term_to_id
+        self.idf = shard_idxs[0].idf
+        self.tf_weighting = shard_idxs[0].tf_weighting
+        self.df = np.sum([shard_idx.df for shard_idx in shard_idxs], axis=0)
+        self.shard_sizes = [shard_idx.total_docs for shard_idx in shard_idxs]
+
+        # Each connection has its own lock, so queries of several threads are in flight at once
+        self.connections: List[ShardConnection] = []
+        self.workers = []
+        for shard, shard_source in enumerate(shard_sources):
+            connection, worker_connection = multiprocessing.Pipe()
+            worker = multiprocessing.Process(target=_run_shard_worker, args=(worker_connection, shard_source),
+                                             daemon=True)
+            worker.start()
+            # Only the worker holds its end, so the connection reports end of file once the worker dies
+            worker_connection.close()
+            self.connections.append(ShardConnection(connection, shard))
+            self.workers.append(worker)
+        logger.info(f'Started {self.shards} shard workers')
+
+    @property
+    def total_docs(self):
+        return sum(self.shard_sizes)
+
+    @property
+    def shards(self):
+        return len(self.workers)
+
+    def __len__(self):
+        return len(self.terms)
+
+    def __contains__(self, term):
+        return term in self.term_to_id
+
+    def __iter__(self):
+        return iter(self.terms)
+
+    def keys(self):
+        return self.terms
+
+    def get_df(self, term) -> int:
+        return int(self.df[self.term_to_id[term]])
+
+    def get_idf(self, term) -> float:
+        return float(self.idf[self.term_to_id[term]])
+
+    def _call_shards(self, method: str, args_per_shard: list) -> list:
+        """
+        Sends the request to all shards and waits for all their responses
+        :param method: name of the method
+        :param args_per_shard: arguments of the method for each shard
+        :return: results of the shards
+        :raises ShardWorkerError: if the connection to any of the workers failed
+        """
+        futures = [connection.submit(method, args) for connection, args in zip(self.connections, args_per_shard)]
+        return [future.result() for future in futures]
+
+    def get_top_n(self, query: CompiledQuery, n: int) -> List[Tuple[float, Document]]:
+        """
+        Searches all shards in parallel and merges their top n results
+        :param query: compiled query (term ids of the shards' vocabulary)
+        :param n: number of returned documents
+        :return: top n documents with their cosine similarity
+        """
+        shard_results = self._call_shards('get_top_n', [(query.get_term_weights(), query.norm, n)] * self.shards)
+        return heapq.nlargest(n, (result for results in shard_results for result in results), key=lambda x: x[0])
+
+    def save(self, dir_path):
+        """
+        Saves all shards to the directory, each shard is saved by its worker
+        :param dir_path: path to the directory
+        :return:
+        """
+        os.makedirs(dir_path, exist_ok=True)
+        self._call_shards('save', [(os.path.join(dir_path, f'shard_{shard}'),) for shard in range(self.shards)])
+        # Manifest is written last, so an incomplete index is never recognized as valid
+        with open(os.path.join(dir_path, 'shards.json'), 'w', encoding='utf-8') as f:
+            json.dump({'shards': self.shards}, f)
+
+    def close(self):
+        """
+        Stops the shard workers
+        :return:
+        """
+        for connection, worker in zip(self.connections, self.workers):
+            connection.close()
+            worker.join()
+            connection.reader.join()
+            connection.connection.close()
+        self.connections, self.workers = [], []
+
+
+def split_sparse_tfidf_idx(sparse_idx: SparseTfIdfIndex, shard_bounds: Sequence[int]) -> List[SparseTfIdfIndex]:
+    """
+    Splits the index into shards by document positions, shards keep the vocabulary, the global idf and
+    the global document norms
+    :param sparse_idx: index ordered by document position
+    :param shard_bounds: first document position of each shard and the total number of documents
+    :return: index of each shard
+    """
+    shard_idxs = []
+    posting_term_ids = sparse_idx._get_posting_term_ids()
+    term_to_id = sparse_idx.term_to_id
+    for start, end in zip(shard_bounds[:-1], shard_bounds[1:]):
+        is_in_shard = (sparse_idx.posting_doc_idxs >= start) & (sparse_idx.posting_doc_idxs < end)
+        shard_idxs.append(SparseTfIdfIndex.from_weighted_postings(
+            term_to_id, posting_term_ids[is_in_shard], sparse_idx.posting_doc_idxs[is_in_shard] - start,
+            sparse_idx.posting_tf_weights[is_in_shard], sparse_idx.doc_ids[start:end], idf=sparse_idx.idf,
+            doc_norms=sparse_idx.doc_norms[start:end], tf_weighting=sparse_idx.tf_weighting))
+    return shard_idxs
+
+
+def create_sharded_idx(documents: List[Document], shards: int, tf_weighting='log') -> ShardedIndex:
+    """
+    Partitions the documents into contiguous shards of the same size and starts a worker for each shard
+    :param documents: documents to index
+    :param shards: number of shards
+    :param tf_weighting: term frequency weighting scheme, one of TF_WEIGHTINGS
+    :return: sharded index
+    """
+    # Statistics are calculated over all documents, then the postings are split
+    shard_bounds = np.linspace(0, len(documents), shards + 1).astype(np.int64)
+    shard_idxs = split_sparse_tfidf_idx(create_sparse_tfidf_idx(documents, tf_weighting), shard_bounds)
+    shard_sources = [(shard_idx, documents[start:end])
+                     for shard_idx, start, end in zip(shard_idxs, shard_bounds[:-1], shard_bounds[1:])]
+    return ShardedIndex(shard_idxs, shard_sources)
+
+
+def load_sharded_idx(dir_path) -> ShardedIndex:
+    """
+    Loads index saved via ShardedIndex.save, workers memory-map their shards
+    :param dir_path: path to the directory
+    :return: sharded index
+    """
+    with open(os.path.join(dir_path, 'shards.json'), 'r', encoding='utf-8') as f:
+        shards = json.load(f)['shards']
+
+    shard_dir_paths = [os.path.join(dir_path, f'shard_{shard}') for shard in range(shards)]
+    return ShardedIndex([load_sparse_tfidf_idx(shard_dir_path) for shard_dir_path in shard_dir_paths],
+                        shard_dir_paths)
+
+
+def sharded_idx_exists(dir_path) -> bool:
+    """
+    Returns True if the directory contains an index saved via ShardedIndex.save
+    """
+    return os.path.exists(os.path.join(dir_path, 'shards.json'))
@@ -0,0 +1,434 @@
+import json
+import os
+import sys
+from array import array
+from itertools import islice
+from operator import attrgetter
+from typing import Iterable, List
+
+import numpy as np
+
+from src.document import Document, get_bows
+from src.tf_idf import InvertedIndex, get_tf_weights
+from src.vocabulary import vocabulary
+
+# Version of the on-disk format written by save_sparse_tfidf_idx
+INDEX_FORMAT_VERSION = 2
+
+# Number of documents whose bags of words are counted at once when the index is created
+BOW_BATCH_SIZE = 10_000
+
+# Arrays of the index, each of them is stored in a separate .npy file so it can be memory-mapped
+INDEX_ARRAYS = ['term_offsets', 'posting_doc_idxs', 'posting_tf_weights', 'doc_ids', 'df', 'idf', 'doc_norms',
+                'term_max_scores']
+
+
+class SparseTfIdfIndex:
+    """
+    Compact representation of the tf-idf inverted index.
+    Postings of all terms are stored in contiguous numpy arrays (CSC layout of the document-term matrix):
+    postings of the term with id t are located at [term_offsets[t], term_offsets[t + 1]).
+    Postings of each term are ordered by document position, or by their impact (normalized tf-idf weight)
+    in descending order if the index is impact-ordered
+    """
+
+    def __init__(self, terms: List[str], term_offsets: np.ndarray, posting_doc_idxs: np.ndarray,
+                 posting_tf_weights: np.ndarray, doc_ids: np.ndarray, df: np.ndarray = None, idf: np.ndarray = None,
+                 doc_norms: np.ndarray = None, term_max_scores: np.ndarray = None, impact_ordered=False,
+                 tf_weighting='log'):
+        """
+        Initializes the index from already built posting arrays
+        :param terms: indexed terms, term id is the position in the list
+        :param term_offsets: start of the postings of each term, has len(terms) + 1 items
+        :param posting_doc_idxs: position of the document (in doc_ids) for each posting
+        :param posting_tf_weights: (log) term frequency weight for each posting
+        :param doc_ids: document id for each document position
+        :param df: document frequency of each term, calculated from the postings if not passed
+        :param idf: inverse document frequency of each term, calculated from df if not passed
+        :param doc_norms: norms of the document vectors, calculated from the postings if not passed
+        :param term_max_scores: upper bound of the normalized tf-idf weight of each term, calculated from
+                                the postings if not passed
+        :param impact_ordered: True if postings of each term are ordered by their impact instead of document
+                               position
+        :param tf_weighting: term frequency weighting scheme of the postings (one of TF_WEIGHTINGS), queries are
+                             weighted by the same scheme
+        """
+        self.terms = terms
+        self.term_to_id = {term: term_id for term_id, term in enumerate(terms)}
+        self.term_offsets = term_offsets
+        self.posting_doc_idxs = posting_doc_idxs
+        self.posting_tf_weights = posting_tf_weights
+        self.doc_ids = doc_ids
+        self.impact_ordered = impact_ordered
+        self.tf_weighting = tf_weighting
+        self._doc_id_to_idx = None
+
+        # Document frequency is simply the length of the posting list
+        self.df = df if df is not None else np.diff(term_offsets).astype(np.int32)
+        self.idf = idf if idf is not None else np.log10(self.total_docs / np.maximum(self.df, 1)).astype(np.float32)
+        self.doc_norms = doc_norms if doc_norms is not None else self._calculate_document_norms()
+        self._inv_doc_norms = None
+        self.term_max_scores = term_max_scores if term_max_scores is not None else self._calculate_term_max_scores()
+
+    @property
+    def total_docs(self):
+        return len(self.doc_ids)
+
+    @property
+    def doc_id_to_idx(self):
+        """
+        Mapping of document ids to document positions, lazy initialized so loading the index stays cheap
+        """
+        if self._doc_id_to_idx is None:
+            self._doc_id_to_idx = {doc_id: idx for idx, doc_id in enumerate(self.doc_ids.tolist())}
+        return self._doc_id_to_idx
+
+    @property
+    def total_postings(self):
+        return len(self.posting_doc_idxs)
+
+    @property
+    def nbytes(self):
+        """
+        Size of the posting and statistics arrays in bytes
+        """
+        return sum(array.nbytes for array in [self.term_offsets, self.posting_doc_idxs, self.posting_tf_weights,
+                                              self.doc_ids, self.df, self.idf, self.doc_norms,
+                                              self.term_max_scores])
+
+    def __len__(self):
+        return len(self.terms)
+
+    def __contains__(self, term):
+        return term in self.term_to_id
+
+    def __iter__(self):
+        return iter(self.terms)
+
+    def keys(self):
+        return self.terms
+
+    def get_df(self, term) -> int:
+        return int(self.df[self.term_to_id[term]])
+
+    def get_idf(self, term) -> float:
+        return float(self.idf[self.term_to_id[term]])
+
+    def get_postings(self, term):
+        """
+        Returns postings of the term
+        :param term: indexed term
+        :return: tuple of document positions and tf-idf weights of the term in these documents
+        """
+        term_id = self.term_to_id[term]
+        start, end = self.term_offsets[term_id], self.term_offsets[term_id + 1]
+        return self.posting_doc_idxs[start:end], self.posting_tf_weights[start:end] * self.idf[term_id]
+
+    def get_document_norm(self, doc_id) -> float:
+        return self.doc_norms[self.doc_id_to_idx[doc_id]]
+
+    @property
+    def inv_doc_norms(self):
+        """
+        Inverse norms of the document vectors (0 for empty documents), lazy initialized
+        """
+        if self._inv_doc_norms is None:
+            inv_doc_norms = np.zeros(self.total_docs, dtype=np.float32)
+            np.divide(1, self.doc_norms, out=inv_doc_norms, where=np.asarray(self.doc_norms) > 0)
+            self._inv_doc_norms = inv_doc_norms
+        return self._inv_doc_norms
+
+    def get_normalized_postings(self, term_id):
+        """
+        Returns postings of the term with tf-idf weights divided by the norms of the documents
+        :param term_id: id of the term
+        :return: tuple of document positions and normalized weights
+        """
+        start, end = self.term_offsets[term_id], self.term_offsets[term_id + 1]
+        doc_idxs = self.posting_doc_idxs[start:end]
+        return doc_idxs, self.posting_tf_weights[start:end] * self.idf[term_id] * self.inv_doc_norms[doc_idxs]
+
+    def to_impact_ordered(self):
+        """
+        Creates index with the same postings ordered by their impact (normalized tf-idf weight) in descending order,
+        so the most important postings of each term come first. Statistics arrays are shared with this index
+        :return: impact-ordered sparse index
+        """
+        if self.impact_ordered:
+            return self
+
+        posting_term_ids = self._get_posting_term_ids()
+        impacts = (self.posting_tf_weights * self.idf[posting_term_ids] *
+                   self.inv_doc_norms[self.posting_doc_idxs])
+        # Postings stay grouped by term, ties keep the document order
+        order = np.lexsort((-impacts, posting_term_ids))
+        return SparseTfIdfIndex(self.terms, self.term_offsets, np.asarray(self.posting_doc_idxs)[order],
+                                np.asarray(self.posting_tf_weights)[order], self.doc_ids, df=self.df, idf=self.idf,
+                                doc_norms=self.doc_norms, term_max_scores=self.term_max_scores, impact_ordered=True,
+                                tf_weighting=self.tf_weighting)
+
+    def _calculate_term_max_scores(self):
+        """
+        Calculates maximum normalized tf-idf weight of each term, which bounds contribution of the term
+        to the cosine similarity of any document
+        """
+        term_max_scores = np.zeros(len(self.terms), dtype=np.float32)
+        if self.total_postings == 0:
+            return term_max_scores
+
+        weights = (self.posting_tf_weights * self.idf[self._get_posting_term_ids()] *
+                   self.inv_doc_norms[self.posting_doc_idxs])
+        has_postings = self.df > 0
+        term_max_scores[has_postings] = np.maximum.reduceat(weights, self.term_offsets[:-1][has_postings])
+        return term_max_scores
+
+    def _get_posting_term_ids(self):
+        """
+        Returns term id for each posting
+        """
+        return np.repeat(np.arange(len(self.terms), dtype=np.int32), self.df)
+
+    def _calculate_document_norms(self):
+        weights = self.posting_tf_weights * self.idf[self._get_posting_term_ids()]
+        squared_sums = np.bincount(self.posting_doc_idxs, weights=np.square(weights, dtype=np.float64),
+                                   minlength=self.total_docs)
+        return np.sqrt(squared_sums).astype(np.float32)
+
+    @staticmethod
+    def from_postings(term_to_id: dict, posting_term_ids: np.ndarray, posting_doc_idxs: np.ndarray,
+                      posting_tfs: np.ndarray, doc_ids: np.ndarray, idf: np.ndarray = None,
+                      doc_norms: np.ndarray = None, tf_weighting='log'):
+        """
+        Creates the index from postings in arbitrary order
+        :param term_to_id: mapping of terms to their ids
+        :param posting_term_ids: term id of each posting
+        :param posting_doc_idxs: document position of each posting
+        :param posting_tfs: raw term frequency of each posting
+        :param doc_ids: document id for each document position
+        :param idf: idf of each term, calculated from the postings if not passed
+        :param doc_norms: norms of the document vectors, calculated from the postings if not passed
+        :param tf_weighting: term frequency weighting scheme, one of TF_WEIGHTINGS
+        :return: sparse tf-idf index
+        """
+        # Weights of all postings are calculated at once, document statistics are gathered from the postings
+        doc_lengths = np.bincount(posting_doc_idxs, weights=posting_tfs, minlength=len(doc_ids))
+        doc_max_tfs = np.zeros(len(doc_ids), dtype=np.int64)
+        np.maximum.at(doc_max_tfs, posting_doc_idxs, posting_tfs)
+        avg_doc_length = doc_lengths.mean() if len(doc_ids) > 0 else 0.0
+        tf_weights = get_tf_weights(posting_tfs, doc_max_tfs[posting_doc_idxs], doc_lengths[posting_doc_idxs],
+                                    avg_doc_length, tf_weighting)
+        return SparseTfIdfIndex.from_weighted_postings(term_to_id, posting_term_ids, posting_doc_idxs,
+                                                       tf_weights.astype(np.float32), doc_ids, idf=idf,
+                                                       doc_norms=doc_norms, tf_weighting=tf_weighting)
+
+    @staticmethod
+    def from_weighted_postings(term_to_id: dict, posting_term_ids: np.ndarray, posting_doc_idxs: np.ndarray,
+                               posting_tf_weights: np.ndarray, doc_ids: np.ndarray, idf: np.ndarray = None,
+                               doc_norms: np.ndarray = None, tf_weighting='log'):
+        """
+        Same as from_postings, but the postings already hold tf weights instead of raw term frequencies
+        """
+        # Group the postings by term, stable sort keeps them ordered by document position
+        order = np.argsort(posting_term_ids, kind='stable')
+        term_offsets = np.zeros(len(term_to_id) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(posting_term_ids, minlength=len(term_to_id)), out=term_offsets[1:])
+
+        terms = [''] * len(term_to_id)
+        for term, term_id in term_to_id.items():
+            terms[term_id] = term
+
+        return SparseTfIdfIndex(terms, term_offsets, posting_doc_idxs[order].astype(np.int32),
+                                posting_tf_weights[order].astype(np.float32), doc_ids, idf=idf, doc_norms=doc_norms,
+                                tf_weighting=tf_weighting)
+
+    @staticmethod
+    def from_inverted_idx(inverted_idx: InvertedIndex):
+        """
+        Converts object-graph inverted index to the sparse index. Document positions are the same as in
+        the inverted index, positions of the deleted documents have no postings
+        :param inverted_idx: inverted index created via create_inverted_tfidf_idx
+        :return: sparse tf-idf index
+        """
+        term_to_id = {term: term_id for term_id, term in enumerate(inverted_idx.keys())}
+        # Postings of each term are gathered at once, as in InvertedIndex.calculate_document_norms
+        get_doc_idx, get_tf_weight = inverted_idx.doc_id_to_idx.__getitem__, attrgetter('tf_weight')
+        posting_doc_idxs, posting_tf_weights, dfs = [], [], []
+        for term_stats in inverted_idx.values():
+            postings = term_stats.documents
+            posting_doc_idxs.append(np.fromiter(map(get_doc_idx, postings), dtype=np.int32, count=len(postings)))
+            posting_tf_weights.append(np.fromiter(map(get_tf_weight, postings.values()), dtype=np.float32,
+                                                  count=len(postings)))
+            dfs.append(len(postings))
+        posting_term_ids = np.repeat(np.arange(len(term_to_id), dtype=np.int32), dfs)
+        posting_doc_idxs = np.concatenate(posting_doc_idxs + [np.empty(0, dtype=np.int32)])
+        posting_tf_weights = np.concatenate(posting_tf_weights + [np.empty(0, dtype=np.float32)])
+
+        # Idf and norms are taken from the inverted index since deleted documents do not count to the total.
+        # The index keeps its norms up to date, so they are only read (the index can be searched meanwhile)
+        idf = np.array([inverted_idx.get_idf(term) for term in inverted_idx.keys()], dtype=np.float32)
+        return SparseTfIdfIndex.from_weighted_postings(term_to_id, posting_term_ids, posting_doc_idxs,
+                                                       posting_tf_weights, inverted_idx.doc_ids, idf=idf,
+                                                       doc_norms=inverted_idx.doc_norms.astype(np.float32),
+                                                       tf_weighting=inverted_idx.tf_weighting)
+
+
+def merge_sparse_tfidf_idxs(sparse_idxs: List[SparseTfIdfIndex], live_masks: List[np.ndarray]) -> SparseTfIdfIndex:
+    """
+    Merges several indexes into one. Postings are concatenated without touching the documents
+    :param sparse_idxs: indexes to merge, postings must be ordered by document position (not impact-ordered)
+    :param live_masks: for each index boolean array of its documents, False marks deleted documents that are dropped
+    :return: merged index, documents are ordered by the index and then by their position
+    """
+    term_to_id = {}
+    posting_term_ids, posting_doc_idxs, posting_tf_weights, doc_ids = [], [], [], []
+    doc_idx_start = 0
+    for sparse_idx, live_mask in zip(sparse_idxs, live_masks):
+        # Map term ids of the index to the merged vocabulary
+        term_id_mapping = np.array([term_to_id.setdefault(term, len(term_to_id)) for term in sparse_idx.terms],
+                                   dtype=np.int32)
+        # New positions of the live documents, deleted documents are mapped to -1
+        doc_idx_mapping = np.full(sparse_idx.total_docs, -1, dtype=np.int64)
+        doc_idx_mapping[live_mask] = np.arange(doc_idx_start, doc_idx_start + np.count_nonzero(live_mask))
+        doc_idx_start += np.count_nonzero(live_mask)
+
+        new_doc_idxs = doc_idx_mapping[sparse_idx.posting_doc_idxs]
+        is_live = new_doc_idxs >= 0
+        posting_term_ids.append(term_id_mapping[sparse_idx._get_posting_term_ids()][is_live])
+        posting_doc_idxs.append(new_doc_idxs[is_live])
+        posting_tf_weights.append(np.asarray(sparse_idx.posting_tf_weights)[is_live])
+        doc_ids.append(np.asarray(sparse_idx.doc_ids)[live_mask])
+
+    return SparseTfIdfIndex.from_weighted_postings(term_to_id, np.concatenate(posting_term_ids),
+                                                   np.concatenate(posting_doc_idxs),
+                                                   np.concatenate(posting_tf_weights), np.concatenate(doc_ids))
+
+
+def create_sparse_tfidf_idx(documents: Iterable[Document], tf_weighting='log') -> SparseTfIdfIndex:
+    """
+    Creates sparse tf-idf index of the documents. Takes the same input as create_inverted_tfidf_idx
+    :param documents: documents to index, any iterable - documents are processed in a single pass and
+                      not referenced afterwards, so they can be streamed
+    :param tf_weighting: term frequency weighting scheme, one of TF_WEIGHTINGS
+    :return: sparse tf-idf index
+    """
+    # Bags of words are counted for batches of documents at once, typed arrays take 4 (8) bytes per posting
+    # instead of a Python int object
+    posting_vocabulary_ids, posting_doc_idxs, posting_tfs, doc_ids = array('i'), array('i'), array('i'), array('q')
+    documents = iter(documents)
+    while batch := list(islice(documents, BOW_BATCH_SIZE)):
+        batch_doc_idxs, batch_term_ids, batch_tfs = get_bows(batch)
+        posting_vocabulary_ids.frombytes(batch_term_ids.tobytes())
+        posting_doc_idxs.frombytes((batch_doc_idxs + len(doc_ids)).astype(np.int32).tobytes())
+        posting_tfs.frombytes(batch_tfs.astype(np.int32).tobytes())
+        doc_ids.extend(document.doc_id for document in batch)
+
+    # Ids of the shared vocabulary are mapped to dense ids of the indexed terms
+    vocabulary_ids, posting_term_ids = np.unique(np.frombuffer(posting_vocabulary_ids, dtype=np.int32),
+                                                 return_inverse=True)
+    term_to_id = {term: term_id for term_id, term in enumerate(vocabulary.get_terms(vocabulary_ids))}
+    return SparseTfIdfIndex.from_postings(term_to_id, posting_term_ids.astype(np.int32),
+                                          np.frombuffer(posting_doc_idxs, dtype=np.int32),
+                                          np.frombuffer(posting_tfs, dtype=np.int32),
+                                          np.frombuffer(doc_ids, dtype=np.int64), tf_weighting=tf_weighting)
+
+
+def save_sparse_tfidf_idx(sparse_idx: SparseTfIdfIndex, dir_path):
+    """
+    Saves the index to a directory. Vocabulary is stored as json, all arrays as separate .npy files
+    :param sparse_idx: sparse index
+    :param dir_path: path to the directory, created if it does not exist
+    :return:
+    """
+    os.makedirs(dir_path, exist_ok=True)
+    for array_name in INDEX_ARRAYS:
+        np.save(os.path.join(dir_path, f'{array_name}.npy'), np.ascontiguousarray(getattr(sparse_idx, array_name)))
+
+    with open(os.path.join(dir_path, 'terms.json'), 'w', encoding='utf-8') as f:
+        json.dump(sparse_idx.terms, f, ensure_ascii=False)
+
+    # Metadata are written last so an incomplete index is never recognized as valid
+    with open(os.path.join(dir_path, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump({'version': INDEX_FORMAT_VERSION, 'total_docs': sparse_idx.total_docs,
+                   'total_terms': len(sparse_idx), 'total_postings': sparse_idx.total_postings,
+                   'impact_ordered': sparse_idx.impact_ordered, 'tf_weighting': sparse_idx.tf_weighting}, f)
+
+
+def load_sparse_tfidf_idx(dir_path, mmap=True) -> SparseTfIdfIndex:
+    """
+    Loads the index saved via save_sparse_tfidf_idx
+    :param dir_path: path to the index directory
+    :param mmap: if True, arrays are memory-mapped (read only) instead of being read to memory. Pages of the
+                 mapped files are shared by all processes that load the same index
+    :return: sparse tf-idf index
+    """
+    with open(os.path.join(dir_path, 'meta.json'), 'r', encoding='utf-8') as f:
+        meta = json.load(f)
+    if meta['version'] != INDEX_FORMAT_VERSION:
+        raise ValueError(f'Unsupported index format version {meta["version"]}, expected {INDEX_FORMAT_VERSION}')
+
+    with open(os.path.join(dir_path, 'terms.json'), 'r', encoding='utf-8') as f:
+        terms = json.load(f)
+
+    arrays = {array_name: np.load(os.path.join(dir_path, f'{array_name}.npy'), mmap_mode='r' if mmap else None)
+              for array_name in INDEX_ARRAYS}
+    return SparseTfIdfIndex(terms, **arrays, impact_ordered=meta.get('impact_ordered', False),
+                            tf_weighting=meta.get('tf_weighting', 'log'))
+
+
+def sparse_idx_exists(dir_path) -> bool:
+    """
+    Returns True if the directory contains an index saved via save_sparse_tfidf_idx
+    """
+    return os.path.exists(os.path.join(dir_path, 'meta.json'))
+
+
+def get_vocabulary_size(terms) -> int:
+    """
+    Size of the term strings in bytes
+    """
+    return sum(sys.getsizeof(term) for term in terms)
+
+
+def get_sparse_idx_size(sparse_idx: SparseTfIdfIndex) -> int:
+    """
+    Estimates size of the sparse index in bytes including its vocabulary
+    :param sparse_idx: sparse index
+    :return: estimated size in bytes
+    """
+    return (sparse_idx.nbytes + sys.getsizeof(sparse_idx.terms) + sys.getsizeof(sparse_idx.term_to_id) +
+            get_vocabulary_size(sparse_idx.terms))
+
+
+def get_inverted_idx_size(inverted_idx: InvertedIndex) -> int:
+    """
+    Estimates size of the object-graph inverted index in bytes including its vocabulary. Documents referenced
+    from the postings are not included since they are shared with the document list
+    :param inverted_idx: inverted index
+    :return: estimated size in bytes
+    """
+    size = sys.getsizeof(inverted_idx) + inverted_idx.doc_ids.nbytes + inverted_idx.doc_norms.nbytes
+    size += get_vocabulary_size(inverted_idx.keys())
+    for term_stats in inverted_idx.values():
+        size += sys.getsizeof(term_stats) + sys.getsizeof(term_stats.documents)
+        for document_stats in term_stats.documents.values():
+            size += sys.getsizeof(document_stats) + sys.getsizeof(document_stats.tf_weight)
+    return size
+
+
+def get_memory_report(inverted_idx: InvertedIndex, sparse_idx: SparseTfIdfIndex) -> dict:
+    """
+    Compares memory used by the object-graph and the sparse index
+    :param inverted_idx: object-graph inverted index
+    :param sparse_idx: sparse index built from the same documents
+    :return: dictionary with total bytes and bytes per posting of both representations
+    """
+    inverted_idx_size = get_inverted_idx_size(inverted_idx)
+    sparse_idx_size = get_sparse_idx_size(sparse_idx)
+    postings = max(sparse_idx.total_postings, 1)
+    return {
+        'postings': sparse_idx.total_postings,
+        'inverted_idx_bytes': inverted_idx_size,
+        'inverted_idx_bytes_per_posting': inverted_idx_size / postings,
+        'sparse_idx_bytes': sparse_idx_size,
+        'sparse_idx_bytes_per_posting': sparse_idx_size / postings,
+    }
@@ -1,18 +1,83 @@
+import gc
+import math
+import pickle
+from operator import attrgetter
 from typing import List
 
-from src.document import Document
+from src.document import Document, get_bows
+from src.vocabulary import vocabulary
 import numpy as np
 
+# Supported term frequency weighting schemes:
+# raw - tf, log - 1 + log(tf), augmented - 0.5 + 0.5 * tf / max tf in the document,
+# bm25 - tf * (k1 + 1) / (tf + k1 * (1 - b + b * document length / average document length))
+TF_WEIGHTINGS = ['raw', 'log', 'augmented', 'bm25']
+
+# Parameters of the bm25 saturation
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def get_tf_weight(tf: int) -> float:
+    """
+    Returns (log) term frequency weight of the term in the document
+    :param tf: number of times the term appears in the document
+    :return: 1 + log(tf) or 0 if the term does not appear in the document
+    """
+    # math is used for scalars, numpy ufunc call is much slower for a single value
+    return 1 + math.log10(tf) if tf > 0 else 0.0
+
+
+def get_tf_weights(tfs: np.ndarray, doc_max_tfs, doc_lengths, avg_doc_length: float,
+                   tf_weighting='log') -> np.ndarray:
+    """
+    Returns term frequency weights of the postings, all postings are weighted at once
+    :param tfs: raw term frequency of each posting (must be positive)
+    :param doc_max_tfs: maximum term frequency in the document of each posting (augmented weighting)
+    :param doc_lengths: number of tokens of the document of each posting (bm25 weighting)
+    :param avg_doc_length: average number of tokens of the documents (bm25 weighting)
+    :param tf_weighting: weighting scheme, one of TF_WEIGHTINGS
+    :return: array of the weights
+    """
+    tfs = np.asarray(tfs, dtype=np.float64)
+    if tf_weighting == 'raw':
+        weights = tfs
+    elif tf_weighting == 'log':
+        weights = 1 + np.log10(tfs)
+    elif tf_weighting == 'augmented':
+        weights = 0.5 + 0.5 * tfs / doc_max_tfs
+    elif tf_weighting == 'bm25':
+        weights = tfs * (BM25_K1 + 1) / (tfs + BM25_K1 * (1 - BM25_B + BM25_B * np.divide(doc_lengths,
+                                                                                            avg_doc_length)))
+    else:
+        raise ValueError(f'Unknown tf weighting {tf_weighting}, expected one of {TF_WEIGHTINGS}')
+    return np.asarray(weights, dtype=np.float64)
+
+
+def get_idf(total_docs: int, df: int) -> float:
+    """
+    Returns inverse document frequency of the term
+    :param total_docs: total number of documents in the index
+    :param df: number of documents containing the term
+    :return: log(N / df)
+    """
+    return math.log10(total_docs / df)
+
 
 class DocumentStats:
     """
     Represents stats for specific term in the document
     """
 
-    def __init__(self, document: Document, occurrences: int):
-        self.document = document  # Reference to the document
+    # One instance exists for each posting, so the instances do not carry per-instance dictionary
+    __slots__ = ('doc_id', 'tf', 'tf_weight', '_tfidf')
+
+    def __init__(self, doc_id, occurrences: int, tf_weight: float = None):
+        self.doc_id = doc_id  # id of the document, the document itself is not referenced
         self.tf = occurrences  # no. times the term appears in the document
-        self._tfidf = None  # Term frequency inverse document frequency
+        # term frequency weight (log term frequency if not passed), idf is applied at query time
+        self.tf_weight = tf_weight if tf_weight is not None else get_tf_weight(occurrences)
+        self._tfidf = None  # Term frequency inverse document frequency (only set for query terms)
 
     def set_tfidf(self, tfidf):
         self._tfidf = tfidf
@@ -24,10 +89,10 @@ class DocumentStats:
     def __str__(self):
         return f"""
         DocumentStats:
-            document_id: {self.document.doc_id}
+            document_id: {self.doc_id}
             term_count: {self.tf}
             term_frequency: {self.tf}
-            tfidf: {self.tfidf}"""
+            tf_weight: {self.tf_weight}"""
 
 
 class TermStats:
@@ -35,37 +100,67 @@ class TermStats:
     Represents stats for specific term in the corpus
     """
 
-    def __init__(self, document: Document, term_str: str, occurrences: int):
+    __slots__ = ('df', 'cf', 'text', 'documents')
+
+    def __init__(self, doc_id, term_str: str, occurrences: int, tf_weight: float = None):
         self.df = 1  # total number of terms in the corpus
         self.cf = occurrences  # total number of occurrences in the corpus
         self.text = term_str  # mostly for debugging, would not be used in production
         self.documents = {
-            document.doc_id: DocumentStats(document, occurrences)
+            doc_id: DocumentStats(doc_id, occurrences, tf_weight)
         }  # dictionary containing the documents where the term appears
-        self._df = None  # Inverse document frequency
 
-    def add_document_stats(self, document: Document, occurrences: int):
+    def add_document_stats(self, doc_id, occurrences: int, tf_weight: float = None):
         """
         Updates the document stats for the term
         :param occurrences: number of times the term appears in the document
-        :param document: the document
+        :param doc_id: id of the document
+        :param tf_weight: term frequency weight, log term frequency if not passed
         :return:
         """
         self.cf += occurrences
         self.df += 1
-        self.documents[document.doc_id] = DocumentStats(document, occurrences)
+        self.documents[doc_id] = DocumentStats(doc_id, occurrences, tf_weight)
 
-    def calculate_tf_idf(self, total_docs: int, log_tf=True):
+    def add_postings(self, doc_ids: List, occurrences: List[int], tf_weights: List[float]):
         """
-        Calculates tf-idf weights in each document
-        :param: log_tf: if True, tf is calculated as log(1 + tf)
+        Same as add_document_stats for each of the documents, but the postings are added at once
+        :param doc_ids: ids of the documents
+        :param occurrences: number of times the term appears in each of the documents
+        :param tf_weights: term frequency weight of the term in each of the documents
         :return:
         """
-        for document in self.documents.values():
-            tf = 1 + np.log10(
-                document.tf) if log_tf and document.tf > 0 else document.tf  # term frequency as an integer
-            idf = np.log10(total_docs / self.df)
-            document.set_tfidf(tf * idf)
+        self.cf += sum(occurrences)
+        self.df += len(doc_ids)
+        self.documents.update(zip(doc_ids, map(DocumentStats, doc_ids, occurrences, tf_weights)))
+
+    def remove_document_stats(self, doc_id):
+        """
+        Removes the document from the postings of the term
+        :param doc_id: id of the document
+        :return:
+        """
+        document_stats = self.documents.pop(doc_id)
+        self.cf -= document_stats.tf
+        self.df -= 1
+
+    def get_idf(self, total_docs: int) -> float:
+        """
+        Returns inverse document frequency of the term. Idf is not stored in the postings, so the postings
+        do not have to be rewritten when documents are added or deleted
+        :param total_docs: total number of documents in the index
+        :return: idf of the term
+        """
+        return get_idf(total_docs, self.df)
+
+    def get_tfidf(self, doc_id, total_docs: int) -> float:
+        """
+        Returns tf-idf weight of the term in the document
+        :param doc_id: id of the document containing the term
+        :param total_docs: total number of documents in the index
+        :return: tf-idf weight
+        """
+        return self.documents[doc_id].tf_weight * self.get_idf(total_docs)
 
     def __str__(self):
         return f"""TermStats:
@@ -74,25 +169,209 @@ class TermStats:
                 documents: {''.join([str(doc) for doc in self.documents.values()])}"""
 
 
-def create_inverted_tfidf_idx(documents: List[Document]):
+class InvertedIndex(dict):
+    """
+    Inverted index - dictionary mapping terms to their TermStats.
+    Additionally holds L2 norms of the document vectors. The index can be updated in place via add_documents and
+    delete_documents. Since every update changes idf of the terms, norms of all documents are recalculated
+    by the update (in a single vectorized pass), so searches never recalculate them
+    """
+
+    def __init__(self, drop_tokens=False, tf_weighting='log', calculate_norms=True):
+        """
+        :param drop_tokens: if True, tokens of the added documents are dropped once their postings are created,
+                            only their bags of words are kept
+        :param tf_weighting: term frequency weighting scheme, one of TF_WEIGHTINGS. Weights of the postings are
+                             calculated when the documents are added (bm25 uses the average document length
+                             at that time)
+        :param calculate_norms: if False, norms are not recalculated by the updates, for indexes whose documents are
+                                normalized with other statistics (e.g. in-memory segment of the segmented index)
+        """
+        if tf_weighting not in TF_WEIGHTINGS:
+            raise ValueError(f'Unknown tf weighting {tf_weighting}, expected one of {TF_WEIGHTINGS}')
+        super().__init__()
+        self.drop_tokens = drop_tokens
+        self.tf_weighting = tf_weighting
+        self.total_doc_length = 0  # total number of tokens of the documents in the index
+        self.documents = []  # indexed document for each position, deleted documents are replaced with None
+        self.doc_ids = np.empty(0, dtype=np.int64)  # document id for each position in doc_norms
+        # L2 norm of the tf-idf vector of each document, kept in float64 so a document matched against itself
+        # does not score above 1
+        self.doc_norms = np.empty(0, dtype=np.float64)
+        self.calculate_norms = calculate_norms
+        self.doc_id_to_idx = {}  # document id -> position in doc_ids and doc_norms (only documents in the index)
+        self.generation = 0  # incremented with every update of the index
+
+    @property
+    def total_docs(self):
+        return len(self.doc_id_to_idx)
+
+    def add_documents(self, documents: List[Document]):
+        """
+        Adds documents to the index. Only postings of the terms of the added documents are updated
+        :param documents: documents to add, their ids must not be in the index already
+        :return:
+        """
+        if len(documents) == 0:
+            return
+
+        new_doc_ids = np.fromiter((document.doc_id for document in documents), dtype=np.int64, count=len(documents))
+        for doc_id in new_doc_ids.tolist():
+            if doc_id in self.doc_id_to_idx:
+                raise ValueError(f'Document with id {doc_id} is already indexed')
+        if len(set(new_doc_ids.tolist())) != len(new_doc_ids):
+            raise ValueError('Added documents must have unique ids')
+
+        # Bags of words of all documents are gathered into posting arrays, so the weights are calculated at once
+        posting_doc_idxs, posting_term_ids, posting_tfs = get_bows(documents)
+        doc_lengths = np.bincount(posting_doc_idxs, weights=posting_tfs, minlength=len(documents))
+        doc_max_tfs = np.zeros(len(documents), dtype=posting_tfs.dtype)
+        np.maximum.at(doc_max_tfs, posting_doc_idxs, posting_tfs)
+        self.total_doc_length += int(doc_lengths.sum())
+        avg_doc_length = self.total_doc_length / (self.total_docs + len(documents))
+        posting_tf_weights = get_tf_weights(posting_tfs, doc_max_tfs[posting_doc_idxs],
+                                            doc_lengths[posting_doc_idxs], avg_doc_length, self.tf_weighting)
+
+        for document in documents:
+            self.doc_id_to_idx[document.doc_id] = len(self.documents)
+            self.documents.append(document)
+
+        # Postings are grouped by term (ordered by document position within the term), so the postings of each
+        # term are added at once
+        order = np.argsort(posting_term_ids, kind='stable')
+        posting_doc_idxs, posting_tf_weights = posting_doc_idxs[order], posting_tf_weights[order]
+        term_ids, term_starts, term_dfs = np.unique(posting_term_ids[order], return_index=True, return_counts=True)
+        terms, term_ends = vocabulary.get_terms(term_ids), (term_starts + term_dfs).tolist()
+        posting_doc_ids = new_doc_ids[posting_doc_idxs].tolist()
+        posting_tf_weight_list = posting_tf_weights.tolist()
+        posting_tfs = posting_tfs[order].tolist()
+        # Postings do not form reference cycles, so the garbage collection is paused while they are created
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            for term, start, end in zip(terms, term_starts.tolist(), term_ends):
+                term_stats = self.get(term)
+                if term_stats is None:
+                    term_stats = self[term] = TermStats(posting_doc_ids[start], term, posting_tfs[start],
+                                                        posting_tf_weight_list[start])
+                    start += 1
+                term_stats.add_postings(posting_doc_ids[start:end], posting_tfs[start:end],
+                                        posting_tf_weight_list[start:end])
+        finally:
+            if gc_enabled:
+                gc.enable()
+
+        if self.drop_tokens:
+            for document in documents:
+                document.drop_tokens()
+
+        self.generation += 1
+        self.doc_ids = np.concatenate([self.doc_ids, new_doc_ids])
+        self.doc_norms = np.concatenate([self.doc_norms, np.zeros(len(documents), dtype=np.float64)])
+        # Idf of the terms changed, so the norms of all documents are recalculated
+        if self.calculate_norms:
+            self.calculate_document_norms()
+
+    def delete_documents(self, doc_ids: List[int]):
+        """
+        Deletes documents from the index. Positions of the deleted documents are kept (as tombstones),
+        so positions of the other documents do not change
+        :param doc_ids: ids of the documents to delete, they must be in the index
+        :return:
+        """
+        # All ids are validated before the index is changed, so a failed deletion does not leave it half updated
+        for doc_id in doc_ids:
+            if doc_id not in self.doc_id_to_idx:
+                raise ValueError(f'Document with id {doc_id} is not indexed')
+        if len(set(doc_ids)) != len(doc_ids):
+            raise ValueError('Deleted documents must have unique ids')
+
+        for doc_id in doc_ids:
+            idx = self.doc_id_to_idx.pop(doc_id)
+            document = self.documents[idx]
+            document_bow = document.bow
+            self.total_doc_length -= sum(document_bow.values())
+            for term in document_bow.keys():
+                term_stats = self[term]
+                term_stats.remove_document_stats(doc_id)
+                if term_stats.df == 0:
+                    del self[term]
+
+            self.documents[idx] = None
+            self.doc_norms[idx] = 0
+
+        self.generation += 1
+        if self.calculate_norms:
+            self.calculate_document_norms()
+
+    def calculate_document_norms(self):
+        """
+        Calculates L2 norm of the tf-idf vector of each document in the index. Weights of all postings are
+        gathered into arrays, so the idf of each term is calculated only once
+        :return:
+        """
+        get_doc_idx, get_tf_weight = self.doc_id_to_idx.__getitem__, attrgetter('tf_weight')
+        posting_doc_idxs, posting_weights = [], []
+        for term_stats in self.values():
+            postings = term_stats.documents
+            posting_doc_idxs.append(np.fromiter(map(get_doc_idx, postings), dtype=np.int64, count=len(postings)))
+            posting_weights.append(np.fromiter(map(get_tf_weight, postings.values()), dtype=np.float64,
+                                               count=len(postings)) * term_stats.get_idf(self.total_docs))
+
+        squared_sums = np.bincount(np.concatenate(posting_doc_idxs + [np.empty(0, dtype=np.int64)]),
+                                   weights=np.concatenate(posting_weights + [np.empty(0)]) ** 2,
+                                   minlength=len(self.documents))
+        self.doc_norms = np.sqrt(squared_sums)
+
+    def get_df(self, term) -> int:
+        return self[term].df
+
+    def get_idf(self, term) -> float:
+        return self[term].get_idf(self.total_docs)
+
+    def get_document_norm(self, doc_id) -> float:
+        """
+        Returns L2 norm of the document vector
+        :param doc_id: id of the document
+        :return: norm of the document vector
+        """
+        return self.doc_norms[self.doc_id_to_idx[doc_id]]
+
+
+def create_inverted_tfidf_idx(documents: List[Document], drop_tokens=False, tf_weighting='log') -> InvertedIndex:
     """
-    Creates an inverse index of the documents with calculated tfidf for each term-document pair
+    Creates an inverse index of the documents. Tf-idf of each term-document pair is obtained from
+    the term frequency weight stored in the postings and idf of the term
+    :param documents: documents to index
+    :param drop_tokens: if True, tokens of the documents are dropped once their postings are created
+    :param tf_weighting: term frequency weighting scheme, one of TF_WEIGHTINGS
     """
 
     # Create a dictionary of terms and their stats
-    inverted_idx = {}
-    for document in documents:
-        # Get (initialize) bow for the document
-        bow = document.bow
-        for term, occurrences in bow.items():
-            if term not in inverted_idx:
-                inverted_idx[term] = TermStats(document, term, occurrences)
-            else:
-                inverted_idx[term].add_document_stats(document, occurrences)
-
-    # Now that we have the inverted index, we can calculate the tf-idf for each term
-    total_docs = len(documents)
-    for term in inverted_idx:
-        inverted_idx[term].calculate_tf_idf(total_docs)
+    # Norms of the document vectors are calculated when the documents are added, they do not change until
+    # the index is updated
+    inverted_idx = InvertedIndex(drop_tokens=drop_tokens, tf_weighting=tf_weighting)
+    inverted_idx.add_documents(documents)
 
     return inverted_idx
+
+
+def save_inverted_idx(inverted_idx: InvertedIndex, file_path):
+    """
+    Saves the inverted index (including the document norms) to a file
+    :param inverted_idx: inverted index
+    :param file_path: path to the file
+    :return:
+    """
+    with open(file_path, 'wb') as f:
+        pickle.dump(inverted_idx, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def load_inverted_idx(file_path) -> InvertedIndex:
+    """
+    Loads the inverted index (including the document norms) saved via save_inverted_idx
+    :param file_path: path to the file
+    :return: inverted index
+    """
+    with open(file_path, 'rb') as f:
+        return pickle.load(f)
@@ -0,0 +1,53 @@
+# Module for interning the terms of the documents
+# Each distinct term is stored once and mapped to a dense int32 id, documents store arrays of these ids instead
+# of lists of strings. Ids are only valid within the process, documents are pickled with their terms
+import threading
+from typing import Iterable, List
+
+import numpy as np
+
+
+class Vocabulary:
+    """
+    Mapping of terms to dense integer ids, ids are assigned in the order in which the terms were added
+    """
+
+    def __init__(self):
+        self.terms = []
+        self.term_to_id = {}
+        # Documents can be created from several threads at once (e.g. API requests)
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.terms)
+
+    def __contains__(self, term):
+        return term in self.term_to_id
+
+    def add_terms(self, terms: Iterable[str]) -> np.ndarray:
+        """
+        Returns ids of the terms, terms which are not in the vocabulary yet are added
+        :param terms: terms, e.g. tokens of the document
+        :return: int32 array of the term ids
+        """
+        term_to_id = self.term_to_id
+        with self.lock:
+            term_ids = []
+            for term in terms:
+                term_id = term_to_id.get(term)
+                if term_id is None:
+                    term_id = term_to_id[term] = len(self.terms)
+                    self.terms.append(term)
+                term_ids.append(term_id)
+        return np.array(term_ids, dtype=np.int32)
+
+    def get_terms(self, term_ids: np.ndarray) -> List[str]:
+        """
+        Returns terms of the term ids
+        """
+        terms = self.terms
+        return [terms[term_id] for term_id in np.asarray(term_ids).tolist()]
+
+
+# Vocabulary shared by all documents
+vocabulary = Vocabulary()
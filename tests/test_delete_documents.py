@@ -0,0 +1,38 @@
+import pytest
+
+from src.cosine_similarity import build_cos_similarity_model
+from src.document import Document
+from src.preprocessing.whitespace_preprocessor import SplitPreprocessor
+from src.tf_idf import create_inverted_tfidf_idx
+
+TEXTS = ['tropical fish live in the sea', 'fish and chips', 'the sea is deep', 'tropical island in the sea']
+
+
+def create_documents():
+    return [Document(doc_id, text.split()) for doc_id, text in enumerate(TEXTS)]
+
+
+@pytest.mark.parametrize('doc_ids', [[1, 1], [1, 5]])
+def test_invalid_deletion_does_not_change_inverted_index(doc_ids):
+    inverted_idx = create_inverted_tfidf_idx(create_documents())
+    total_docs, total_doc_length = inverted_idx.total_docs, inverted_idx.total_doc_length
+
+    with pytest.raises(ValueError):
+        inverted_idx.delete_documents(doc_ids)
+
+    assert inverted_idx.total_docs == total_docs
+    assert inverted_idx.total_doc_length == total_doc_length
+    assert inverted_idx.get_df('fish') == 2
+
+
+@pytest.mark.parametrize('doc_ids', [[1, 1], [1, 5]])
+def test_invalid_deletion_does_not_break_search(doc_ids):
+    model = build_cos_similarity_model(create_documents(), SplitPreprocessor())
+    expected_results = model.get_top_n_documents('fish sea', 10)
+
+    with pytest.raises(ValueError):
+        model.delete_documents(doc_ids)
+
+    assert model.get_top_n_documents('fish sea', 10) == expected_results
+    model.delete_documents([1])
+    assert [document.doc_id for _, document in model.get_top_n_documents('fish', 10)] == [0]
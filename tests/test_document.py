@@ -0,0 +1,15 @@
+from src.document import Document, get_bows
+from src.vocabulary import vocabulary
+
+
+def test_get_bows_while_vocabulary_grows(monkeypatch):
+    documents = [Document(0, ['a', 'b', 'a']), Document(1, ['c'])]
+    vocabulary_len = vocabulary.__class__.__len__
+    sizes = iter(range(len(vocabulary), len(vocabulary) + 10))
+
+    # Each read of the size sees the vocabulary grown by another thread
+    monkeypatch.setattr(vocabulary.__class__, '__len__', lambda self: max(next(sizes), vocabulary_len(self)))
+    posting_doc_idxs, posting_term_ids, posting_tfs = get_bows(documents)
+
+    postings = set(zip(posting_doc_idxs.tolist(), vocabulary.get_terms(posting_term_ids), posting_tfs.tolist()))
+    assert postings == {(0, 'a', 2), (0, 'b', 1), (1, 'c', 1)}
@@ -0,0 +1,21 @@
+from datetime import datetime
+
+from src.metacritic_review_do import MetacriticReviewDocument
+from src.preprocessing.metacritic_preprocessing import deserialize_preprocessed_reviews, \
+    serialize_preprocessed_reviews
+from src.preprocessing.preprocessed_corpus import load_preprocessed_corpus, save_preprocessed_corpus
+
+
+def test_corpus_formats_load_the_same_dates(tmp_path):
+    documents = [MetacriticReviewDocument(0, ['great', 'game'], 'Zelda', 'bob', datetime(2017, 3, 3), 10.0,
+                                          'Great game', True),
+                 MetacriticReviewDocument(1, ['boring'], 'Zelda', 'alice', None, 2.0, 'Boring', False)]
+    serialize_preprocessed_reviews(documents, str(tmp_path / 'reviews.json'))
+    save_preprocessed_corpus(documents, str(tmp_path / 'corpus'))
+
+    json_documents = deserialize_preprocessed_reviews(str(tmp_path / 'reviews.json'))
+    corpus = load_preprocessed_corpus(str(tmp_path / 'corpus'))
+    expected_dates = [document.dateReviewed for document in json_documents]
+    assert expected_dates == ['2017-03-03 00:00:00', None]
+    assert [document.dateReviewed for document in corpus] == expected_dates
+    assert [corpus[idx].dateReviewed for idx in range(len(corpus))] == expected_dates
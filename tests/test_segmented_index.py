@@ -0,0 +1,57 @@
+import pytest
+
+from src.cosine_similarity import build_cos_similarity_model, build_segmented_cos_similarity_model
+from src.doc_id_service import doc_id_service
+from src.document import Document
+from src.preprocessing.whitespace_preprocessor import SplitPreprocessor
+from src.segmented_index import SegmentedIndex
+
+TEXTS = ['tropical fish live in the sea', 'fish and chips', 'the sea is deep', 'tropical island in the sea']
+
+
+def create_documents(first_doc_id=0):
+    return [Document(first_doc_id + i, text.split()) for i, text in enumerate(TEXTS)]
+
+
+@pytest.mark.parametrize('doc_ids', [[100, 100], [100, 5]])
+def test_invalid_deletion_does_not_change_statistics(tmp_path, doc_ids):
+    segmented_idx = SegmentedIndex(str(tmp_path), seal_threshold=2, background=False)
+    segmented_idx.add_documents(create_documents(100))
+    total_docs, global_df = segmented_idx.total_docs, dict(segmented_idx.global_df)
+
+    with pytest.raises(ValueError):
+        segmented_idx.delete_documents(doc_ids)
+
+    assert segmented_idx.total_docs == total_docs
+    assert segmented_idx.global_df == global_df
+    segmented_idx.close()
+
+
+def test_memory_segment_scores_match_inverted_index(tmp_path):
+    documents = create_documents()
+    model = build_cos_similarity_model(documents, SplitPreprocessor())
+    segmented_model = build_segmented_cos_similarity_model(str(tmp_path), SplitPreprocessor(), documents[:2])
+    segmented_model.add_documents(documents[2:])
+    for cos_sim_model in [model, segmented_model]:
+        cos_sim_model.delete_documents([1])
+
+    for query in ['tropical sea', 'fish', 'the sea is deep']:
+        expected_results = model.get_top_n_documents(query, 10)
+        results = segmented_model.get_top_n_documents(query, 10)
+        assert [document.doc_id for _, document in results] == [document.doc_id for _, document in expected_results]
+        assert [score for score, _ in results] == pytest.approx([score for score, _ in expected_results])
+        assert all(score <= 1.0 for score, _ in results)
+    segmented_model.tf_idf_inverted_idx.close()
+
+
+def test_reopened_index_does_not_reuse_doc_ids(tmp_path, monkeypatch):
+    segmented_idx = SegmentedIndex(str(tmp_path), background=False)
+    segmented_idx.add_documents([Document(doc_id_service.get_id(), text.split()) for text in TEXTS])
+    segmented_idx.close()
+
+    # Process serving the reopened index counts the ids from the start
+    monkeypatch.setattr(doc_id_service, 'counter', -1)
+    segmented_model = build_segmented_cos_similarity_model(str(tmp_path), SplitPreprocessor())
+    segmented_model.add_documents([Document(doc_id_service.get_id(), ['fish'])])
+    assert segmented_model.total_docs == len(TEXTS) + 1
+    segmented_model.tf_idf_inverted_idx.close()
@@ -0,0 +1,44 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from src.cosine_similarity import build_cos_similarity_model
+from src.document import Document
+from src.preprocessing.whitespace_preprocessor import SplitPreprocessor
+from src.sharded_index import ShardWorkerError
+
+TEXTS = ['tropical fish live in the sea', 'fish and chips', 'the sea is deep', 'tropical island in the sea',
+         'deep sea fish', 'island of fish']
+QUERIES = ['tropical sea', 'fish', 'deep island', 'sea fish chips']
+
+
+def get_doc_ids(results):
+    return [document.doc_id for _, document in results]
+
+
+@pytest.fixture
+def sharded_model():
+    documents = [Document(doc_id, text.split()) for doc_id, text in enumerate(TEXTS)]
+    model = build_cos_similarity_model(documents, SplitPreprocessor(), shards=2)
+    yield model
+    model.tf_idf_inverted_idx.close()
+
+
+def test_concurrent_queries(sharded_model):
+    expected_results = {query: get_doc_ids(sharded_model.get_top_n_documents(query, 3)) for query in QUERIES}
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(lambda query: (query, sharded_model.get_top_n_documents(query, 3)),
+                                    QUERIES * 50))
+
+    for query, query_results in results:
+        assert get_doc_ids(query_results) == expected_results[query]
+
+
+def test_failed_worker_does_not_mix_replies(sharded_model):
+    sharded_model.tf_idf_inverted_idx.workers[0].kill()
+    sharded_model.tf_idf_inverted_idx.workers[0].join()
+
+    for query in QUERIES:
+        with pytest.raises(ShardWorkerError):
+            sharded_model.get_top_n_documents(query, 3)